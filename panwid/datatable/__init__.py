@@ -1,8 +1,21 @@
 from .datatable import *
 from .dataframe import *
+from .filters import *
+from .sql import *
+from .frame import *
+from .arrow import *
 
 __all__ = """
 DataTable
 DataTableColumn
 DataTableDataFrame
+DataTableFilter
+EqualsFilter
+IsInFilter
+RangeFilter
+SubstringFilter
+SQLDataTable
+SQLiteDataTable
+ArrayDataTable
+ArrowDataTable
 """.split()
@@ -0,0 +1,199 @@
+import logging
+logger = logging.getLogger("panwid.datatable")
+from bisect import bisect_right
+
+from .filters import *
+from .frame import *
+
+# imported by import_arrow() when a source is opened
+pa = None
+pc = None
+
+
+def import_arrow():
+    """Import pyarrow and its compute functions."""
+    global pa, pc
+    if pa is not None:
+        return
+    try:
+        import pyarrow
+        import pyarrow.compute
+    except ImportError:
+        raise Exception("pyarrow is required for Arrow data sources")
+    pa, pc = pyarrow, pyarrow.compute
+
+
+class ArrowSource(DataSource):
+    """
+    Memory-mapped Arrow IPC (Feather v2) file.  Opening it only reads the
+    schema and record batch metadata; pages are read from the batches they
+    fall in, and only for the columns asked for, so memory use follows what
+    is on screen rather than the size of the file.
+    """
+
+    def __init__(self, path, index=None):
+
+        import_arrow()
+        self.path = path
+        self.index = index
+        self.file = pa.memory_map(path, "r")
+        self.reader = pa.ipc.open_file(self.file)
+        self.schema = self.reader.schema
+        self.offsets = [0]
+        for i in range(self.reader.num_record_batches):
+            self.offsets.append(self.offsets[-1] + self.reader.get_batch(i).num_rows)
+        self.arrays = dict()
+
+    def __len__(self):
+        return self.offsets[-1]
+
+    @property
+    def columns(self):
+        columns = list(self.schema.names)
+        if self.index not in columns:
+            columns.insert(0, self.index)
+        return columns
+
+    def is_position_index(self, name):
+        return name == self.index and name not in self.schema.names
+
+    def column(self, name):
+        """Return a whole column as a ChunkedArray over the mapped batches."""
+        try:
+            return self.arrays[name]
+        except KeyError:
+            pass
+        if self.is_position_index(name):
+            values = pa.chunked_array([pa.array(range(len(self)), type=pa.int64())])
+        else:
+            i = self.schema.get_field_index(name)
+            values = pa.chunked_array(
+                [ self.reader.get_batch(b).column(i)
+                  for b in range(self.reader.num_record_batches) ],
+                type=self.schema.field(i).type
+            )
+        self.arrays[name] = values
+        return values
+
+    def read_range(self, name, start, stop):
+        """Read rows ``start`` to ``stop`` of a column from the batches holding them."""
+        if self.is_position_index(name):
+            return list(range(start, stop))
+        i = self.schema.get_field_index(name)
+        values = []
+        b = bisect_right(self.offsets, start) - 1
+        while start < stop and b < self.reader.num_record_batches:
+            offset = self.offsets[b]
+            end = min(stop, self.offsets[b+1])
+            values.extend(self.reader.get_batch(b).column(i)
+                          .slice(start - offset, end - start).to_pylist())
+            start = end
+            b += 1
+        return values
+
+    def rows(self, positions, columns):
+        columns = [ c for c in columns if self.has_column(c) ]
+        if isinstance(positions, range):
+            values = [ self.read_range(c, positions.start, positions.stop)
+                       for c in columns ]
+        else:
+            values = [ positions.to_pylist() if self.is_position_index(c)
+                       else self.column(c).take(positions).to_pylist()
+                       for c in columns ]
+        return [ dict(zip(columns, row)) for row in zip(*values) ]
+
+    @property
+    def mask_errors(self):
+        return (pa.ArrowException, TypeError, ValueError)
+
+    def filter_mask(self, f):
+        return pc.fill_null(super(ArrowSource, self).filter_mask(f), False)
+
+    def compute_mask(self, f, values):
+        if isinstance(f, EqualsFilter):
+            if f.value is None:
+                return pc.is_null(values)
+            return pc.equal(values, pa.scalar(f.value, type=values.type))
+        elif isinstance(f, IsInFilter):
+            mask = pc.is_in(values, value_set=pa.array(
+                [ v for v in f.values if v is not None ], type=values.type))
+            if None in f.values:
+                mask = pc.or_(mask, pc.is_null(values))
+            return mask
+        elif isinstance(f, RangeFilter):
+            mask = pc.is_valid(values)
+            for bound, op in [
+                    (f.lower, pc.greater_equal if f.include_lower else pc.greater),
+                    (f.upper, pc.less_equal if f.include_upper else pc.less)]:
+                if bound is not None:
+                    mask = pc.and_(mask, op(values, pa.scalar(bound, type=values.type)))
+            return mask
+        elif isinstance(f, SubstringFilter) and (
+                pa.types.is_string(values.type) or pa.types.is_large_string(values.type)):
+            return pc.match_substring(values, f.text, ignore_case=not f.case_sensitive)
+        return None
+
+    def make_mask(self, values):
+        return pa.array(values, type=pa.bool_())
+
+    def and_masks(self, a, b):
+        return pc.and_(a, b)
+
+    def nonzero(self, mask):
+        return pc.indices_nonzero(mask)
+
+    def take(self, values, positions):
+        return values.take(positions)
+
+    def to_list(self, values):
+        return values.to_pylist()
+
+    def sort_order(self, values, reverse=False):
+        # a stable sort in either direction, so equal values stay in
+        # position order
+        return pc.array_sort_indices(
+            values,
+            order="descending" if reverse else "ascending",
+            null_placement="at_start" if reverse else "at_end"
+        )
+
+    def page(self, positions, start=0, stop=None):
+        if positions is None:
+            return range(start, min(len(self), stop) if stop is not None else len(self))
+        stop = len(positions) if stop is None else min(stop, len(positions))
+        return positions.slice(start, max(stop - start, 0))
+
+    def close(self):
+        """Release the memory map.  The source can't be read after this."""
+        self.arrays = dict()
+        self._selection = None
+        self.reader = None
+        self.file.close()
+
+
+class ArrowDataTable(ArrayDataTable):
+    """
+    DataTable viewing an Arrow IPC (Feather v2) file through a memory map:
+
+        ArrowDataTable("dump.arrow", columns=[...])
+
+    Only the table's columns are read, a page at a time with at most
+    max_pages kept, and the row count comes from the file's batch metadata.  close() releases the file, or the
+    table can be used as a context manager.
+    """
+
+    def __init__(self, path=None, *args, **kwargs):
+        super(ArrowDataTable, self).__init__(
+            ArrowSource(path, kwargs.get("index") or self.index)
+            if path is not None else None,
+            *args, **kwargs
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+__all__ = ["ArrowSource", "ArrowDataTable"]
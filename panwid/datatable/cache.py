@@ -0,0 +1,123 @@
+import logging
+logger = logging.getLogger("panwid.datatable")
+from collections import OrderedDict
+import contextlib
+import pickle
+import sqlite3
+import time
+
+
+def query_key(kwargs):
+    """Return a hashable key for a set of query() arguments."""
+    def freeze(value):
+        if isinstance(value, (list, tuple)):
+            return tuple(freeze(v) for v in value)
+        if isinstance(value, dict):
+            return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+        return value
+    return freeze(kwargs)
+
+
+class QueryPageCache(object):
+    """
+    Least-recently-used cache of query() results keyed by the arguments they
+    were queried with -- sort order, offset, limit -- so going back to a
+    recent sort order or page doesn't hit the backend again.
+    """
+
+    def __init__(self, max_size=32):
+
+        self.max_size = max_size
+        self.pages = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.pages)
+
+    def __contains__(self, kwargs):
+        return query_key(kwargs) in self.pages
+
+    def get(self, kwargs):
+        key = query_key(kwargs)
+        try:
+            rows = self.pages.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self.pages[key] = rows
+        self.hits += 1
+        return rows
+
+    def put(self, kwargs, rows):
+        key = query_key(kwargs)
+        self.pages.pop(key, None)
+        self.pages[key] = rows
+        while len(self.pages) > self.max_size:
+            self.pages.popitem(last=False)
+        return rows
+
+    def clear(self):
+        self.pages = OrderedDict()
+
+
+class PersistentQueryCache(object):
+    """
+    Query results saved to a SQLite file under a caller-chosen key, so a
+    table can show the last results it got as soon as it starts.  Every call
+    uses its own connection, so the cache can be written from worker threads.
+
+    Rows are stored pickled, so they can hold any picklable values, and
+    loading them can run arbitrary code: only point ``path`` at a file no
+    one else can write to.
+    """
+
+    def __init__(self, path, key=""):
+
+        self.path = path
+        self.key = key
+        with self.connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                "cache_key TEXT, query TEXT, rows BLOB, updated REAL, "
+                "PRIMARY KEY (cache_key, query))"
+            )
+
+    @contextlib.contextmanager
+    def connect(self):
+        db = sqlite3.connect(self.path)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def get(self, kwargs):
+        with self.connect() as db:
+            result = db.execute(
+                "SELECT rows FROM pages WHERE cache_key = ? AND query = ?",
+                (self.key, repr(query_key(kwargs)))
+            ).fetchone()
+        if result is None:
+            return None
+        try:
+            return pickle.loads(result[0])
+        except Exception as e:
+            logger.warning("discarding unreadable cached query: %s" %(e))
+            return None
+
+    def put(self, kwargs, rows):
+        with self.connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)",
+                (self.key, repr(query_key(kwargs)),
+                 pickle.dumps(list(rows), pickle.HIGHEST_PROTOCOL), time.time())
+            )
+        return rows
+
+    def clear(self):
+        with self.connect() as db:
+            db.execute("DELETE FROM pages WHERE cache_key = ?", (self.key,))
+
+
+__all__ = ["query_key", "QueryPageCache", "PersistentQueryCache"]
@@ -150,6 +150,7 @@ class DataTableHeaderCell(DataTableCell):
 
     ASCENDING_SORT_MARKER = u"\N{UPWARDS ARROW}"
     DESCENDING_SORT_MARKER = u"\N{DOWNWARDS ARROW}"
+    PENDING_SORT_MARKER = u"\N{HORIZONTAL ELLIPSIS}"
 
     # def __init__(self, table, column, sort=None, sort_icon=None, *args, **kwargs):
     def update_contents(self):
@@ -175,7 +176,7 @@ class DataTableHeaderCell(DataTableCell):
                     (urwid.Text(""), self.columns.options("given", 1))
                 )
         self.contents = self.columns
-        self.update_sort(self.table.sort_by)
+        self.update_sort(self.table.multi_sort_by or self.table.sort_by)
 
     def set_attr_maps(self):
 
@@ -201,15 +202,29 @@ class DataTableHeaderCell(DataTableCell):
         if event == 'mouse press':
             urwid.emit_signal(self, "click", self)
 
-    def update_sort(self, sort):
+    def update_sort(self, sort, pending=False):
         if not self.sort_icon: return
 
         index = 0 if self.column.align=="right" else 1
-        if sort and sort[0] == self.column.name:
-            direction = self.DESCENDING_SORT_MARKER if sort[1] else self.ASCENDING_SORT_MARKER
-            self.columns.contents[index][0].set_text(direction)
-        else:
-            self.columns.contents[index][0].set_text("")
+        # a list of (column, reverse) tuples means a multi-column sort, and
+        # each column's marker is followed by its priority
+        sorts = sort if isinstance(sort, list) else [sort]
+        marker = ""
+        for priority, s in enumerate(sorts):
+            if not s or s[0] != self.column.name:
+                continue
+            if pending and priority == 0:
+                marker = self.PENDING_SORT_MARKER
+            else:
+                marker = self.DESCENDING_SORT_MARKER if s[1] else self.ASCENDING_SORT_MARKER
+            if len(sorts) > 1:
+                marker += str(priority+1)
+            break
+        text, options = self.columns.contents[index]
+        text.set_text(marker)
+        self.columns.contents[index] = (
+            text, self.columns.options("given", max(len(marker), 1))
+        )
 
 class DataTableFooterCell(DataTableCell):
 
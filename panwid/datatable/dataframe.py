@@ -1,14 +1,556 @@
 import logging
 logger = logging.getLogger("panwid.datatable")
 import raccoon as rc
+from raccoon.sort_utils import sorted_list_indexes
 import collections
+try:
+    from collections.abc import MutableSequence
+except ImportError:
+    from collections import MutableSequence
+from array import array
+from itertools import compress
+import heapq
+import re
+import locale
+from datetime import datetime, date, timedelta, timezone
+from decimal import Decimal
+from blist import blist
+
+from .indexes import *
+from .filters import *
+
+EPOCH = datetime(1970, 1, 1)
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+TRUE_STRINGS = ["1", "t", "true", "y", "yes", "on"]
+
+DATETIME_FORMATS = [
+    "%Y-%m-%d %H:%M:%S.%f",
+    "%Y-%m-%dT%H:%M:%S.%f",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%d",
+]
+
+# bytes.translate() table that flips a 0/1 null mask into a 1/0 presence mask
+INVERT_MASK = bytes(bytearray([1, 0] + [0]*254))
+
+DTYPES = ["int", "float", "decimal", "datetime", "date", "bool", "str", "category"]
+
+DTYPE_ALIASES = {
+    int: "int",
+    float: "float",
+    Decimal: "decimal",
+    datetime: "datetime",
+    date: "date",
+    bool: "bool",
+    str: "str",
+}
+
+def normalize_dtype(dtype):
+    if dtype is None:
+        return None
+    dtype = DTYPE_ALIASES.get(dtype, dtype)
+    if dtype not in DTYPES:
+        raise Exception("dtype %s not supported" %(dtype))
+    return dtype
+
+def null_sort_key(x):
+    return (x is None, x)
+
+NATURAL_SPLIT_RE = re.compile(r"(\d+)")
+
+def natural_key(s):
+    # Splitting on digit runs alternates text and numbers, so any two keys
+    # compare text with text and numbers with numbers
+    return tuple(int(p) if i % 2 else p.casefold()
+                 for i, p in enumerate(NATURAL_SPLIT_RE.split(s)))
+
+COLLATIONS = {
+    "casefold": str.casefold,
+    "natural": natural_key,
+    "locale": locale.strxfrm,
+}
+
+def normalize_collation(collation):
+    if collation is not None and collation not in COLLATIONS:
+        raise Exception("collation %s not supported" %(collation))
+    return collation
+
+def coerce_bool(v):
+    if isinstance(v, str):
+        return v.strip().lower() in TRUE_STRINGS
+    return bool(v)
+
+def coerce_decimal(v):
+    if isinstance(v, float):
+        v = repr(v)
+    return v if isinstance(v, Decimal) else Decimal(v)
+
+def parse_datetime(s):
+    for fmt in DATETIME_FORMATS:
+        try:
+            return datetime.strptime(s, fmt)
+        except ValueError:
+            continue
+    raise ValueError("invalid datetime: %s" %(s))
+
+def coerce_datetime(v):
+    if isinstance(v, datetime):
+        return v
+    elif isinstance(v, date):
+        return datetime.combine(v, datetime.min.time())
+    elif isinstance(v, str):
+        return parse_datetime(v)
+    return datetime.fromtimestamp(v)
+
+def coerce_date(v):
+    if isinstance(v, datetime):
+        return v.date()
+    elif isinstance(v, date):
+        return v
+    elif isinstance(v, str):
+        return parse_datetime(v).date()
+    return date.fromordinal(v)
+
+def encode_datetime(v):
+    if v.tzinfo is not None:
+        v = v.replace(tzinfo=None) - v.utcoffset()
+    return (v - EPOCH) // ONE_MICROSECOND
+
+def decode_datetime(v):
+    return EPOCH + timedelta(microseconds=v)
+
+# dtype: (array typecode, coerce, encode, decode)
+DTYPE_CODECS = {
+    "int": ("q", int, None, None),
+    "float": ("d", float, None, None),
+    "bool": ("b", coerce_bool, int, bool),
+    "datetime": ("q", coerce_datetime, encode_datetime, decode_datetime),
+    "date": ("i", coerce_date, date.toordinal, date.fromordinal),
+    "decimal": (None, coerce_decimal, None, None),
+    "str": (None, str, None, None),
+    "category": (None, None, None, None),
+}
+
+
+class ColumnData(MutableSequence):
+    """
+    List-like storage for a typed DataTableDataFrame column.  Values are
+    coerced to the column's dtype on the way in, and sorting compares the
+    stored values directly instead of going through a generic key function.
+    """
+
+    def __init__(self, dtype, values=None):
+
+        self.dtype = dtype
+        self._coerce = DTYPE_CODECS[dtype][1]
+        self._values = self._empty()
+        if values:
+            self.extend(values)
+
+    def _empty(self):
+        return []
+
+    def _store(self, v):
+        if v is None or self._coerce is None:
+            return v
+        return self._coerce(v)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __getitem__(self, i):
+        return self._values[i]
+
+    def __setitem__(self, i, v):
+        if isinstance(i, slice):
+            self._values[i] = [self._store(x) for x in v]
+        else:
+            self._values[i] = self._store(v)
+
+    def __delitem__(self, i):
+        del self._values[i]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __repr__(self):
+        return "%s(%s, %s)" %(self.__class__.__name__, self.dtype, list(self))
+
+    def insert(self, i, v):
+        self._values.insert(i, self._store(v))
+
+    def extend(self, values):
+        self._values.extend(self._store(v) for v in values)
+
+    def copy(self):
+        return self.take(range(len(self)))
+
+    def take(self, order):
+        """Return a new column with the values at the given positions."""
+        column = self.__class__(self.dtype)
+        column._values = self._empty()
+        column._values.extend(map(self._values.__getitem__, order))
+        return column
+
+    def null_positions(self):
+        return [i for i, v in enumerate(self._values) if v is None]
+
+    def _sort_values(self):
+        return self._values
+
+    def sort_order(self, reverse=False):
+        """
+        Return the positions of this column in sorted order.  Nulls sort
+        last, or first when reversed, matching ``(x is None, x)``.
+        """
+        key = self._sort_values().__getitem__
+        nulls = self.null_positions()
+        if not nulls:
+            return sorted(range(len(self)), key=key, reverse=reverse)
+        null_set = set(nulls)
+        order = sorted((i for i in range(len(self)) if i not in null_set),
+                       key=key, reverse=reverse)
+        return nulls + order if reverse else order + nulls
+
+
+class CollatedColumnData(ColumnData):
+    """
+    String column storage that keeps each value's collation key next to it.
+    Keys are computed when a value is stored, so sorting is a plain
+    comparison of the precomputed keys.
+    """
+
+    def __init__(self, dtype, values=None, collation="casefold"):
+
+        self.collation = collation
+        self._collate = COLLATIONS[collation]
+        self._keys = []
+        super(CollatedColumnData, self).__init__(dtype or "str", values)
+
+    def _key(self, v):
+        return None if v is None else self._collate(v)
+
+    def __setitem__(self, i, v):
+        if isinstance(i, slice):
+            values = [self._store(x) for x in v]
+            self._values[i] = values
+            self._keys[i] = [self._key(x) for x in values]
+        else:
+            v = self._store(v)
+            self._values[i] = v
+            self._keys[i] = self._key(v)
+
+    def __delitem__(self, i):
+        del self._values[i]
+        del self._keys[i]
+
+    def insert(self, i, v):
+        v = self._store(v)
+        self._values.insert(i, v)
+        self._keys.insert(i, self._key(v))
+
+    def extend(self, values):
+        values = [self._store(v) for v in values]
+        self._values.extend(values)
+        self._keys.extend(self._key(v) for v in values)
+
+    def take(self, order):
+        column = self.__class__(self.dtype, collation=self.collation)
+        column._values = [self._values[i] for i in order]
+        column._keys = [self._keys[i] for i in order]
+        return column
+
+    def collation_key(self, i):
+        return self._keys[i]
+
+    def _sort_values(self):
+        return self._keys
+
+
+class ArrayColumnData(ColumnData):
+    """
+    Compact column storage for fixed-width dtypes, keeping encoded values in
+    an ``array.array`` alongside a one byte per row null mask.
+    """
+
+    def __init__(self, dtype, values=None):
+
+        self._typecode, _, self._encode, self._decode = DTYPE_CODECS[dtype]
+        self._nulls = bytearray()
+        super(ArrayColumnData, self).__init__(dtype, values)
+
+    def _empty(self):
+        return array(self._typecode)
+
+    def _store(self, v):
+        v = self._coerce(v)
+        return self._encode(v) if self._encode else v
+
+    def _load(self, v):
+        return self._decode(v) if self._decode else v
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if self._nulls[i]:
+            return None
+        return self._load(self._values[i])
+
+    def __setitem__(self, i, v):
+        if isinstance(i, slice):
+            for j, x in zip(range(*i.indices(len(self))), v):
+                self[j] = x
+        elif v is None:
+            self._nulls[i] = 1
+            self._values[i] = 0
+        else:
+            self._values[i] = self._store(v)
+            self._nulls[i] = 0
+
+    def __delitem__(self, i):
+        del self._values[i]
+        del self._nulls[i]
+
+    def __iter__(self):
+        for v, null in zip(self._values, self._nulls):
+            yield None if null else self._load(v)
+
+    def insert(self, i, v):
+        if v is None:
+            self._values.insert(i, 0)
+            self._nulls.insert(i, 1)
+        else:
+            self._values.insert(i, self._store(v))
+            self._nulls.insert(i, 0)
+
+    def append(self, v):
+        self.insert(len(self), v)
+
+    def extend(self, values):
+        for v in values:
+            self.append(v)
+
+    def take(self, order):
+        order = list(order)
+        column = super(ArrayColumnData, self).take(order)
+        column._nulls = bytearray(map(self._nulls.__getitem__, order))
+        return column
+
+    def null_positions(self):
+        return list(compress(range(len(self)), self._nulls))
+
+    def sort_order(self, reverse=False):
+        if not any(self._nulls):
+            return sorted(range(len(self)), key=self._values.__getitem__,
+                          reverse=reverse)
+        nulls = self.null_positions()
+        order = sorted(
+            compress(range(len(self)), self._nulls.translate(INVERT_MASK)),
+            key=self._values.__getitem__, reverse=reverse)
+        return nulls + order if reverse else order + nulls
+
+
+class DatetimeColumnData(ArrayColumnData):
+    """
+    Datetime column storage.  Values are encoded as microseconds since the
+    epoch, in UTC for aware values, and each row also keeps a small code for
+    its time zone, numbered in order of first appearance, so aware values
+    come back in the zone they were stored in.  Code 0 is naive.
+    """
+
+    def __init__(self, dtype="datetime", values=None, zones=None):
+
+        self.zones = zones if zones is not None else [None]
+        self._zone_codes = dict()
+        self._zones = array("H")
+        super(DatetimeColumnData, self).__init__(dtype, values)
+
+    def _zone(self, v):
+        tz = v.tzinfo if isinstance(v, datetime) else None
+        if tz is None:
+            return 0
+        try:
+            return self._zone_codes[tz]
+        except KeyError:
+            code = self._zone_codes[tz] = len(self.zones)
+            self.zones.append(tz)
+            return code
+
+    def _localize(self, v, code):
+        if v is None or not code:
+            return v
+        return v.replace(tzinfo=timezone.utc).astimezone(self.zones[code])
+
+    def __getitem__(self, i):
+        v = super(DatetimeColumnData, self).__getitem__(i)
+        if isinstance(i, slice):
+            return v
+        return self._localize(v, self._zones[i])
+
+    def __setitem__(self, i, v):
+        super(DatetimeColumnData, self).__setitem__(i, v)
+        if not isinstance(i, slice):
+            self._zones[i] = self._zone(v)
+
+    def __delitem__(self, i):
+        super(DatetimeColumnData, self).__delitem__(i)
+        del self._zones[i]
+
+    def __iter__(self):
+        for v, code in zip(super(DatetimeColumnData, self).__iter__(), self._zones):
+            yield self._localize(v, code)
+
+    def insert(self, i, v):
+        super(DatetimeColumnData, self).insert(i, v)
+        self._zones.insert(i, self._zone(v))
+
+    def take(self, order):
+        order = list(order)
+        column = super(DatetimeColumnData, self).take(order)
+        column.zones = self.zones
+        column._zone_codes = self._zone_codes
+        column._zones = array("H", map(self._zones.__getitem__, order))
+        return column
+
+
+class CategoryDictionary(object):
+    """
+    The distinct values of a categorical column, numbered in order of first
+    appearance.  Code 0 is reserved for None.
+    """
+
+    def __init__(self):
+        self.values = [None]
+        self.codes = {None: 0}
+        self._ranks = None
+
+    def __len__(self):
+        return len(self.values)
+
+    def encode(self, v):
+        try:
+            return self.codes[v]
+        except KeyError:
+            code = len(self.values)
+            self.values.append(v)
+            self.codes[v] = code
+            self._ranks = None
+            return code
+
+    def ranks(self):
+        """
+        Return an array mapping each code to the rank of its value in sorted
+        order, with None ranked last.  Cached until a new value is added.
+        """
+        if self._ranks is None:
+            ranks = array("I", [len(self.values)-1]) * len(self.values)
+            order = sorted(range(1, len(self.values)), key=self.values.__getitem__)
+            for rank, code in enumerate(order):
+                ranks[code] = rank
+            self._ranks = ranks
+        return self._ranks
+
+
+class CategoricalColumnData(ColumnData):
+    """
+    Dictionary-encoded column storage for low-cardinality values.  Each row
+    holds an integer code in an ``array("I")``, and the dictionary of
+    distinct values is shared with every copy produced by take(), so
+    sorting and equality tests compare integers instead of values.
+    """
+
+    def __init__(self, dtype="category", values=None, categories=None):
+
+        self.categories = categories if categories is not None else CategoryDictionary()
+        super(CategoricalColumnData, self).__init__(dtype, values)
+
+    def _empty(self):
+        return array("I")
+
+    @property
+    def codes(self):
+        return self._values
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.categories.values[c] for c in self._values[i]]
+        return self.categories.values[self._values[i]]
+
+    def __setitem__(self, i, v):
+        if isinstance(i, slice):
+            self._values[i] = array("I", map(self.categories.encode, v))
+        else:
+            self._values[i] = self.categories.encode(v)
+
+    def __iter__(self):
+        return map(self.categories.values.__getitem__, self._values)
+
+    def insert(self, i, v):
+        self._values.insert(i, self.categories.encode(v))
+
+    def extend(self, values):
+        self._values.extend(map(self.categories.encode, values))
+
+    def take(self, order):
+        column = self.__class__(self.dtype, categories=self.categories)
+        column._values.extend(map(self._values.__getitem__, order))
+        return column
+
+    def null_positions(self):
+        return [i for i, code in enumerate(self._values) if not code]
+
+    def sort_order(self, reverse=False):
+        # Counting sort over the precomputed code ranks: O(n + k) and stable
+        ranks = self.categories.ranks()
+        buckets = [[] for _ in range(len(ranks))]
+        for i, code in enumerate(self._values):
+            buckets[ranks[code]].append(i)
+        if reverse:
+            buckets.reverse()
+        return [i for bucket in buckets for i in bucket]
+
+    def equals(self, value):
+        code = self.categories.codes.get(value)
+        if code is None:
+            return [False] * len(self)
+        return [c == code for c in self._values]
+
+    def isin(self, values):
+        codes = set(self.categories.codes[v] for v in values
+                    if v in self.categories.codes)
+        return [c in codes for c in self._values]
+
+
+def make_column_data(dtype, values=None, collation=None):
+    if collation:
+        if dtype not in (None, "str"):
+            raise Exception("collation not supported for %s columns" %(dtype))
+        return CollatedColumnData(dtype, values, collation)
+    elif dtype == "category":
+        return CategoricalColumnData(dtype, values)
+    elif dtype == "datetime":
+        return DatetimeColumnData(dtype, values)
+    elif DTYPE_CODECS[dtype][0]:
+        return ArrayColumnData(dtype, values)
+    return ColumnData(dtype, values)
+
 
 class DataTableDataFrame(rc.DataFrame):
 
     DATA_TABLE_COLUMNS = ["_dirty", "_focus_position", "_value_fn", "_rendered_row"]
 
-    def __init__(self, data=None, columns=None, index=None, index_name="index", use_blist=False, sort=None):
+    def __init__(self, data=None, columns=None, index=None, index_name="index",
+                 use_blist=False, sort=None, dtypes=None, collations=None,
+                 derived=None):
 
+        self._dtypes = dict()
+        self._derived = set(derived or [])
+        self._collations = dict()
+        self._secondary_indexes = dict()
+        self._positions = None
+        self._version = 0
         if columns and not index_name in columns:
             columns = [index_name] + columns
         super(DataTableDataFrame, self).__init__(
@@ -21,6 +563,471 @@ class DataTableDataFrame(rc.DataFrame):
         )
         for c in self.DATA_TABLE_COLUMNS:
             self[c] = None
+        for column, dtype in list((dtypes or {}).items()):
+            self.set_dtype(column, dtype)
+        for column, collation in list((collations or {}).items()):
+            self.set_collation(column, collation)
+
+    @property
+    def dtypes(self):
+        return dict(self._dtypes)
+
+    @property
+    def collations(self):
+        return dict(self._collations)
+
+    @property
+    def version(self):
+        """
+        Counter that changes whenever rows are added, removed, reordered or
+        have their data columns modified.  Writes to DataTable bookkeeping
+        columns and to derived columns don't change it.
+        """
+        return self._version
+
+    @property
+    def derived(self):
+        return set(self._derived)
+
+    def set_derived(self, columns):
+        """
+        Mark columns as derived from the others (e.g. calculated columns),
+        so writing their values doesn't change ``version``.  Whoever writes
+        them is responsible for invalidating anything that depends on them.
+        """
+        self._derived = set(columns)
+
+    def _touch(self, columns=None):
+        if columns is None or any(c not in self.DATA_TABLE_COLUMNS
+                                  and c not in self._derived for c in columns):
+            self._version += 1
+
+    def set_dtype(self, column, dtype):
+        """
+        Set the storage type of a column, converting any existing values.
+        Passing ``None`` reverts the column to untyped storage.
+        """
+        dtype = normalize_dtype(dtype)
+        if dtype:
+            self._dtypes[column] = dtype
+        else:
+            self._dtypes.pop(column, None)
+        self._restore(column)
+
+    def set_collation(self, column, collation):
+        """
+        Sort a string column by a collation key ("casefold", "natural" or
+        "locale") computed once per value.  ``None`` reverts to plain
+        string comparison.
+        """
+        collation = normalize_collation(collation)
+        if collation:
+            self._collations[column] = collation
+        else:
+            self._collations.pop(column, None)
+        self._restore(column)
+
+    def _make_column_data(self, column, values):
+        dtype = self._dtypes.get(column)
+        collation = self._collations.get(column)
+        if dtype or collation:
+            return make_column_data(dtype, values, collation)
+        return blist(values) if self._blist else list(values)
+
+    def _restore(self, column):
+        # Convert a column's existing values to its current storage type
+        if column not in self._columns:
+            return
+        c = self._columns.index(column)
+        if (isinstance(self._data[c], ColumnData)
+            or column in self._dtypes or column in self._collations):
+            self._data[c] = self._make_column_data(column, self._data[c])
+
+    def _position_map(self):
+        if self._positions is None:
+            self._positions = { x: i for i, x in enumerate(self._index) }
+        return self._positions
+
+    def has_index(self, index):
+        return index in self._position_map()
+
+    def index_position(self, index):
+        """
+        Return the position of the row with the given index value.  The
+        index-to-position map is cached until rows are added, removed or
+        reordered.
+        """
+        try:
+            return self._position_map()[index]
+        except KeyError:
+            raise ValueError("%s is not in index" %(index))
+
+    def add_secondary_index(self, column, kind="sorted"):
+        """
+        Maintain a secondary index of the given kind ("sorted" or "hash") on
+        a column, building it from the current data.
+        """
+        index = make_secondary_index(column, kind)
+        if column in self._columns:
+            index.build(self._data[self._columns.index(column)], self._index)
+        else:
+            index.build([None] * len(self._index), self._index)
+        self._secondary_indexes[column] = index
+        return index
+
+    def drop_secondary_index(self, column):
+        self._secondary_indexes.pop(column, None)
+
+    def secondary_index(self, column):
+        return self._secondary_indexes.get(column)
+
+    @property
+    def secondary_indexes(self):
+        return dict(self._secondary_indexes)
+
+    def _current_values(self, column, indexes):
+        if column not in self._columns:
+            return [None] * len(indexes)
+        data = self._data[self._columns.index(column)]
+        positions = self._position_map()
+        return [data[positions[i]] if i in positions else None for i in indexes]
+
+    def _reindex(self, column, indexes, old_values):
+        index = self._secondary_indexes[column]
+        data = self._data[self._columns.index(column)]
+        positions = self._position_map()
+        for i, old in zip(indexes, old_values):
+            index.remove(old, i)
+            index.add(data[positions[i]], i)
+
+    def _add_row(self, index):
+        super(DataTableDataFrame, self)._add_row(index)
+        self._touch()
+        if self._positions is not None:
+            self._positions[index] = len(self._index) - 1
+        for secondary_index in self._secondary_indexes.values():
+            secondary_index.add(None, index)
+
+    def _insert_row(self, i, index):
+        super(DataTableDataFrame, self)._insert_row(i, index)
+        self._positions = None
+        self._touch()
+        for secondary_index in self._secondary_indexes.values():
+            secondary_index.add(None, index)
+
+    def _add_column(self, column):
+        super(DataTableDataFrame, self)._add_column(column)
+        if column in self._dtypes or column in self._collations:
+            self._data[-1] = self._make_column_data(column, self._data[-1])
+
+    def get_entire_column(self, column, as_list=False):
+        data = self._data[self._columns.index(column)]
+        if as_list or not isinstance(data, ColumnData):
+            return super(DataTableDataFrame, self).get_entire_column(column, as_list)
+        # raccoon only accepts plain lists as column data
+        return rc.DataFrame(data={column: list(data)}, index=self._index,
+                            index_name=self._index_name, sort=self._sort)
+
+    def get_cell(self, index, column):
+        if self._sort:
+            return super(DataTableDataFrame, self).get_cell(index, column)
+        return self._data[self._columns.index(column)][self.index_position(index)]
+
+    def get_columns(self, index, columns=None, as_dict=False):
+        if self._sort:
+            return super(DataTableDataFrame, self).get_columns(index, columns, as_dict)
+        return self.get_location(self.index_position(index), columns, as_dict)
+
+    def set_cell(self, index, column, value):
+        self._touch([column])
+        indexed = column in self._secondary_indexes
+        if indexed:
+            old_values = self._current_values(column, [index])
+        positions = self._position_map()
+        if self._sort or index not in positions or column not in self._columns:
+            super(DataTableDataFrame, self).set_cell(index, column, value)
+        else:
+            # existing cell: find the row through the position map instead of
+            # raccoon's linear search of the index
+            self._data[self._columns.index(column)][positions[index]] = value
+        if indexed:
+            self._reindex(column, [index], old_values)
+
+    def set_row(self, index, values):
+        self._touch(values)
+        indexed = [c for c in values if c in self._secondary_indexes]
+        old_values = [self._current_values(c, [index]) for c in indexed]
+        super(DataTableDataFrame, self).set_row(index, values)
+        for column, old in zip(indexed, old_values):
+            self._reindex(column, [index], old)
+
+    def set_location(self, location, values, missing_to_none=False):
+        self._touch(None if missing_to_none else values)
+        index = self._index[location]
+        indexed = [c for c in self._secondary_indexes
+                   if c in values or missing_to_none]
+        old_values = [self._current_values(c, [index]) for c in indexed]
+        super(DataTableDataFrame, self).set_location(location, values, missing_to_none)
+        for column, old in zip(indexed, old_values):
+            self._reindex(column, [index], old)
+
+    def set_column(self, index=None, column=None, values=None):
+        self._touch([column])
+        indexes = None
+        if column in self._secondary_indexes and index:
+            if all(isinstance(i, bool) for i in index):
+                indexes = list(compress(self._index, index))
+            else:
+                indexes = list(index)
+            old_values = self._current_values(column, indexes)
+        super(DataTableDataFrame, self).set_column(index, column, values)
+        if column in self._dtypes or column in self._collations:
+            c = self._columns.index(column)
+            if not isinstance(self._data[c], ColumnData):
+                self._data[c] = self._make_column_data(column, self._data[c])
+        if column in self._secondary_indexes:
+            if indexes is None:
+                self._secondary_indexes[column].build(
+                    self._data[self._columns.index(column)], self._index)
+            else:
+                self._reindex(column, indexes, old_values)
+
+    def get_positions(self, column, positions):
+        """Return the values of a column at the given row positions."""
+        data = self._data[self._columns.index(column)]
+        return [ data[p] for p in positions ]
+
+    def set_positions(self, column, positions, values):
+        """Set the values of a column at the given row positions."""
+        if column not in self._columns:
+            self._add_column(column)
+        self._touch([column])
+        data = self._data[self._columns.index(column)]
+        indexed = column in self._secondary_indexes
+        if indexed:
+            indexes = [self._index[p] for p in positions]
+            old_values = [data[p] for p in positions]
+        for p, v in zip(positions, values):
+            data[p] = v
+        if indexed:
+            self._reindex(column, indexes, old_values)
+
+    def delete_head(self, count):
+        """
+        Delete the first ``count`` rows, e.g. to keep only the most recently
+        appended rows.
+        """
+        count = min(count, len(self._index))
+        if count <= 0:
+            return
+        indexes = self._index[:count]
+        for column, secondary_index in self._secondary_indexes.items():
+            data = self._data[self._columns.index(column)]
+            for value, index in zip(data[:count], indexes):
+                secondary_index.remove(value, index)
+        del self._index[:count]
+        for data in self._data:
+            del data[:count]
+        self._positions = None
+        self._touch()
+
+    def delete_rows(self, indexes):
+        indexes = [indexes] if not isinstance(indexes, (list, blist)) else indexes
+        if all(isinstance(i, bool) for i in indexes):
+            indexes = list(compress(self._index, indexes))
+        for column, secondary_index in self._secondary_indexes.items():
+            for i, value in zip(indexes, self._current_values(column, indexes)):
+                secondary_index.remove(value, i)
+        super(DataTableDataFrame, self).delete_rows(indexes)
+        self._positions = None
+        self._touch()
+
+    def delete_all_rows(self):
+        super(DataTableDataFrame, self).delete_all_rows()
+        self._positions = None
+        self._touch()
+        for secondary_index in self._secondary_indexes.values():
+            secondary_index.clear()
+
+    def delete_columns(self, columns):
+        super(DataTableDataFrame, self).delete_columns(columns)
+        self._touch()
+        for column in columns if isinstance(columns, (list, blist)) else [columns]:
+            self._secondary_indexes.pop(column, None)
+
+    def select_positions(self, f):
+        """
+        Return the sorted positions of the rows matching a DataTableFilter,
+        answered from a secondary index or a dictionary-encoded column, or
+        None if the filter has to be evaluated row by row.
+        """
+        if not isinstance(f, DataTableFilter) or f.column not in self._columns:
+            return None
+        secondary_index = self._secondary_indexes.get(f.column)
+        if secondary_index is not None:
+            indexes = f.lookup(secondary_index)
+            if indexes is not None:
+                positions = self._position_map()
+                return sorted(positions[i] for i in indexes)
+        data = self._data[self._columns.index(f.column)]
+        if isinstance(data, CategoricalColumnData):
+            if isinstance(f, EqualsFilter):
+                mask = data.equals(f.value)
+            elif isinstance(f, IsInFilter):
+                mask = data.isin(f.values)
+            else:
+                return None
+            return list(compress(range(len(data)), mask))
+        return None
+
+    def sort_snapshot(self, column):
+        """
+        Return a copy of the values of ``column`` that sort_order() can sort
+        while the frame keeps changing, e.g. from another thread.
+        """
+        data = self._data[self._columns.index(column)]
+        if isinstance(data, ColumnData):
+            return data.copy()
+        return list(data)
+
+    def sort_order(self, column, key=None, reverse=False, data=None):
+        """
+        Return the row positions that would sort the frame by ``column``, or
+        ``data``, a snapshot of it from sort_snapshot(), if given.  Typed
+        columns without a custom key use their native null-aware ordering,
+        and columns with a sorted secondary index reuse its order.
+        """
+        secondary_index = None
+        if data is None:
+            data = self._data[self._columns.index(column)]
+            secondary_index = self._secondary_indexes.get(column)
+        if (key is None and secondary_index is not None
+            and not isinstance(data, CollatedColumnData)):
+            # Reuse the order already maintained by a sorted index
+            rows = secondary_index.sorted_rows(reverse)
+            if rows is not None:
+                positions = self._position_map()
+                order = [positions[i] for i in rows]
+                nulls = sorted(positions[i] for i in secondary_index.nulls)
+                return nulls + order if reverse else order + nulls
+        if key is None:
+            if isinstance(data, ColumnData):
+                return data.sort_order(reverse)
+            key = null_sort_key
+        return sorted_list_indexes(data, key, reverse)
+
+    def sort_value(self, column, position, key=None):
+        """
+        Return what sort_order() compares for the row at ``position`` when
+        sorting by ``column``.
+        """
+        data = self._data[self._columns.index(column)]
+        if key is not None:
+            return key(data[position])
+        if isinstance(data, CollatedColumnData):
+            return null_sort_key(data.collation_key(position))
+        return null_sort_key(data[position])
+
+    def sort_ranks(self, column, key=None):
+        """
+        Return the dense rank of each row's value in ``column``, by position,
+        so rows can be compared on several columns without calling ``key``
+        again.  Equal values, nulls included, share a rank, and nulls rank
+        last.
+        """
+        data = self._data[self._columns.index(column)]
+        if key is None and isinstance(data, CollatedColumnData):
+            value = data.collation_key
+        else:
+            value = data.__getitem__
+        ranks = [0] * len(self._index)
+        rank = -1
+        last = object()
+        for p in self.sort_order(column, key=key):
+            v = key(value(p)) if key else value(p)
+            if rank < 0 or v != last:
+                rank += 1
+                last = v
+            ranks[p] = rank
+        return ranks
+
+    def partial_sort_order(self, column, count, start=0, key=None, reverse=False):
+        """
+        Return row positions that keep the first ``start`` rows in place,
+        follow them with the ``count`` remaining rows that sort first, in
+        order, and leave everything after that in its current order.
+        Selecting the rows is O(n log count) rather than a full sort.
+        """
+        data = self._data[self._columns.index(column)]
+        if key is None and isinstance(data, CollatedColumnData):
+            value = data.collation_key
+        else:
+            value = data.__getitem__
+        key = key or null_sort_key
+        rest = range(start, len(self._index))
+        keys = [key(value(i)) for i in rest]
+        if count >= len(keys):
+            chosen = sorted(range(len(keys)), key=keys.__getitem__, reverse=reverse)
+        else:
+            select = heapq.nlargest if reverse else heapq.nsmallest
+            chosen = select(count, range(len(keys)), key=keys.__getitem__)
+        chosen = [start + i for i in chosen]
+        selected = set(chosen)
+        return (list(range(start)) + chosen
+                + [i for i in rest if i not in selected])
+
+    def apply_order(self, order):
+        """Rearrange every column (and the index) into the given row order."""
+        self._positions = None
+        self._touch()
+        self._index = (blist([self._index[x] for x in order]) if self._blist
+                       else [self._index[x] for x in order])
+        for c, data in enumerate(self._data):
+            if isinstance(data, ColumnData):
+                self._data[c] = data.take(order)
+            else:
+                self._data[c] = (blist([data[i] for i in order]) if self._blist
+                                 else [data[i] for i in order])
+
+    def move_row(self, old, new):
+        """
+        Move the row at position ``old`` to position ``new``, shifting the
+        rows in between by one.  Only those rows change position, so this
+        costs the distance moved rather than the size of the frame.
+        """
+        if old == new:
+            return
+        self._touch()
+        for data in [self._index] + list(self._data):
+            value = data[old]
+            del data[old]
+            data.insert(new, value)
+        if self._positions is not None:
+            for p in range(min(old, new), max(old, new) + 1):
+                self._positions[self._index[p]] = p
+
+    def equality(self, column, indexes=None, value=None):
+        data = self._data[self._columns.index(column)]
+        if indexes is None and isinstance(data, CategoricalColumnData):
+            return data.equals(value)
+        return super(DataTableDataFrame, self).equality(column, indexes, value)
+
+    def isin(self, column, compare_list):
+        data = self._data[self._columns.index(column)]
+        if isinstance(data, CategoricalColumnData):
+            return data.isin(compare_list)
+        return super(DataTableDataFrame, self).isin(column, compare_list)
+
+    def sort_columns(self, column, key=None, reverse=False):
+        if isinstance(column, (list, blist)):
+            raise TypeError("Can only sort by a single column")
+        self.apply_order(self.sort_order(column, key=key, reverse=reverse))
+
+    def index_sort_order(self):
+        return sorted_list_indexes(self._index)
+
+    def sort_index(self):
+        self.apply_order(self.index_sort_order())
 
     def _validate_index(self, indexes):
         try:
@@ -33,6 +1040,15 @@ class DataTableDataFrame(rc.DataFrame):
             raise
 
 
+    def iterlocations(self, locations):
+        """Iterate over the rows at the given positions as dicts."""
+        columns = list(zip(self._columns, self._data))
+        for i in locations:
+            row = {self._index_name: self._index[i]}
+            for column, data in columns:
+                row[column] = data[i]
+            yield row
+
     def log_dump(self, n=5, columns=None, label=None):
         df = self
         if columns:
@@ -48,8 +1064,57 @@ class DataTableDataFrame(rc.DataFrame):
             df.head(n)))
 
 
+    def upsert_rows(self, rows):
+        """
+        Update the rows whose index already exists and append the rest.
+        Returns a dict mapping the position of each existing row that
+        actually changed to the set of its changed columns, and the
+        positions of the appended rows.
+        """
+        positions = self._position_map()
+        updates = collections.OrderedDict()
+        new_rows = collections.OrderedDict()
+        for row in rows:
+            index = row.get(self.index_name)
+            if index in positions:
+                updates.setdefault(positions[index], dict()).update(row)
+            elif index is None:
+                new_rows[object()] = row
+            else:
+                new_rows.setdefault(index, dict()).update(row)
+
+        changed = self.update_rows(updates)
+        start = len(self._index)
+        self.append_rows(list(new_rows.values()))
+        return changed, range(start, len(self._index))
+
+    def update_rows(self, updates):
+        """
+        Write ``{position: {column: value}}`` to existing rows in bulk, one
+        column at a time, skipping values that didn't change.  Returns a dict
+        mapping the position of each changed row to its changed columns.
+        """
+        changes = collections.OrderedDict()
+        changed = dict()
+        for p, row in updates.items():
+            for column, value in row.items():
+                if column not in self._columns:
+                    self._add_column(column)
+                elif self._data[self._columns.index(column)][p] == value:
+                    continue
+                changes.setdefault(column, ([], []))
+                changes[column][0].append(p)
+                changes[column][1].append(value)
+                changed.setdefault(p, set()).add(column)
+        for column, (column_positions, values) in changes.items():
+            self.set_positions(column, column_positions, values)
+        return changed
+
     def append_rows(self, rows):
 
+        if not self._sort:
+            return self._extend_rows(rows)
+
         colnames =  list(self.columns)
         length = len(rows)
 
@@ -84,6 +1149,44 @@ class DataTableDataFrame(rc.DataFrame):
         self.append(newdata)
         # self.log_dump(10, label="after")
 
+    def _extend_rows(self, rows):
+        # Append rows directly to the column storage, checking for duplicate
+        # indexes against the position map rather than the whole index
+        if not rows:
+            return
+        for column in set().union(*rows):
+            if column not in self._columns:
+                self._add_column(column)
+
+        start = len(self._index)
+        has_index = any(self.index_name in row for row in rows)
+        if has_index:
+            indexes = [row.get(self.index_name) for row in rows]
+        else:
+            indexes = list(range(start, start + len(rows)))
+        positions = self._position_map()
+        if (len(set(indexes)) != len(indexes)
+            or any(index in positions for index in indexes)):
+            logger.error("duplicates in index: %s" %(
+                [item for item, count
+                 in list(collections.Counter(indexes).items())
+                 if count > 1 or item in positions]))
+            raise ValueError("duplicate indexes in DataFrames")
+
+        self._touch()
+        self._index.extend(indexes)
+        positions.update((index, start + i) for i, index in enumerate(indexes))
+        for c, column in enumerate(self._columns):
+            data = self._data[c]
+            if column == self.index_name:
+                data.extend(indexes)
+            else:
+                data.extend(row.get(column) for row in rows)
+            secondary_index = self._secondary_indexes.get(column)
+            if secondary_index is not None:
+                for index, value in zip(indexes, data[start:]):
+                    secondary_index.add(value, index)
+
     # def add_column(self, column, data=None):
     #     self[column] = data
 
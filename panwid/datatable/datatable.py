@@ -3,15 +3,30 @@ logger = logging.getLogger("panwid.datable")
 import urwid
 import urwid_utils.palette
 from ..listbox import ScrollingListBox
-from orderedattrdict import OrderedDict
+from orderedattrdict import OrderedDict, AttrDict
 import itertools
+import functools
+import operator
+import bisect
+import contextlib
 import traceback
+from timeit import default_timer as timer
+import pickle
+import os
+import threading
+from collections import deque
+try:
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+except ImportError:
+    ProcessPoolExecutor = None
 from datetime import datetime, date as datetype
 import math
 from blist import blist
 
 from .dataframe import *
+from .filters import *
 from .rows import *
+from .cache import *
 
 class NoSuchColumnException(Exception):
     pass
@@ -29,6 +44,27 @@ def make_value_function(template):
 
     return inner
 
+def filter_chunk(filters, positions, rows):
+    # Runs in a worker process when filtering in parallel
+    return [ p for p, row in zip(positions, rows)
+             if all(f(row) for f in filters) ]
+
+def value_chunk(value_fn, rows):
+    # Runs in a worker process when computing calculated columns in parallel
+    return [ value_fn(None, row) for row in rows ]
+
+
+DTYPE_FORMATTERS = {
+    "int": lambda v: "%d" %(v),
+    "float": lambda v: "%.03f" %(v),
+    "decimal": lambda v: format(v, ".3f"),
+    "datetime": lambda v: v.strftime("%Y-%m-%d %H:%M:%S"),
+    "date": lambda v: v.strftime("%Y-%m-%d"),
+    "bool": str,
+    "str": str,
+    "category": str,
+}
+
 
 class DataTableColumn(object):
 
@@ -44,7 +80,11 @@ class DataTableColumn(object):
                  attr = None,
                  sort_key = None, sort_reverse=False,
                  sort_icon = None,
-                 footer_fn = None, footer_arg = "values"):
+                 footer_fn = None, footer_arg = "values",
+                 dtype = None,
+                 collation = None,
+                 value_parallel = False,
+                 value_depends = None):
 
         self.name = name
         self.label = label if label is not None else name
@@ -55,6 +95,10 @@ class DataTableColumn(object):
                 self.value_fn = value
         else:
             self.value_fn = None
+        # value_fn can run in a worker process, where it's passed table=None
+        self.value_parallel = value_parallel
+        # columns value_fn reads; None means it may read any of them
+        self.value_depends = value_depends
         self.width = width
         self.align = align
         self.wrap = wrap
@@ -68,6 +112,9 @@ class DataTableColumn(object):
         self.sort_icon = sort_icon
         self.footer_fn = footer_fn
         self.footer_arg = footer_arg
+        self.dtype = normalize_dtype(dtype)
+        self.collation = normalize_collation(collation)
+        self._formatter = DTYPE_FORMATTERS.get(self.dtype)
 
         if isinstance(self.width, tuple):
             if self.width[0] != "weight":
@@ -98,6 +145,12 @@ class DataTableColumn(object):
                 logger.error("%s format exception: %s" %(self.name, v))
                 logger.exception(e)
                 raise e
+        elif self._formatter and v is not None:
+            # Typed columns skip the type sniffing in format()
+            try:
+                return urwid.Text(self._formatter(v), align=self.align, wrap=self.wrap)
+            except (TypeError, ValueError, AttributeError):
+                pass
         return self.format(v)
 
 
@@ -126,13 +179,15 @@ class DataTable(urwid.WidgetWrap, urwid.listbox.ListWalker):
 
     signals = ["select", "refresh",
                # "focus", "unfocus", "row_focus", "row_unfocus",
-               "drag_start", "drag_continue", "drag_stop"]
+               "drag_start", "drag_continue", "drag_stop",
+               "progress"]
 
     ATTR = "table"
 
     columns = []
 
     limit = None
+    max_pages = None
     index = "index"
 
     with_header = True
@@ -141,6 +196,7 @@ class DataTable(urwid.WidgetWrap, urwid.listbox.ListWalker):
     cell_selection = False
 
     sort_by = (None, None)
+    multi_sort_by = None
     query_sort = False
     sort_icons = True
     sort_refocus = False
@@ -162,10 +218,40 @@ class DataTable(urwid.WidgetWrap, urwid.listbox.ListWalker):
     detail_column = None
     auto_expand_details = False
 
+    secondary_indexes = []
+    cache_filters = False
+    filter_stack_size = 32
+    filter_sample_interval = 64
+    filter_stats_size = 256
+
+    parallel = False
+    parallel_chunk_size = 50000
+
+    async_sort = False
+    async_sort_retries = 2
+    main_loop = None
+
+    lazy_sort = False
+    lazy_sort_size = 200
+
+    manual_order = False
+
+    tail = False
+    tail_capacity = 10000
+    tail_fps = 10
+
+    query_cursor = False
+    query_filters = False
+
+    query_cache_size = 0
+    query_cache_path = None
+    query_cache_key = None
+    query_threadsafe = True
+
     def __init__(self,
                  columns = None,
                  data = None,
-                 limit = None,
+                 limit = None, max_pages = None,
                  index = None,
                  with_header = None, with_footer = None, with_scrollbar = None,
                  cell_selection = None,
@@ -174,7 +260,17 @@ class DataTable(urwid.WidgetWrap, urwid.listbox.ListWalker):
                  border = None, padding = None,
                  detail_fn = None, detail_column = None,
                  auto_expand_details = False,
-                 ui_sort = None):
+                 ui_sort = None,
+                 secondary_indexes = None,
+                 cache_filters = None,
+                 parallel = None, parallel_chunk_size = None,
+                 async_sort = None, async_sort_retries = None, main_loop = None,
+                 lazy_sort = None, lazy_sort_size = None,
+                 manual_order = None,
+                 tail = None, tail_capacity = None, tail_fps = None,
+                 query_cursor = None, query_filters = None,
+                 query_cache_size = None,
+                 query_cache_path = None, query_cache_key = None):
 
         self._focus = 0
         if columns is not None: self.columns = columns
@@ -193,7 +289,10 @@ class DataTable(urwid.WidgetWrap, urwid.listbox.ListWalker):
 
         if query_sort: self.query_sort = query_sort
 
-        if sort_by:
+        if isinstance(sort_by, list):
+            self.multi_sort_by = sort_by
+            self.sort_by = sort_by[0] if isinstance(sort_by[0], tuple) else (sort_by[0], None)
+        elif sort_by:
             if isinstance(sort_by, tuple):
                 column = sort_by[0]
                 reverse = sort_by[1]
@@ -204,7 +303,7 @@ class DataTable(urwid.WidgetWrap, urwid.listbox.ListWalker):
 
             self.sort_by = (column, reverse)
 
-        self.initial_sort = self.sort_by
+        self.initial_sort = self.multi_sort_by or self.sort_by
 
         if sort_icons is not None: self.sort_icons = sort_icons
         if sort_refocus is not None: self.sort_refocus = sort_refocus
@@ -221,27 +320,103 @@ class DataTable(urwid.WidgetWrap, urwid.listbox.ListWalker):
         if detail_fn is not None: self.detail_fn = detail_fn
         if detail_column is not None: self.detail_column = detail_column
         if auto_expand_details: self.auto_expand_details = auto_expand_details
+        if secondary_indexes is not None: self.secondary_indexes = secondary_indexes
+        if cache_filters is not None: self.cache_filters = cache_filters
+        if parallel is not None: self.parallel = parallel
+        if parallel_chunk_size is not None: self.parallel_chunk_size = parallel_chunk_size
+        self._executor = None
+        if async_sort is not None: self.async_sort = async_sort
+        if async_sort_retries is not None: self.async_sort_retries = async_sort_retries
+        if main_loop is not None: self.main_loop = main_loop
+        self._sort_generation = 0
+        self._sort_results = deque()
+        self._sort_pipe = None
+        self._sort_thread = None
+        self._sort_running = False
+        self._sort_request = None
+        if lazy_sort is not None: self.lazy_sort = lazy_sort
+        if lazy_sort_size is not None: self.lazy_sort_size = lazy_sort_size
+        self._lazy_sort = None
+        self._lazy_sort_idle = None
+        self._sort_keys = dict()
+        self._sort_keys_version = None
+        if manual_order is not None: self.manual_order = manual_order
+        self.row_ranks = dict()
+        self._next_rank = 0
+        self._first_rank = 0
+        self._batch_depth = 0
+        self._pending = set()
+        self._batch_added = []
+        if tail is not None: self.tail = tail
+        if tail_capacity is not None: self.tail_capacity = tail_capacity
+        if tail_fps is not None: self.tail_fps = tail_fps
+        self._tail_rows = deque()
+        self._tail_order = deque()
+        self._tail_alarm = None
+        self._posted = deque()
+        self._posted_signalled = False
+        self._update_pipe = None
+        self._update_pipe_lock = threading.Lock()
+        if self.main_loop:
+            self._update_pipe = self.main_loop.watch_pipe(self.drain_updates)
+        if query_cursor is not None: self.query_cursor = query_cursor
+        self.query_cursors = dict()
+        if query_filters is not None: self.query_filters = query_filters
+        self.pushed_filters = None
+        self._resetting = False
+        if query_cache_size is not None: self.query_cache_size = query_cache_size
+        self.query_cache = None
+        if self.query_cache_size:
+            self.query_cache = QueryPageCache(self.query_cache_size)
+        if query_cache_path is not None: self.query_cache_path = query_cache_path
+        if query_cache_key is not None: self.query_cache_key = query_cache_key
+        self.persistent_cache = None
+        if self.query_cache_path:
+            self.persistent_cache = PersistentQueryCache(
+                self.query_cache_path,
+                self.query_cache_key or self.__class__.__name__
+            )
+        self._reconcile_generation = 0
+        self._reconciled = deque()
+        self._reconcile_pipe = None
+        self._reconcile_thread = None
 
         # self.offset = 0
         if limit:
             self.limit = limit
+        if max_pages is not None: self.max_pages = max_pages
+        self.first_page = 0
 
         self.sort_column = None
 
         self.filters = None
         self.filtered_rows = blist()
+        self.filter_cache = FilterBitmapCache(lambda: self.df)
+        self.filter_stack = []
+        self.filter_stack_version = None
+        self.filter_stats = OrderedDict()
 
         kwargs = dict(
             columns = self.column_names,
             use_blist=True,
             sort=False,
             # sorted=True,
+            dtypes = { c.name: c.dtype for c in self.columns if c.dtype },
+            collations = { c.name: c.collation for c in self.columns if c.collation },
+            derived = [ c.name for c in self.columns if c.value_fn ],
         )
         if self.index:
             kwargs["index_name"] = self.index
 
         self.df = DataTableDataFrame(**kwargs)
 
+        if isinstance(self.secondary_indexes, dict):
+            secondary_indexes = list(self.secondary_indexes.items())
+        else:
+            secondary_indexes = [(c, "sorted") for c in self.secondary_indexes]
+        for column, kind in secondary_indexes:
+            self.df.add_secondary_index(column, kind)
+
         self.pile = urwid.Pile([])
         self.listbox = ScrollingListBox(
             self, infinite=self.limit,
@@ -269,9 +444,12 @@ class DataTable(urwid.WidgetWrap, urwid.listbox.ListWalker):
             lambda source, drag_from ,drag_to: urwid.signals.emit_signal(
                 self, "drag_stop", self, drag_from, drag_to)
         )
+        if self.manual_order:
+            urwid.connect_signal(self.listbox, "drag_stop", self.on_drag_stop)
 
         if self.limit:
             urwid.connect_signal(self.listbox, "load_more", self.load_more)
+            urwid.connect_signal(self.listbox, "load_previous", self.load_previous)
             # self.offset = 0
 
         if self.with_header:
@@ -310,7 +488,7 @@ class DataTable(urwid.WidgetWrap, urwid.listbox.ListWalker):
         self.reset()
 
         if self.sort_by:
-            self.sort_by_column(self.sort_by)
+            self.sort_by_column(self.initial_sort)
 
 
         self.attr = urwid.AttrMap(
@@ -322,6 +500,13 @@ class DataTable(urwid.WidgetWrap, urwid.listbox.ListWalker):
 
 
     def query(self, sort=None, offset=None):
+        """
+        Return an iterable of row dicts.  Called with ``sort``, ``offset``,
+        ``limit`` and ``load_all``, and with query_cursor set, ``after``: the
+        ``(sort_value, index)`` of the last row loaded so far, or None for
+        the first page, so the next page can be fetched with a keyset
+        condition instead of an offset.
+        """
         raise Exception("query method must be overriden")
 
     def query_result_count(self):
@@ -548,8 +733,52 @@ class DataTable(urwid.WidgetWrap, urwid.listbox.ListWalker):
 
     def _modified(self):
         # self.focus_position = 0
+        if self._batch_depth:
+            self._pending.add("modified")
+            return
         urwid.listbox.ListWalker._modified(self)
 
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Defer invalidation, filtering, sorting and footer updates until the
+        block exits, then do each of them once:
+
+            with table.batch():
+                for row in rows:
+                    table.add_row(row)
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                self.flush_batch()
+
+    def flush_batch(self):
+        pending, self._pending = self._pending, set()
+        added, self._batch_added = self._batch_added, []
+        added = [ index for index in added if self.df.has_index(index) ]
+        if added:
+            # rows added in the batch get their calculated fields before
+            # they're sorted and filtered on
+            self.df.set_positions(
+                "_dirty", [ self.index_to_position(index) for index in added ],
+                [True] * len(added))
+            self.refresh_calculated_fields(added)
+        if "sort" in pending:
+            self.resort()
+            self.finish_sort()
+        if "filter" in pending:
+            self.apply_filters()
+        elif "invalidate" in pending:
+            self.invalidate()
+        elif "footer" in pending:
+            self.footer.update()
+        if pending:
+            self._modified()
+
     def positions(self, reverse=False):
         if reverse:
             return range(len(self) - 1, -1, -1)
@@ -607,15 +836,10 @@ class DataTable(urwid.WidgetWrap, urwid.listbox.ListWalker):
 
     def index_to_position(self, index):
         # raise Exception(index, self.df.index)
-        return self.df.index.index(index)
+        return self.df.index_position(index)
 
     def get_dataframe_row(self, index):
         logger.debug("__getitem__: %s" %(index))
-        try:
-            v = self.df[index:index]
-        except IndexError:
-            logger.debug(traceback.format_exc())
-
         return self.df.get_columns(index, as_dict=True)
 
     def get_row(self, index):
@@ -637,6 +861,8 @@ class DataTable(urwid.WidgetWrap, urwid.listbox.ListWalker):
         return row
 
     def get_row_by_position(self, position):
+        if self._lazy_sort and self.filtered_rows[position] >= self._lazy_sort.sorted:
+            self.extend_sort(self.filtered_rows[position] + 1)
         index = self.position_to_index(self.filtered_rows[position])
         return self.get_row(index)
 
@@ -663,9 +889,112 @@ class DataTable(urwid.WidgetWrap, urwid.listbox.ListWalker):
             indexes = [indexes]
         for col in self.columns:
             if not col.value_fn: continue
-            for index in indexes:
-                if self.df[index, "_dirty"]:
-                    self.df.set(index, col.name, col.value_fn(self, self.get_dataframe_row(index)))
+            dirty = [ index for index in indexes if self.df[index, "_dirty"] ]
+            positions = [ self.index_to_position(index) for index in dirty ]
+            values = None
+            if col.value_parallel and self.can_parallelize([col.value_fn], len(dirty)):
+                values = self.parallel_values(col.value_fn, positions)
+            if values is None:
+                values = [ col.value_fn(self, self.get_dataframe_row(index))
+                           for index in dirty ]
+            # only write values that changed, and invalidate what they affect
+            current = self.df.get_positions(col.name, positions)
+            changed = [ (p, v) for p, v, old in zip(positions, values, current)
+                        if old != v ]
+            if not changed:
+                continue
+            positions, values = [ list(x) for x in zip(*changed) ]
+            self.df.set_positions(col.name, positions, values)
+            self.calculated_fields_changed(col.name, positions)
+
+    def calculated_fields_changed(self, column, positions):
+        """
+        Invalidate cached filter and sort results after the values of
+        calculated ``column`` changed at ``positions``.  Calculated columns
+        are derived, so writing them doesn't change the dataframe version
+        the caches otherwise follow.
+        """
+        self.filter_cache.invalidate(positions, [column])
+        if self.filters_depend_on([column]):
+            self.filter_stack = []
+        if self.sort_depends_on([column]):
+            self._sort_keys_version = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers = None if self.parallel is True else self.parallel
+            )
+        return self._executor
+
+    def shutdown_executor(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def can_parallelize(self, fns, count):
+        if (not self.parallel or ProcessPoolExecutor is None
+            or count <= self.parallel_chunk_size):
+            return False
+        try:
+            pickle.dumps(fns)
+        except Exception:
+            return False
+        return True
+
+    def worker_row(self, row):
+        return { k: v for k, v in row.items()
+                 if k not in DataTableDataFrame.DATA_TABLE_COLUMNS }
+
+    def run_parallel(self, fn, chunks):
+        """
+        Run ``fn(*args)`` in the process pool for each ``args`` in ``chunks``
+        and return the results in order.  Emits the "progress" signal with
+        the number of chunks completed so far and the total as each one
+        finishes.
+        """
+        futures = dict(
+            (self.executor.submit(fn, *args), i)
+            for i, args in enumerate(chunks)
+        )
+        results = [None] * len(chunks)
+        for done, future in enumerate(as_completed(futures)):
+            results[futures[future]] = future.result()
+            urwid.signals.emit_signal(self, "progress", self, done+1, len(chunks))
+        return results
+
+    def chunk_positions(self, positions):
+        size = self.parallel_chunk_size
+        return [ positions[i:i+size] for i in range(0, len(positions), size) ]
+
+    def parallel_values(self, value_fn, positions):
+        chunks = [
+            (value_fn, [ self.worker_row(row)
+                         for row in self.df.iterlocations(chunk) ])
+            for chunk in self.chunk_positions(positions)
+        ]
+        try:
+            results = self.run_parallel(value_chunk, chunks)
+        except Exception as e:
+            logger.warning("parallel value_fn failed, running serially: %s" %(e))
+            return None
+        return [ v for values in results for v in values ]
+
+    def parallel_filter_positions(self, rows, filters):
+        rows = list(rows)
+        filters = self.order_filters(filters)
+        chunks = [
+            (filters, [ p for p, row in chunk ],
+             [ self.worker_row(row) for p, row in chunk ])
+            for chunk in self.chunk_positions(rows)
+        ]
+        try:
+            results = self.run_parallel(filter_chunk, chunks)
+        except Exception as e:
+            logger.warning("parallel filtering failed, running serially: %s" %(e))
+            return self.scan_filters(rows, filters)
+        return [ p for positions in results for p in positions ]
 
     def visible_column_index(self, column_name):
         try:
@@ -680,10 +1009,15 @@ class DataTable(urwid.WidgetWrap, urwid.listbox.ListWalker):
         column_name = None
         column_number = None
 
-        if isinstance(col, tuple):
+        if isinstance(col, list):
+            return self.sort_by_columns(col)
+
+        elif isinstance(col, tuple):
             col, reverse = col
 
         elif col is None:
+            if self.multi_sort_by:
+                return self.sort_by_columns(self.multi_sort_by)
             col = self.sort_column
 
         if isinstance(col, int):
@@ -717,6 +1051,7 @@ class DataTable(urwid.WidgetWrap, urwid.listbox.ListWalker):
         # if not self.query_sort:
 
         self.sort_by = sort_by
+        self.multi_sort_by = None
         logger.info("sort_by: %s (%s), %s" %(column_name, self.sort_column, reverse))
         if self.query_sort:
             self.reset()
@@ -725,26 +1060,336 @@ class DataTable(urwid.WidgetWrap, urwid.listbox.ListWalker):
         if self.sort_refocus:
             row_index = self[self._focus].data.get(self.index, None)
             logger.info("row_index: %s" %(row_index))
+
+        if self._batch_depth:
+            self._pending.add("sort")
+            return
+
+        if self.async_sort and self.main_loop:
+            self.sort_async(column_name, key=column.sort_key, row_index=row_index)
+            return
+
         self.sort(column_name, key=column.sort_key)
+        self.finish_sort(row_index)
+
+    def sort_by_columns(self, sort_by):
+        """
+        Sort by several columns, e.g. ``[("region", False), ("bar", True)]``,
+        with ties on each column broken by the ones that follow it.
+        """
+        columns = dict((c.name, c) for c in self.columns)
+        self.multi_sort_by = []
+        for s in sort_by:
+            column_name, reverse = s if isinstance(s, tuple) else (s, None)
+            if column_name not in columns:
+                raise NoSuchColumnException(column_name)
+            if reverse is None:
+                reverse = bool(columns[column_name].sort_reverse)
+            self.multi_sort_by.append((column_name, reverse))
+        self.sort_by = self.multi_sort_by[0]
+        try:
+            self.sort_column = self.visible_column_index(self.sort_by[0])
+        except:
+            self.sort_column = None
+        logger.info("sort_by: %s" %(self.multi_sort_by))
+        if self.query_sort:
+            self.reset()
+
+        row_index = None
+        if self.sort_refocus:
+            row_index = self[self._focus].data.get(self.index, None)
+
+        if self._batch_depth:
+            self._pending.add("sort")
+            return
+
+        self.resort()
+        self._modified()
+        self.finish_sort(row_index)
+
+    def resort(self):
+        """
+        Sort the rows again by the current sort columns, e.g. after their
+        values changed, leaving the header and focus alone.
+        """
+        if self.multi_sort_by:
+            self.cancel_lazy_sort()
+            keys = self.sort_keys(self.multi_sort_by)
+            self.reorder(sorted(range(len(self.df)), key=keys.__getitem__))
+        elif self.sort_by[0]:
+            column = next((c for c in self.columns if c.name == self.sort_by[0]), None)
+            self.sort(self.sort_by[0], key=column.sort_key if column else None)
+
+    def place_rows(self, positions):
+        """
+        Move the rows at ``positions``, which were added or had their sort
+        value changed, to where they belong among the other rows, which are
+        still in order, by bisecting on the sort key.  Rows equal to others
+        go after them, as a stable sort would put them.  Each row is moved
+        on its own, so the rest of the frame isn't rearranged.  Anything but
+        a completed single-column sort is sorted again with resort().
+        """
+        if self.multi_sort_by or self._lazy_sort or self.sort_pending:
+            self.resort()
+            return
+        column_name, reverse = self.sort_by
+        column = next((c for c in self.columns if c.name == column_name), None)
+        key = column.sort_key if column else None
+        value = lambda p: self.df.sort_value(column_name, p, key)
+
+        indexes = [ self.position_to_index(p) for p in sorted(set(positions)) ]
+        moving = set(indexes)
+        for index in indexes:
+            old = self.index_to_position(index)
+            v = value(old)
+            lo, hi = 0, len(self.df)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                # rows still waiting to be moved aren't in order, so compare
+                # with the first row from mid on that isn't one of them
+                q = mid
+                while q < hi and self.position_to_index(q) in moving:
+                    q += 1
+                if q == hi:
+                    hi = mid
+                    continue
+                o = value(q)
+                if (o < v) if reverse else (v < o):
+                    hi = mid
+                else:
+                    lo = q + 1
+            moving.discard(index)
+            self.move_position(old, lo - 1 if lo > old else lo)
+
+    def move_position(self, old, new):
+        """Move the row at position ``old`` of the dataframe to ``new``."""
+        if old == new:
+            return
+        self.filter_cache.move(old, new)
+        cached = self._sort_keys_version == self.df.version
+        self.df.move_row(old, new)
+        if self.filters:
+            # filtered rows are kept in position order, so the ones in
+            # between shift by one
+            start = bisect.bisect_left(self.filtered_rows, min(old, new))
+            stop = bisect.bisect_right(self.filtered_rows, max(old, new))
+            span = self.filtered_rows[start:stop]
+            shift = 1 if new < old else -1
+            moved = [ p + shift for p in span if p != old ]
+            if len(moved) < len(span):
+                bisect.insort(moved, new)
+            self.filtered_rows[start:stop] = moved
+        if cached:
+            for keys in self._sort_keys.values():
+                keys.insert(new, keys.pop(old))
+            self._sort_keys_version = self.df.version
+
+    def sort_keys(self, sort_by):
+        """
+        Return a composite sort key for each row, built from the rank of the
+        row's value in each sort column, negated for descending columns.
+        Ranks and keys are cached until the data changes, and follow the
+        rows when they're reordered.
+        """
+        if self._sort_keys_version != self.df.version:
+            self._sort_keys = dict()
+            self._sort_keys_version = self.df.version
+        columns = dict((c.name, c) for c in self.columns)
+        spec = tuple(
+            (column_name, columns[column_name].sort_key, reverse)
+            for column_name, reverse in sort_by
+        )
+        try:
+            return self._sort_keys[spec]
+        except KeyError:
+            pass
+        ranks = []
+        for column_name, key, reverse in spec:
+            try:
+                r = self._sort_keys[(column_name, key)]
+            except KeyError:
+                r = self._sort_keys[(column_name, key)] = self.df.sort_ranks(column_name, key)
+            ranks.append([-x for x in r] if reverse else r)
+        keys = self._sort_keys[spec] = list(zip(*ranks))
+        return keys
+
+    def finish_sort(self, row_index=None):
 
         if self.with_header:
-            self.header.update_sort(self.sort_by)
+            self.header.update_sort(self.multi_sort_by or self.sort_by)
 
         self.set_focus_column(self.sort_column)
         if row_index:
             self.focus_position = self.index_to_position(row_index)
 
     def sort(self, column, key=None):
-        import functools
         logger.debug(column)
-        if not key:
-            key = lambda x: (x is None, x)
-        self.df.sort_columns(
-            column,
-            key = key,
-            reverse = self.sort_by[1])
+        self.cancel_lazy_sort()
+        if self.lazy_sort:
+            self.sort_lazy(column, key=key)
+        else:
+            self.reorder(self.df.sort_order(
+                column,
+                key = key,
+                reverse = self.sort_by[1]))
+        self._modified()
+
+    def sort_lazy(self, column, key=None):
+        """
+        Sort only the first ``lazy_sort_size`` rows, leaving the rest to be
+        sorted as they're scrolled into view or when the main loop is idle.
+        """
+        self._lazy_sort = AttrDict(
+            column = column, key = key, reverse = self.sort_by[1],
+            sorted = 0, version = self.df.version
+        )
+        self.extend_sort(self.lazy_sort_size)
+        if self._lazy_sort and self.main_loop:
+            self._lazy_sort_idle = self.main_loop.enter_idle(self.on_lazy_sort_idle)
+
+    def extend_sort(self, count):
+        """
+        Grow the sorted prefix of a lazy sort to at least ``count`` rows.
+        """
+        state = self._lazy_sort
+        if not state:
+            return
+        if state.version != self.df.version:
+            # rows changed since the last step, so the prefix can't be
+            # trusted; sort it again from the start
+            state.sorted = 0
+        # at least double the prefix so scrolling through the whole table
+        # doesn't cost a selection pass per screen
+        count = max(count - state.sorted, state.sorted, self.lazy_sort_size)
+        self.reorder(self.df.partial_sort_order(
+            state.column, count, start = state.sorted,
+            key = state.key, reverse = state.reverse
+        ))
+        state.sorted += count
+        state.version = self.df.version
+        if state.sorted >= len(self.df):
+            self.cancel_lazy_sort()
+
+    def cancel_lazy_sort(self):
+        self._lazy_sort = None
+        if self._lazy_sort_idle is not None:
+            self.main_loop.remove_enter_idle(self._lazy_sort_idle)
+            self._lazy_sort_idle = None
+
+    def on_lazy_sort_idle(self):
+        if not self._lazy_sort:
+            self.cancel_lazy_sort()
+            return
+        self.extend_sort(self._lazy_sort.sorted * 2)
         self._modified()
 
+    def sort_async(self, column, key=None, row_index=None, retries=0):
+        """
+        Compute the sort order in a worker thread and apply it from the main
+        loop when it's done, so the UI keeps responding while a big table is
+        sorted.  Only one worker runs at a time: a newer sort supersedes any
+        that are still pending, and starts when the running one finishes.
+
+        The worker sorts a copy of the column taken when it starts.  If the
+        rows change before its result is applied, the sort is started again,
+        up to ``async_sort_retries`` times before it's done in the foreground.
+        """
+        self.cancel_lazy_sort()
+        self._sort_generation += 1
+
+        if self.with_header:
+            self.header.update_sort(self.sort_by, pending=True)
+
+        request = (self._sort_generation, column, key, self.sort_by[1],
+                   row_index, retries)
+        if self._sort_running:
+            self._sort_request = request
+            return
+        self.start_sort(request)
+
+    def start_sort(self, request):
+
+        generation, column, key, reverse, row_index, retries = request
+        version = self.df.version
+        data = self.df.sort_snapshot(column)
+
+        def worker():
+            try:
+                order = self.df.sort_order(column, key=key, reverse=reverse, data=data)
+            except Exception as e:
+                logger.error("background sort failed: %s" %(e))
+                order = None
+            self._sort_results.append(
+                (generation, version, column, key, row_index, retries, order)
+            )
+            os.write(self.sort_pipe, b"s")
+
+        self.sort_pipe # create the pipe from the main thread
+        self._sort_running = True
+        self._sort_thread = threading.Thread(target=worker)
+        self._sort_thread.daemon = True
+        self._sort_thread.start()
+
+    @property
+    def sort_pipe(self):
+        if self._sort_pipe is None:
+            self._sort_pipe = self.main_loop.watch_pipe(self.on_sort_done)
+        return self._sort_pipe
+
+    def on_sort_done(self, data):
+        while self._sort_results:
+            (generation, version, column, key,
+             row_index, retries, order) = self._sort_results.popleft()
+            self._sort_running = False
+            if generation != self._sort_generation:
+                continue
+            if order is None:
+                self.finish_sort(row_index)
+            elif version == self.df.version:
+                self.reorder(order)
+                self._modified()
+                self.finish_sort(row_index)
+            elif retries < self.async_sort_retries:
+                self.sort_async(column, key=key, row_index=row_index,
+                                retries=retries+1)
+            else:
+                # the rows keep changing; sort them here instead
+                self.reorder(self.df.sort_order(column, key=key,
+                                                reverse=self.sort_by[1]))
+                self._modified()
+                self.finish_sort(row_index)
+        if self._sort_request and not self._sort_running:
+            request, self._sort_request = self._sort_request, None
+            if request[0] == self._sort_generation:
+                self.start_sort(request)
+        return True
+
+    @property
+    def sort_pending(self):
+        return self._sort_running or self._sort_request is not None
+
+    def reorder(self, order):
+        """Rearrange the dataframe rows into the given order of positions."""
+        self.filter_cache.permute(order)
+        cached = self._sort_keys_version == self.df.version
+        self.df.apply_order(order)
+        if self.manual_order:
+            # sorting replaces the manual order
+            self.row_ranks = dict()
+            self._next_rank = 0
+            self._first_rank = 0
+        if (self.filters or self.manual_order) and len(order) == len(self.df):
+            # filtered rows are kept in position order, so they move too
+            positions = [0] * len(order)
+            for new, old in enumerate(order):
+                positions[old] = new
+            self.filtered_rows = blist(sorted(positions[p] for p in self.filtered_rows))
+        if cached:
+            self._sort_keys = dict(
+                (k, [keys[i] for i in order]) for k, keys in self._sort_keys.items()
+            )
+            self._sort_keys_version = self.df.version
+
 
     def set_focus_column(self, index):
         if self.with_header:
@@ -771,12 +1416,10 @@ class DataTable(urwid.WidgetWrap, urwid.listbox.ListWalker):
         self.sort_by_column(index)
 
     def sort_index(self):
-        self.df.sort_index()
+        self.reorder(self.df.index_sort_order())
         self._modified()
 
-    def requery(self, offset=0, load_all=False, **kwargs):
-
-        # logger.info("requery")
+    def query_kwargs(self, offset=0, limit=None, load_all=False):
         kwargs = {"load_all": load_all}
         if self.query_sort:
             kwargs["sort"] = self.sort_by
@@ -784,12 +1427,133 @@ class DataTable(urwid.WidgetWrap, urwid.listbox.ListWalker):
             kwargs["sort"] = (None, False)
         if self.limit:
             kwargs["offset"] = offset
-            kwargs["limit"] = self.limit
+            kwargs["limit"] = limit or self.limit
+        if self.query_cursor:
+            kwargs["after"] = self.query_cursors.get(kwargs["sort"]) if offset else None
+        if self.query_filters:
+            kwargs["filters"] = tuple(self.pushed_filters or ())
+        return kwargs
+
+    def supports_query_filters(self, filters):
+        """
+        Return True if query() can apply ``filters`` itself when
+        query_filters is set.  Filters it can't are applied in memory.
+        """
+        return False
+
+    def update_cursor(self, sort, rows):
+        """
+        Remember the sort value and index of the last row of a page, which
+        query() gets as ``after`` when the next page is loaded.
+        """
+        if not rows:
+            return
+        last = rows[-1]
+        self.query_cursors[sort] = (
+            last.get(sort[0]) if sort and sort[0] else None,
+            last.get(self.index)
+        )
+
+    def query_rows(self, **kwargs):
+        """
+        Return the rows query() returns for ``kwargs``, from the query cache
+        if there is one and it has them.
+        """
+        if self.query_cache is None:
+            return list(self.query(**kwargs))
+        rows = self.query_cache.get(kwargs)
+        if rows is None:
+            rows = self.query_cache.put(kwargs, list(self.query(**kwargs)))
+        return rows
+
+    def reconcile(self, kwargs):
+        """
+        Run the query for ``kwargs`` in a worker thread, save the result to
+        the persistent cache, and merge it into the table from the main loop
+        in place of the cached rows shown in the meantime.  If query() can't
+        be called from another thread (see query_threadsafe), it's run from
+        the main loop once the cached rows have been drawn.
+        """
+        self._reconcile_generation += 1
+        generation = self._reconcile_generation
+
+        def run():
+            try:
+                rows = list(self.query(**kwargs))
+                self.persistent_cache.put(kwargs, rows)
+            except Exception as e:
+                logger.error("background query failed: %s" %(e))
+                return False
+            self._reconciled.append((generation, kwargs, rows))
+            return True
+
+        if not self.query_threadsafe:
+            def on_alarm(loop, user_data):
+                if run():
+                    self.on_reconciled(None)
+            self.main_loop.set_alarm_in(0, on_alarm)
+            return
+
+        def worker():
+            if run():
+                os.write(self.reconcile_pipe, b"r")
 
-        if self.data:
+        self.reconcile_pipe # create the pipe from the main thread
+        self._reconcile_thread = threading.Thread(target=worker)
+        self._reconcile_thread.daemon = True
+        self._reconcile_thread.start()
+
+    @property
+    def reconcile_pipe(self):
+        if self._reconcile_pipe is None:
+            self._reconcile_pipe = self.main_loop.watch_pipe(self.on_reconciled)
+        return self._reconcile_pipe
+
+    def on_reconciled(self, data):
+        while self._reconciled:
+            generation, kwargs, rows = self._reconciled.popleft()
+            if (generation != self._reconcile_generation
+                or query_key(kwargs) != query_key(self.query_kwargs())):
+                # the table was queried again, or with other parameters,
+                # since this query started
+                continue
+            if self.query_cache is not None:
+                self.query_cache.put(kwargs, rows)
+            if self.page > 1:
+                # more pages were loaded since; bring them all up to date
+                self.refresh(diff=True)
+            else:
+                if self.query_cursor:
+                    self.update_cursor(kwargs["sort"], rows)
+                self.merge_rows(rows)
+        return True
+
+    def invalidate_query_cache(self):
+        """Forget cached query results, e.g. after the backend data changed."""
+        if self.query_cache is not None:
+            self.query_cache.clear()
+
+    def requery(self, offset=0, load_all=False, **kwargs):
+
+        # logger.info("requery")
+        kwargs = self.query_kwargs(offset, load_all=load_all)
+        if not offset:
+            # results of an earlier background query are out of date
+            self._reconcile_generation += 1
+
+        if self.data is not None:
             rows = self.data
+        elif (self.persistent_cache is not None and self.main_loop
+              and not offset and not load_all):
+            rows = self.persistent_cache.get(kwargs)
+            if rows is None:
+                rows = self.persistent_cache.put(kwargs, self.query_rows(**kwargs))
+            else:
+                self.reconcile(kwargs)
         else:
-            rows = list(self.query(**kwargs))
+            rows = self.query_rows(**kwargs)
+        if self.query_cursor and self.data is None:
+            self.update_cursor(kwargs["sort"], rows)
         self.append_rows(rows)
         self.refresh_calculated_fields()
         self.apply_filters()
@@ -798,11 +1562,140 @@ class DataTable(urwid.WidgetWrap, urwid.listbox.ListWalker):
 
     def append_rows(self, rows):
         # logger.info("append_rows: %s" %([row[self.index] for row in rows]))
+        start = len(self.df)
         self.df.append_rows(rows)
-        self.df["_focus_position"] = self.sort_column
+        added = range(start, len(self.df))
+        self.df.set_positions("_focus_position", added,
+                              [self.sort_column] * len(added))
         self.invalidate()
         self._modified()
 
+    def upsert_rows(self, rows):
+        """
+        Update the rows whose index already exists in place and append the
+        rest.  Only the rows in the batch are re-rendered and re-filtered, so
+        the cost doesn't grow with the size of the table.
+        """
+        changed, added = self.df.upsert_rows(rows)
+        self.rows_changed(changed, list(added))
+
+    def update_cells(self, updates):
+        """
+        Write ``{index: {column: value}}`` to the table in bulk.  Only the
+        calculated columns that depend on the changed columns are recomputed,
+        rows are re-filtered or re-sorted only if a filtered or sorted column
+        changed, and rows that are already rendered only have their changed
+        cells rebuilt.
+        """
+        changed = self.df.update_rows(dict(
+            (self.index_to_position(index), values)
+            for index, values in updates.items()
+        ))
+        self.rows_changed(changed)
+
+    def rows_changed(self, changed, added=[]):
+        """
+        Bring the table up to date after the rows at the positions in
+        ``changed`` had the columns it maps them to modified, and the rows
+        at ``added`` were appended to the dataframe.
+        """
+        if not (changed or added):
+            return
+        self.update_calculated_fields(changed)
+        self.filter_cache.invalidate(list(changed))
+        columns = set().union(*changed.values())
+
+        for p, row_columns in changed.items():
+            row = self.df.get_location(p, "_rendered_row")
+            if row is None or self.df.get_location(p, "_dirty"):
+                continue
+            row.update_cells(dict(
+                (c, self.df.get_location(p, c)) for c in row_columns
+            ))
+            focus = self.df.get_location(p, "_focus_position")
+            if focus is not None:
+                row.set_focus_column(focus)
+
+        if added:
+            self.df.set_positions("_dirty", added, [True] * len(added))
+            self.df.set_positions("_focus_position", added,
+                                  [self.sort_column] * len(added))
+            self.refresh_calculated_fields(
+                [self.position_to_index(p) for p in added]
+            )
+
+        if "filter" in self._pending:
+            pass
+        elif self.filters and self.filters_depend_on(columns):
+            self.refilter_positions(list(changed) + added)
+        elif added:
+            self.refilter_positions(added)
+
+        if not self.manual_order and (self.multi_sort_by or self.sort_by[0]):
+            moved = [ p for p, row_columns in changed.items()
+                      if self.sort_depends_on(row_columns) ] + list(added)
+            if not moved:
+                pass
+            elif self._batch_depth:
+                self._pending.add("sort")
+            else:
+                self.place_rows(moved)
+
+        if self.with_footer and (added or any(
+                c.footer_fn and c.name in columns for c in self.columns)):
+            if self._batch_depth:
+                self._pending.add("footer")
+            else:
+                self.footer.update()
+        self._modified()
+
+    def update_calculated_fields(self, changed):
+        """
+        Recompute calculated columns for the changed rows whose
+        ``value_depends`` columns changed, adding any calculated column whose
+        value changed to the row's set of changed columns.
+        """
+        for col in self.columns:
+            if not col.value_fn: continue
+            positions = [
+                p for p, columns in changed.items()
+                if col.value_depends is None
+                or columns.intersection(col.value_depends)
+            ]
+            updates = dict()
+            for p, row in zip(positions, self.df.iterlocations(positions)):
+                value = col.value_fn(self, row)
+                if value != row.get(col.name):
+                    updates[p] = value
+            if not updates:
+                continue
+            self.df.set_positions(col.name, list(updates), list(updates.values()))
+            for p in updates:
+                changed[p].add(col.name)
+
+    def filters_depend_on(self, columns):
+        return any(not isinstance(f, DataTableFilter) or f.column in columns
+                   for f in self.filters or [])
+
+    def sort_depends_on(self, columns):
+        return any(c in columns for c, reverse in self.multi_sort_by or [self.sort_by])
+
+    def refilter_positions(self, positions):
+        """
+        Evaluate the current filters on the rows at ``positions`` and add or
+        remove them from the filtered rows accordingly.
+        """
+        filters = self.filters or []
+        for p, row in zip(positions, self.df.iterlocations(positions)):
+            passed = all(f(row) for f in filters)
+            i = self.filtered_row_location(p)
+            present = i < len(self.filtered_rows) and self.filtered_rows[i] == p
+            if passed and not present:
+                self.filtered_rows.insert(i, p)
+            elif present and not passed:
+                del self.filtered_rows[i]
+        self.filter_stack = []
+
     def add_columns(self, columns, data=None):
 
         if not isinstance(columns, list):
@@ -811,8 +1704,12 @@ class DataTable(urwid.WidgetWrap, urwid.listbox.ListWalker):
                 data = [data]
 
         self.columns += columns
+        self.filter_cache.clear()
         for i, column in enumerate(columns):
+            self.df.set_dtype(column.name, column.dtype)
+            self.df.set_collation(column.name, column.collation)
             self.df[column.name] = data=data[i] if data else None
+        self.df.set_derived([ c.name for c in self.columns if c.value_fn ])
 
         self.invalidate()
 
@@ -826,6 +1723,7 @@ class DataTable(urwid.WidgetWrap, urwid.listbox.ListWalker):
                     else column for column in columns ]
 
         self.columns = [ c for c in self.columns if c.name not in columns ]
+        self.filter_cache.clear()
         self.df.delete_columns(columns)
         self.invalidate()
 
@@ -892,21 +1790,195 @@ class DataTable(urwid.WidgetWrap, urwid.listbox.ListWalker):
 
     def add_row(self, data, sort=True):
 
+        if self.tail:
+            self.tail_rows([data])
+            return
         self.append_rows([data])
-        if sort:
+        if (sort and not self.manual_order and not self.query_sort
+            and not self._batch_depth):
+            # put the new row in place rather than sorting and filtering
+            # the whole table again
+            self.rows_changed({}, [len(self.df) - 1])
+            return
+        index = self.position_to_index(len(self.df) - 1)
+        if self._batch_depth:
+            self._batch_added.append(index)
+        else:
+            self.refresh_calculated_fields(index)
+        if sort and not self.manual_order:
             self.sort_by_column()
         self.apply_filters()
         # else:
         #     self.invalidate()
 
+    def post_updates(self, ops):
+        """
+        Queue changes to be applied on the main loop.  Safe to call from any
+        thread.  ``ops`` is a list of tuples:
+
+            ("insert", row) or ("upsert", row)
+            ("update", index, {column: value, ...})
+            ("delete", index)
+
+        Everything queued by the time the main loop gets to it is applied as
+        one batch.  Inserting an index that exists updates that row, and
+        updates to an index that doesn't exist are ignored.  The table must
+        have a main loop; use apply_updates() to apply ops directly.
+        """
+        pipe = self.update_pipe
+        self._posted.extend(ops)
+        if not self._posted_signalled:
+            self._posted_signalled = True
+            os.write(pipe, b"u")
+
+    @property
+    def update_pipe(self):
+        with self._update_pipe_lock:
+            if self._update_pipe is None:
+                if not self.main_loop:
+                    raise Exception("post_updates requires a main loop")
+                self._update_pipe = self.main_loop.watch_pipe(self.drain_updates)
+        return self._update_pipe
+
+    def drain_updates(self, data=None):
+        # Clear the flag first so anything queued from here on gets a wakeup
+        self._posted_signalled = False
+        ops = []
+        while True:
+            try:
+                ops.append(self._posted.popleft())
+            except IndexError:
+                break
+        self.apply_updates(ops)
+        return True
+
+    def apply_updates(self, ops):
+        """
+        Apply a list of ops as described in post_updates() in one batch,
+        merging consecutive inserts and updates into a single upsert.
+        """
+        rows = []
+        pending = set()
+        deletes = []
+
+        def flush():
+            if rows:
+                self.upsert_rows(rows)
+                del rows[:]
+                pending.clear()
+            if deletes:
+                indexes = [ i for i in OrderedDict.fromkeys(deletes)
+                            if self.df.has_index(i) ]
+                if indexes:
+                    self.delete_rows(indexes)
+                del deletes[:]
+
+        with self.batch():
+            for op in ops:
+                if op[0] in ("insert", "upsert"):
+                    if deletes: flush()
+                    rows.append(op[1])
+                    pending.add(op[1].get(self.index))
+                elif op[0] == "update":
+                    if deletes: flush()
+                    if op[1] not in pending and not self.df.has_index(op[1]):
+                        logger.warning("update for unknown index: %s" %(op[1]))
+                        continue
+                    row = dict(op[2])
+                    row[self.index] = op[1]
+                    rows.append(row)
+                elif op[0] == "delete":
+                    if rows: flush()
+                    deletes.append(op[1])
+                else:
+                    raise Exception("unknown update: %s" %(op[0]))
+            flush()
+
+    def tail_rows(self, rows):
+        """
+        Queue rows to be appended in tail mode.  Queued rows are added at
+        most ``tail_fps`` times a second when there's a main loop, and only
+        the newest ``tail_capacity`` rows are kept.
+        """
+        self._tail_rows.extend(rows)
+        if not self.main_loop:
+            self.flush_tail()
+        elif self._tail_alarm is None:
+            self._tail_alarm = self.main_loop.set_alarm_in(
+                1.0 / self.tail_fps, lambda loop, user_data: self.flush_tail()
+            )
+
+    def flush_tail(self):
+
+        self._tail_alarm = None
+        rows = list(self._tail_rows)
+        self._tail_rows.clear()
+        if not rows:
+            return
+        rows = rows[-self.tail_capacity:]
+        following = not len(self) or self.focus_position >= len(self) - 1
+        focus_index = None
+        if not following:
+            focus_index = self.position_to_index(self.filtered_rows[self.focus_position])
+
+        # the oldest rows go first, wherever sorting has put them
+        if not self._tail_order:
+            self._tail_order.extend(self.df.index)
+        evict = []
+        while (self._tail_order
+               and len(self.df) - len(evict) + len(rows) > self.tail_capacity):
+            index = self._tail_order.popleft()
+            if self.df.has_index(index):
+                evict.append(index)
+        dropped = 0
+        if evict == self.df.index[:len(evict)]:
+            dropped = self.delete_head_rows(len(evict))
+        else:
+            self.delete_rows(evict)
+
+        start = len(self.df)
+        self.df.append_rows(rows)
+        self._tail_order.extend(self.df.index[start:])
+        self.rows_changed({}, list(range(start, len(self.df))))
+
+        if following:
+            self._focus = max(len(self) - 1, 0)
+        elif self.df.has_index(focus_index):
+            self._focus = self.filtered_row_location(self.index_to_position(focus_index))
+        else:
+            self._focus = max(min(self._focus - dropped, len(self) - 1), 0)
+
     def delete_rows(self, indexes):
+        if not isinstance(indexes, list):
+            indexes = [indexes]
+        positions = sorted(self.index_to_position(index) for index in indexes)
+        self.filter_cache.delete(positions)
+        for index in indexes:
+            self.row_ranks.pop(index, None)
         self.df.delete_rows(indexes)
-        self.apply_filters()
+        if "filter" not in self._pending:
+            # drop the deleted rows and shift the ones after them, leaving
+            # the other rendered rows alone
+            deleted = set(positions)
+            self.filtered_rows = blist(
+                p - bisect.bisect_left(positions, p)
+                for p in self.filtered_rows if p not in deleted
+            )
+            self.filter_stack = []
         if self.focus_position >= len(self)-1:
             self.focus_position = len(self)-1
+        if self.with_footer:
+            if self._batch_depth:
+                self._pending.add("footer")
+            else:
+                self.footer.update()
+        self._modified()
 
 
     def invalidate(self):
+        if self._batch_depth:
+            self._pending.add("invalidate")
+            return
         self.df["_dirty"] = True
         if self.with_header:
             self.header.update()
@@ -920,6 +1992,8 @@ class DataTable(urwid.WidgetWrap, urwid.listbox.ListWalker):
         for index in indexes:
             self.refresh_calculated_fields(index)
 
+        self.filter_cache.invalidate(
+            [self.index_to_position(index) for index in indexes])
         self.df[indexes, "_dirty"] = True
         self._modified()
         # FIXME: update header / footer if dynamic
@@ -949,8 +2023,119 @@ class DataTable(urwid.WidgetWrap, urwid.listbox.ListWalker):
     def swap_rows(self, p0, p1, field=None):
         # r0 = self[self.position_to_index(p0)]
         # r1 = self[self.position_to_index(p1)]
+        if self.manual_order:
+            # just swap the rows' places in the display order
+            i0 = self.position_to_index(self.filtered_rows[p0])
+            i1 = self.position_to_index(self.filtered_rows[p1])
+            self.row_ranks[i0], self.row_ranks[i1] = (
+                self.row_rank(self.filtered_rows[p1]),
+                self.row_rank(self.filtered_rows[p0])
+            )
+            self.filtered_rows[p0], self.filtered_rows[p1] = (
+                self.filtered_rows[p1], self.filtered_rows[p0]
+            )
+            self._modified()
+            return
         self.swap_rows_by_field(p0, p1, field=field)
 
+    def move_row(self, src, dst):
+        """
+        Move the row shown at position ``src`` to position ``dst``.  Only the
+        display order changes, so no row data is copied and rendered rows
+        stay valid.
+        """
+        if not self.manual_order:
+            raise Exception("move_row requires manual_order")
+        if src == dst:
+            return
+        p = self.filtered_rows.pop(src)
+        self.row_rank(p)
+        self.row_ranks[self.position_to_index(p)] = self.rank_at(dst)
+        self.filtered_rows.insert(dst, p)
+        if self.focus_position == src:
+            self.focus_position = dst
+        self._modified()
+
+    def on_drag_stop(self, source, drag_from, drag_to):
+        src = self.listbox.position_at_row(drag_from[1])
+        dst = self.listbox.position_at_row(drag_to[1])
+        if src is not None and dst is not None:
+            self.move_row(src, dst)
+
+    def row_rank(self, p):
+        # Rows are shown in order of rank in manual order mode.  Rows that
+        # don't have one yet are ranked after all the others, in the order
+        # they appear in the dataframe.
+        index = self.position_to_index(p)
+        try:
+            return self.row_ranks[index]
+        except KeyError:
+            pass
+        # unranked rows are normally the ones appended since ranks were
+        # last handed out, so only look back from the end until a ranked one
+        unranked = []
+        for i in reversed(self.df.index):
+            if i in self.row_ranks:
+                break
+            unranked.append(i)
+        for i in reversed(unranked):
+            self.row_ranks[i] = self._next_rank
+            self._next_rank += 1
+        if index not in self.row_ranks:
+            for i in self.df.index:
+                if i not in self.row_ranks:
+                    self.row_ranks[i] = self._next_rank
+                    self._next_rank += 1
+        return self.row_ranks[index]
+
+    def rank_at(self, i):
+        """
+        Return a rank that places a row at position ``i`` of the filtered
+        rows, between the ranks of its neighbors.
+        """
+        while True:
+            if i >= len(self.filtered_rows):
+                rank = self._next_rank
+                self._next_rank += 1
+                return rank
+            hi = self.row_rank(self.filtered_rows[i])
+            if i == 0:
+                # below every rank handed out so far
+                self._first_rank = min(self._first_rank, hi) - 1
+                return self._first_rank
+            lo = self.row_rank(self.filtered_rows[i-1])
+            rank = (lo + hi) / 2.0
+            if lo < rank < hi:
+                return rank
+            # out of float precision between the neighbors
+            self.renumber_ranks()
+
+    def renumber_ranks(self):
+        for rank, index in enumerate(sorted(self.row_ranks, key=self.row_ranks.__getitem__)):
+            self.row_ranks[index] = rank
+        self._next_rank = len(self.row_ranks)
+        self._first_rank = 0
+
+    def display_key(self, p):
+        return self.row_rank(p) if self.manual_order else p
+
+    def order_positions(self, positions):
+        if not self.manual_order:
+            return positions
+        return sorted(positions, key=self.row_rank)
+
+    def filtered_row_location(self, p):
+        # where position p is, or would be inserted, in the filtered rows
+        key = self.display_key(p)
+        lo, hi = 0, len(self.filtered_rows)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.display_key(self.filtered_rows[mid]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
     def row_count(self):
 
         if not self.with_scrollbar:
@@ -971,30 +2156,119 @@ class DataTable(urwid.WidgetWrap, urwid.listbox.ListWalker):
         logger.info("load_more: page: %s, offset: %s, len: %s" %(self.page, offset, self.row_count()))
         self.requery(offset)
         self.page += 1
+        if self.max_pages and self.page - self.first_page > self.max_pages:
+            # drop the page furthest above the rows just loaded
+            dropped = self.delete_head_rows(self.limit)
+            self.first_page += 1
+            self._focus = max(self._focus - dropped, 0)
+
+    def load_previous(self):
+        """
+        Load the page before the first one loaded again after load_more()
+        dropped it, dropping the last page if that goes over max_pages.
+        """
+        if not self.first_page:
+            return
+        self.load_head(self.first_page - 1)
+        if self.max_pages and self.page - self.first_page > self.max_pages:
+            count = min(self.limit, len(self.df))
+            self.delete_rows(list(self.df.index[len(self.df)-count:]))
+            self.page -= 1
+            if self.query_cursor:
+                # the next page starts after the new last row
+                sort = self.query_kwargs()["sort"]
+                last = self.df.index[-1] if len(self.df) else None
+                self.query_cursors.pop(sort, None)
+                if last is not None:
+                    self.update_cursor(sort, [{
+                        sort[0]: self.df.get(last, sort[0]) if sort[0] else None,
+                        self.index: last
+                    }])
+
+    def load_head(self, first):
+        """Load pages ``first`` up to the first one loaded, above the loaded rows."""
+        kwargs = self.query_kwargs(first*self.limit,
+                                   limit=(self.first_page-first)*self.limit)
+        if self.query_cursor:
+            kwargs["after"] = None
+        rows = self.query_rows(**kwargs)
+        count = len(self.df)
+        before = len(self)
+        self.append_rows(rows)
+        self.reorder(list(range(count, len(self.df))) + list(range(count)))
+        self.first_page = first
+        self.refresh_calculated_fields()
+        self.apply_filters()
+        self._focus += len(self) - before
+
+    def delete_head_rows(self, count):
+        """
+        Delete the first ``count`` rows of the dataframe, returning how many
+        of them were shown.
+        """
+        count = min(count, len(self.df))
+        if count <= 0:
+            return 0
+        self.filter_cache.delete_head(count)
+        for index in self.df.index[:count]:
+            self.row_ranks.pop(index, None)
+        self.df.delete_head(count)
+        dropped = bisect.bisect_left(self.filtered_rows, count)
+        self.filtered_rows = blist(p - count for p in self.filtered_rows[dropped:])
+        self.filter_stack = []
+        self._modified()
+        return dropped
 
     def load_all(self):
-        if len(self) >= self.query_result_count():
+        if len(self.df) >= self.query_result_count():
             return
         logger.info("load_all: %s" %(self.page))
+        if self.first_page:
+            self.load_head(0)
         self.requery(self.page*self.limit, load_all=True)
         self.page = (self.query_result_count() // self.limit)
         self.listbox._invalidate()
 
     def apply_filters(self, filters=None):
 
+        if self.query_filters and filters:
+            if not isinstance(filters, list):
+                filters = [filters]
+            if self.supports_query_filters(filters):
+                self.pushed_filters = filters
+                self.filters = filters
+                self.reset()
+                return
+            elif self.pushed_filters:
+                # the new filters replace the ones in the query
+                self.pushed_filters = None
+                self.reset()
+
         if not filters:
             filters = self.filters
         elif not isinstance(filters, list):
             filters = [filters]
 
-        self.filtered_rows = blist(
-            i
-            for i, row in enumerate(self.df.iterrows())
-            if not filters or all(
-                    f(row)
-                    for f in filters
-            )
-        )
+        if self._batch_depth:
+            self.filters = filters
+            self._pending.add("filter")
+            return
+
+        if filters and filters == self.pushed_filters:
+            # the query already applied them
+            positions = list(range(len(self.df)))
+        else:
+            positions = self.refined_positions(filters)
+        if positions is None:
+            positions = self.filter_positions(filters)
+            self.filter_stack = []
+        key = tuple(filters or ())
+        if not self.filter_stack or self.filter_stack[-1][0] != key:
+            self.filter_stack.append((key, positions))
+            del self.filter_stack[:-self.filter_stack_size]
+        self.filter_stack_version = self.df.version
+
+        self.filtered_rows = blist(self.order_positions(positions))
         if self.focus_position > len(self):
             self.focus_position = len(self)-1
 
@@ -1004,22 +2278,233 @@ class DataTable(urwid.WidgetWrap, urwid.listbox.ListWalker):
         self.filters = filters
         self.invalidate()
 
+    def refined_positions(self, filters):
+        """
+        Try to derive the rows passing ``filters`` from the stack of recent
+        filter results instead of scanning the whole dataframe.  Going back
+        to an earlier set of filters (e.g. backspace in a search box) reuses
+        its saved result, and adding a filter or replacing one with a filter
+        that refines it only evaluates the rows currently shown, or with
+        cache_filters, intersects them with the new filter's bitmap.
+        Returns None if the stack can't help.
+        """
+        if not self.filter_stack or self.filter_stack_version != self.df.version:
+            return None
+        filters = tuple(filters or ())
+
+        for i, (previous, positions) in enumerate(self.filter_stack):
+            if previous == filters:
+                del self.filter_stack[i+1:]
+                return positions
+
+        current, positions = self.filter_stack[-1]
+        if len(filters) == len(current) + 1 and filters[:-1] == current:
+            new = filters[-1]
+        elif len(filters) == len(current):
+            changed = [ (old, new) for old, new in zip(current, filters)
+                        if old != new ]
+            if len(changed) != 1:
+                return None
+            old, new = changed[0]
+            if not (isinstance(new, DataTableFilter) and new.refines(old)):
+                return None
+        else:
+            return None
+
+        if self.cache_filters:
+            bitmap = self.filter_cache.bitmap(new)
+            if len(positions) < len(self.df):
+                bitmap &= positions_bitmap(positions)
+            return bitmap_positions(bitmap)
+        return self.scan_positions(positions, [new])
+
+    def filter_positions(self, filters):
+        """
+        Return the positions of the dataframe rows that pass every filter.
+        Filters that can be answered from a secondary index narrow the set
+        of candidate rows before the rest are evaluated.
+        """
+        if not filters:
+            return range(len(self.df))
+
+        candidates = None
+        remaining = []
+        for f in filters:
+            positions = self.df.select_positions(f)
+            if positions is None:
+                remaining.append(f)
+            elif candidates is None:
+                candidates = positions
+            else:
+                candidates = sorted(set(candidates).intersection(positions))
+
+        if self.cache_filters and remaining:
+            bitmap = functools.reduce(
+                operator.and_,
+                (self.filter_cache.bitmap(f) for f in remaining)
+            )
+            if candidates is not None:
+                bitmap &= positions_bitmap(candidates)
+            return bitmap_positions(bitmap)
+
+        return self.scan_positions(candidates, remaining)
+
+    def scan_positions(self, positions, filters):
+        """
+        Evaluate ``filters`` on the rows at ``positions``, or on every row if
+        ``positions`` is None, in the process pool if the table is set up
+        for parallel evaluation and there are enough rows.
+        """
+        if positions is None:
+            rows = enumerate(self.df.iterrows())
+            count = len(self.df)
+        else:
+            rows = zip(positions, self.df.iterlocations(positions))
+            count = len(positions)
+        if self.can_parallelize(filters, count):
+            return self.parallel_filter_positions(rows, filters)
+        return self.scan_filters(rows, filters)
+
+    def get_filter_stats(self, f):
+        try:
+            return self.filter_stats[f]
+        except KeyError:
+            if len(self.filter_stats) >= self.filter_stats_size:
+                self.filter_stats.popitem(last=False)
+            stats = self.filter_stats[f] = FilterStats()
+            return stats
+
+    def order_filters(self, filters):
+        """
+        Return the filters sorted by their measured cost per rejected row.
+        Filters that haven't been measured yet keep their relative order
+        ahead of the others.
+        """
+        def rank(f):
+            stats = self.get_filter_stats(f)
+            return stats.rank if stats.calls else -1
+        return sorted(filters, key=rank)
+
+    def scan_filters(self, rows, filters):
+        """
+        Return the positions of the (position, row) pairs that pass every
+        filter.  Every ``filter_sample_interval``-th row is evaluated against
+        each filter separately to measure its cost and pass rate, and the
+        evaluation order is periodically adjusted from those measurements.
+        """
+        if not filters:
+            return [ p for p, row in rows ]
+        interval = self.filter_sample_interval
+        ordered = self.order_filters(filters)
+        positions = []
+        for n, (p, row) in enumerate(rows):
+            if n % interval:
+                if all(f(row) for f in ordered):
+                    positions.append(p)
+                continue
+            passed = True
+            for f in ordered:
+                start = timer()
+                result = f(row)
+                self.get_filter_stats(f).record(result, timer() - start)
+                passed = passed and result
+            if passed:
+                positions.append(p)
+            if n % (interval * 16) == 0:
+                ordered = self.order_filters(filters)
+        return positions
+
     def clear_filters(self):
-        self.filtered_rows = blist(range(len(self.df)))
-        self.filters = None
+        if self.pushed_filters and not self._resetting:
+            self.pushed_filters = None
+            self.reset()
+            return
+        self.filtered_rows = blist(self.order_positions(range(len(self.df))))
+        # filters the query applies stay set while it's run again
+        self.filters = self.pushed_filters if self._resetting else None
+        self.filter_stack = []
         self.invalidate()
 
+    def refresh(self, diff=False):
+        """
+        Query the data again.  Without ``diff`` this is reset().  With
+        ``diff``, the result is compared with the loaded rows by index and
+        only the rows that were added, removed or changed are touched, so
+        unchanged rows keep their rendered widgets and focus stays on the
+        same record.
+        """
+        if not diff:
+            self.reset()
+            return
+
+        self.invalidate_query_cache()
+        self._reconcile_generation += 1
+        if self.data is not None:
+            rows = self.data
+        else:
+            kwargs = self.query_kwargs(
+                self.first_page * self.limit if self.limit else 0,
+                limit = (self.page - self.first_page) * self.limit if self.limit else None
+            )
+            if self.query_cursor:
+                # the loaded pages, by offset
+                kwargs["after"] = None
+            rows = self.query_rows(**kwargs)
+            if self.persistent_cache is not None:
+                self.persistent_cache.put(kwargs, rows)
+            if self.query_cursor:
+                self.update_cursor(kwargs["sort"], rows)
+        self.merge_rows(rows)
+
+    def merge_rows(self, rows):
+        """
+        Bring the table in line with ``rows``, the complete result of a
+        query, deleting, updating and adding only the rows that differ.
+        """
+        focus_index = None
+        if len(self):
+            focus_index = self.position_to_index(
+                self.filtered_rows[min(self.focus_position, len(self)-1)])
+
+        current = set(row.get(self.index) for row in rows)
+        deleted = [ index for index in self.df.index if index not in current ]
+
+        if deleted:
+            self.delete_rows(deleted)
+        changed, added = self.df.upsert_rows(rows)
+        self.rows_changed(changed, list(added))
+        if added and not self.manual_order:
+            if self.multi_sort_by or self.sort_by[0]:
+                # added rows were put in place by rows_changed()
+                pass
+            elif len(rows) == len(self.df):
+                # no sort of our own, so keep the order the rows came in
+                self.reorder([ self.index_to_position(row.get(self.index))
+                               for row in rows ])
+
+        if focus_index is not None and self.df.has_index(focus_index):
+            p = self.index_to_position(focus_index)
+            i = self.filtered_row_location(p)
+            if i < len(self.filtered_rows) and self.filtered_rows[i] == p:
+                self.focus_position = i
+
     def reset(self, reset_sort=False):
         logger.debug("reset")
         # self.offset = 0
         # if self.query_sort:
             # self.df.clear()
         # if requery or self.query_sort:
-        self.df.clear()
-        self.requery()
-        self.page = 1
-        self.clear_filters()
-        self.apply_filters()
+        self._resetting = True
+        try:
+            self.df.clear()
+            self.filter_cache.clear()
+            self.requery()
+            self.page = 1
+            self.first_page = 0
+            self.clear_filters()
+            self.apply_filters()
+        finally:
+            self._resetting = False
         if reset_sort:
             self.sort_by_column(self.initial_sort)
         self.focus_position = 0
@@ -1030,6 +2515,7 @@ class DataTable(urwid.WidgetWrap, urwid.listbox.ListWalker):
         with open(path, "r") as f:
             json = "\n".join(f.readlines())
             self.df = DataTableDataFrame.from_json(json)
+            self.df.set_derived([ c.name for c in self.columns if c.value_fn ])
         self.reset()
 
     def save(self, path):
@@ -0,0 +1,351 @@
+import logging
+logger = logging.getLogger("panwid.datatable")
+
+
+class DataTableFilter(object):
+    """
+    Base class for declarative filters on a single column.  Filters are
+    callable on a row dict like any other filter function, but also describe
+    themselves so DataTable can answer them from a secondary index or a
+    dictionary-encoded column instead of testing every row.
+    """
+
+    def __init__(self, column):
+        self.column = column
+
+    def __call__(self, row):
+        raise Exception("__call__ method must be overriden")
+
+    def lookup(self, index):
+        """
+        Return the indexes of the rows matching this filter according to the
+        secondary index, or None if the index can't answer it.
+        """
+        return None
+
+    def refines(self, other):
+        """
+        Return True if every row matching this filter is guaranteed to match
+        ``other``, so this filter only needs to be evaluated on the rows
+        ``other`` already selected.
+        """
+        return False
+
+    def _key(self):
+        return (self.__class__,) + tuple(
+            (k, v) for k, v in sorted(self.__dict__.items())
+            if not k.startswith("_"))
+
+    def __eq__(self, other):
+        return isinstance(other, DataTableFilter) and self._key() == other._key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        return "%s(%s)" %(
+            self.__class__.__name__,
+            ", ".join("%s=%r" %(k, v) for k, v in sorted(self.__dict__.items())
+                      if not k.startswith("_"))
+        )
+
+
+class EqualsFilter(DataTableFilter):
+
+    def __init__(self, column, value):
+        super(EqualsFilter, self).__init__(column)
+        self.value = value
+
+    def __call__(self, row):
+        return row.get(self.column) == self.value
+
+    def lookup(self, index):
+        return index.equal(self.value)
+
+
+class IsInFilter(DataTableFilter):
+
+    def __init__(self, column, values):
+        super(IsInFilter, self).__init__(column)
+        self.values = frozenset(values)
+
+    def __call__(self, row):
+        return row.get(self.column) in self.values
+
+    def lookup(self, index):
+        return index.isin(self.values)
+
+    def refines(self, other):
+        return (isinstance(other, IsInFilter)
+                and other.column == self.column
+                and self.values <= other.values)
+
+
+class RangeFilter(DataTableFilter):
+    """
+    Matches non-null values between ``lower`` and ``upper``.  Either bound
+    may be None to leave that side open.
+    """
+
+    def __init__(self, column, lower=None, upper=None,
+                 include_lower=True, include_upper=True):
+        super(RangeFilter, self).__init__(column)
+        self.lower = lower
+        self.upper = upper
+        self.include_lower = include_lower
+        self.include_upper = include_upper
+
+    def __call__(self, row):
+        v = row.get(self.column)
+        if v is None:
+            return False
+        if self.lower is not None:
+            if v < self.lower or (v == self.lower and not self.include_lower):
+                return False
+        if self.upper is not None:
+            if v > self.upper or (v == self.upper and not self.include_upper):
+                return False
+        return True
+
+    def lookup(self, index):
+        return index.range(self.lower, self.upper,
+                           self.include_lower, self.include_upper)
+
+    def refines(self, other):
+        if not (isinstance(other, RangeFilter) and other.column == self.column):
+            return False
+        if other.lower is not None:
+            if self.lower is None or self.lower < other.lower:
+                return False
+            if (self.lower == other.lower
+                and self.include_lower and not other.include_lower):
+                return False
+        if other.upper is not None:
+            if self.upper is None or self.upper > other.upper:
+                return False
+            if (self.upper == other.upper
+                and self.include_upper and not other.include_upper):
+                return False
+        return True
+
+
+class SubstringFilter(DataTableFilter):
+    """
+    Matches rows whose value in ``column`` contains ``text``.  Extending the
+    text refines the previous filter, so search-as-you-type filtering only
+    has to look at the rows that matched the shorter text.
+    """
+
+    def __init__(self, column, text, case_sensitive=False):
+        super(SubstringFilter, self).__init__(column)
+        self.text = text
+        self.case_sensitive = case_sensitive
+        self._needle = text if case_sensitive else text.lower()
+
+    def __call__(self, row):
+        if not self._needle:
+            return True
+        v = row.get(self.column)
+        if v is None:
+            return False
+        v = v if isinstance(v, str) else str(v)
+        return self._needle in (v if self.case_sensitive else v.lower())
+
+    def refines(self, other):
+        return (isinstance(other, SubstringFilter)
+                and other.column == self.column
+                and other.case_sensitive == self.case_sensitive
+                and other._needle in self._needle)
+
+
+class FilterStats(object):
+    """
+    Running measurements of one filter's cost per call and pass rate, used
+    to order filters so the cheapest, most selective ones run first.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.passed = 0
+        self.elapsed = 0.0
+
+    def record(self, passed, elapsed):
+        self.calls += 1
+        self.passed += 1 if passed else 0
+        self.elapsed += elapsed
+
+    @property
+    def cost(self):
+        return self.elapsed / self.calls if self.calls else 0.0
+
+    @property
+    def pass_rate(self):
+        return float(self.passed) / self.calls if self.calls else 0.0
+
+    @property
+    def rank(self):
+        """
+        Expected cost of evaluating the filter per row it rejects.  Running
+        filters in increasing rank order minimizes the expected cost of
+        evaluating a conjunction of independent filters.
+        """
+        if self.pass_rate >= 1:
+            return float("inf")
+        return self.cost / (1 - self.pass_rate)
+
+    def __repr__(self):
+        return "FilterStats(calls=%d, cost=%.3gs, pass_rate=%.3f)" %(
+            self.calls, self.cost, self.pass_rate)
+
+
+def bitmap_positions(bitmap):
+    """Return the positions of the set bits in an integer bitmap."""
+    return [ i for i, bit in enumerate(bin(bitmap)[:1:-1]) if bit == "1" ]
+
+def positions_bitmap(positions):
+    bitmap = 0
+    for p in positions:
+        bitmap |= 1 << p
+    return bitmap
+
+
+class FilterBitmapCache(object):
+    """
+    Caches the result of each filter as a bitmap over dataframe row
+    positions.  Bitmaps are Python ints, so combining filters is a bitwise
+    AND over machine words, and only rows that were appended or marked dirty
+    since a bitmap was built are evaluated again.
+
+    ``frame_fn`` returns the DataTableDataFrame the bitmaps describe.
+    delete(), move() and permute() must be called before the frame is
+    changed.
+    """
+
+    def __init__(self, frame_fn, max_size=32):
+
+        self.frame_fn = frame_fn
+        self.max_size = max_size
+        self.clear()
+
+    def __len__(self):
+        return len(self.bitmaps)
+
+    def __contains__(self, f):
+        return f in self.bitmaps
+
+    def clear(self):
+        self.bitmaps = dict()
+        self.length = 0
+        self.dirty = set()
+
+    def discard(self, f):
+        self.bitmaps.pop(f, None)
+
+    def _evaluate(self, f, start, stop):
+        bits = [ "1" if f(row) else "0"
+                 for row in self.frame_fn().iterlocations(range(start, stop)) ]
+        bits.reverse()
+        return int("".join(bits) or "0", 2)
+
+    def _sync(self):
+        length = len(self.frame_fn())
+        if length < self.length:
+            # rows went away without going through delete()
+            self.clear()
+        if self.dirty and self.bitmaps:
+            self._update(list(self.bitmaps), self.dirty)
+        self.dirty = set()
+        if length > self.length:
+            for f, bitmap in list(self.bitmaps.items()):
+                self.bitmaps[f] = bitmap | (self._evaluate(f, self.length, length)
+                                            << self.length)
+        self.length = length
+
+    def _update(self, filters, positions):
+        # evaluate ``filters`` again on the rows at ``positions``
+        positions = sorted(p for p in set(positions) if p < self.length)
+        rows = list(self.frame_fn().iterlocations(positions))
+        for f in filters:
+            bitmap = self.bitmaps[f]
+            for p, row in zip(positions, rows):
+                if f(row):
+                    bitmap |= 1 << p
+                else:
+                    bitmap &= ~(1 << p)
+            self.bitmaps[f] = bitmap
+
+    def bitmap(self, f):
+        """Return the bitmap of the rows passing filter ``f``."""
+        self._sync()
+        try:
+            return self.bitmaps[f]
+        except KeyError:
+            pass
+        if len(self.bitmaps) >= self.max_size:
+            del self.bitmaps[next(iter(self.bitmaps))]
+        bitmap = self.bitmaps[f] = self._evaluate(f, 0, self.length)
+        return bitmap
+
+    def invalidate(self, positions, columns=None):
+        """
+        Mark rows whose values changed so they're evaluated again.  If the
+        changed ``columns`` are given, only the bitmaps of filters that may
+        read them are updated; this is how changes to calculated columns,
+        which don't change the frame's version, are handled.
+        """
+        if columns is None:
+            self.dirty.update(positions)
+            return
+        self._sync()
+        self._update([
+            f for f in self.bitmaps
+            if not isinstance(f, DataTableFilter) or f.column in columns
+        ], positions)
+
+    def delete(self, positions):
+        """Drop the bits for rows about to be deleted."""
+        self._sync()
+        positions = sorted(set(p for p in positions if p < self.length), reverse=True)
+        for f, bitmap in list(self.bitmaps.items()):
+            for p in positions:
+                bitmap = (bitmap & ((1 << p) - 1)) | ((bitmap >> (p + 1)) << p)
+            self.bitmaps[f] = bitmap
+        self.length -= len(positions)
+
+    def delete_head(self, count):
+        """Drop the bits for the first ``count`` rows, about to be deleted."""
+        self._sync()
+        count = min(count, self.length)
+        for f, bitmap in list(self.bitmaps.items()):
+            self.bitmaps[f] = bitmap >> count
+        self.length -= count
+
+    def move(self, old, new):
+        """Move the bit for a row about to be moved from ``old`` to ``new``."""
+        self._sync()
+        for f, bitmap in list(self.bitmaps.items()):
+            bit = (bitmap >> old) & 1
+            bitmap = (bitmap & ((1 << old) - 1)) | ((bitmap >> (old + 1)) << old)
+            self.bitmaps[f] = ((bitmap & ((1 << new) - 1))
+                               | ((((bitmap >> new) << 1) | bit) << new))
+
+    def permute(self, order):
+        """Rearrange the bitmaps for rows about to be reordered."""
+        self._sync()
+        if len(order) != self.length:
+            self.clear()
+            return
+        for f, bitmap in list(self.bitmaps.items()):
+            bits = format(bitmap, "0%db" %(self.length))[::-1] if self.length else ""
+            bits = "".join(bits[i] for i in reversed(order))
+            self.bitmaps[f] = int(bits or "0", 2)
+
+
+__all__ = [
+    "DataTableFilter", "EqualsFilter", "IsInFilter", "RangeFilter",
+    "SubstringFilter", "FilterStats",
+    "FilterBitmapCache", "bitmap_positions", "positions_bitmap",
+]
@@ -0,0 +1,338 @@
+import logging
+logger = logging.getLogger("panwid.datatable")
+
+from .datatable import *
+from .filters import *
+from .cache import query_key
+
+# imported by import_arrays() when an array source is created, so that
+# importing panwid doesn't load them
+np = None
+pd = None
+
+
+def import_arrays():
+    """Import numpy, and pandas if it's installed."""
+    global np, pd
+    if np is not None:
+        return
+    try:
+        import numpy
+    except ImportError:
+        raise Exception("numpy is required for array data sources")
+    try:
+        import pandas
+    except ImportError:
+        pandas = None
+    np, pd = numpy, pandas
+
+
+class DataSource(object):
+    """
+    Columnar data that ArrayDataTable can query: select() returns the
+    positions of the rows passing some filters in some sort order, page()
+    slices a selection, and rows() builds the row dicts for a page.
+
+    select() is built on a few array primitives subclasses supply: column(),
+    compute_mask(), make_mask(), and_masks(), nonzero(), take() and
+    sort_order().
+    """
+
+    index = None
+    _selection = None
+    # errors from compute_mask() that mean the filter should be evaluated
+    # in Python instead
+    mask_errors = (TypeError, ValueError)
+
+    def __len__(self):
+        raise Exception("__len__ method must be overriden")
+
+    @property
+    def columns(self):
+        raise Exception("columns property must be overriden")
+
+    def has_column(self, name):
+        return name in self.columns
+
+    def column(self, name):
+        raise Exception("column method must be overriden")
+
+    def compute_mask(self, f, values):
+        """
+        Return a boolean array of the rows passing filter ``f`` computed on
+        the column ``values``, or None if it can't be.
+        """
+        return None
+
+    def make_mask(self, values):
+        """Return a boolean array of a list of booleans."""
+        raise Exception("make_mask method must be overriden")
+
+    def and_masks(self, a, b):
+        raise Exception("and_masks method must be overriden")
+
+    def nonzero(self, mask):
+        """Return the positions of the rows set in a boolean array."""
+        raise Exception("nonzero method must be overriden")
+
+    def take(self, values, positions):
+        raise Exception("take method must be overriden")
+
+    def sort_order(self, values, reverse=False):
+        """
+        Return the positions that sort ``values``, with equal values kept in
+        position order in either direction.  Nulls sort last, or first when
+        reversed.
+        """
+        raise Exception("sort_order method must be overriden")
+
+    def to_list(self, values):
+        return list(values)
+
+    def filter_mask(self, f):
+        """Return a boolean array of the rows passing filter ``f``."""
+        values = self.column(f.column)
+        try:
+            mask = self.compute_mask(f, values)
+        except self.mask_errors as e:
+            # e.g. a filter value of a different type than the column
+            logger.debug("filtering %s in Python: %s" %(f.column, e))
+            mask = None
+        if mask is None:
+            # anything else is evaluated one value at a time
+            mask = self.make_mask([ bool(f({f.column: v}))
+                                    for v in self.to_list(values) ])
+        return mask
+
+    def select(self, sort=None, filters=None):
+        """
+        Return the positions of the rows passing ``filters`` in ``sort``
+        order, or None for all rows in their stored order.  The last
+        selection is cached.
+        """
+        column, reverse = sort if sort else (None, False)
+        if not self.has_column(column):
+            column = None
+        key = query_key((column, reverse, filters or ()))
+        if self._selection and self._selection[0] == key:
+            return self._selection[1]
+
+        positions = None
+        mask = None
+        for f in filters or []:
+            m = self.filter_mask(f)
+            mask = m if mask is None else self.and_masks(mask, m)
+        if mask is not None:
+            positions = self.nonzero(mask)
+        if column is not None:
+            values = self.column(column)
+            if positions is not None:
+                values = self.take(values, positions)
+            order = self.sort_order(values, reverse)
+            positions = order if positions is None else self.take(positions, order)
+
+        self._selection = (key, positions)
+        return positions
+
+    def count(self, sort=None, filters=None):
+        positions = self.select(sort, filters)
+        return len(self) if positions is None else len(positions)
+
+    def page(self, positions, start=0, stop=None):
+        raise Exception("page method must be overriden")
+
+    def rows(self, positions, columns):
+        raise Exception("rows method must be overriden")
+
+    def close(self):
+        pass
+
+
+class ArraySource(DataSource):
+    """
+    Read-only view over a pandas DataFrame or a dict of NumPy arrays.
+    Nothing is copied when it's created: sorts and filters are answered
+    with vectorized operations on the columns involved, and rows are only
+    built for the positions that are asked for.
+
+    If ``index`` isn't a column (or, for a DataFrame, the name of its
+    index), each row's position is used as its index value.
+    """
+
+    def __init__(self, data, index=None):
+
+        import_arrays()
+        self.data = data
+        self.index = index
+        self.is_frame = pd is not None and isinstance(data, pd.DataFrame)
+        self.arrays = dict()
+
+    def __len__(self):
+        if self.is_frame:
+            return len(self.data)
+        return len(next(iter(self.data.values()))) if self.data else 0
+
+    @property
+    def columns(self):
+        columns = list(self.data.columns if self.is_frame else self.data.keys())
+        if self.index not in columns:
+            columns.insert(0, self.index)
+        return columns
+
+    def is_position_index(self, name):
+        if name != self.index:
+            return False
+        if self.is_frame:
+            return name not in self.data.columns and self.data.index.name != name
+        return name not in self.data
+
+    def column(self, name):
+        """Return the values of a column as a NumPy array."""
+        try:
+            return self.arrays[name]
+        except KeyError:
+            pass
+        if self.is_position_index(name):
+            values = np.arange(len(self))
+        elif self.is_frame:
+            if name in self.data.columns:
+                values = self.data[name].to_numpy()
+            else:
+                values = self.data.index.to_numpy()
+        else:
+            values = np.asarray(self.data[name])
+        self.arrays[name] = values
+        return values
+
+    def values(self, name, positions):
+        """Return the values of a column at ``positions`` as Python objects."""
+        if self.is_position_index(name):
+            return positions.tolist()
+        if self.is_frame:
+            if name in self.data.columns:
+                return self.data[name].iloc[positions].tolist()
+            return self.data.index[positions].tolist()
+        return np.asarray(self.data[name])[positions].tolist()
+
+    def rows(self, positions, columns):
+        columns = [ c for c in columns if self.has_column(c) ]
+        values = [ self.values(c, positions) for c in columns ]
+        return [ dict(zip(columns, row)) for row in zip(*values) ]
+
+    def isnull(self, values):
+        if pd is not None:
+            return pd.isnull(values)
+        if values.dtype.kind == "f":
+            return np.isnan(values)
+        if values.dtype.kind == "O":
+            return np.frompyfunc(lambda v: v is None or v != v, 1, 1)(values).astype(bool)
+        return np.zeros(len(values), dtype=bool)
+
+    def compute_mask(self, f, values):
+        if isinstance(f, EqualsFilter):
+            if f.value is None:
+                return self.isnull(values)
+            return np.asarray(values == f.value, dtype=bool)
+        elif isinstance(f, IsInFilter):
+            mask = np.isin(values, [ v for v in f.values if v is not None ])
+            if None in f.values:
+                mask |= self.isnull(values)
+            return mask
+        elif isinstance(f, RangeFilter):
+            mask = ~self.isnull(values)
+            present = np.flatnonzero(mask)
+            v = values[present]
+            passed = np.ones(len(present), dtype=bool)
+            if f.lower is not None:
+                passed &= (v >= f.lower) if f.include_lower else (v > f.lower)
+            if f.upper is not None:
+                passed &= (v <= f.upper) if f.include_upper else (v < f.upper)
+            mask[present] = passed
+            return mask
+        return None
+
+    def make_mask(self, values):
+        return np.array(values, dtype=bool)
+
+    def and_masks(self, a, b):
+        return a & b
+
+    def nonzero(self, mask):
+        return np.flatnonzero(mask)
+
+    def take(self, values, positions):
+        return values[positions]
+
+    def to_list(self, values):
+        return values.tolist()
+
+    def sort_order(self, values, reverse=False):
+        try:
+            if reverse:
+                # a stable sort of the values back to front, read backwards
+                return len(values) - 1 - np.argsort(values[::-1], kind="stable")[::-1]
+            return np.argsort(values, kind="stable")
+        except TypeError:
+            # mixed or null values in an object column
+            return np.array(sorted(range(len(values)),
+                                   key=lambda i: (values[i] is None, values[i]),
+                                   reverse=reverse),
+                            dtype=np.intp)
+
+    def page(self, positions, start=0, stop=None):
+        if positions is None:
+            return np.arange(start, min(len(self), stop) if stop is not None else len(self))
+        return positions[start:stop]
+
+
+class ArrayDataTable(DataTable):
+    """
+    DataTable over a pandas DataFrame or a dict of NumPy arrays, used in
+    place rather than copied into the table:
+
+        ArrayDataTable(frame, columns=[...], limit=500)
+
+    Sorting and filtering with DataTableFilter instances are done on the
+    source arrays, and only the pages that are scrolled to are loaded, at
+    most max_pages of them at a time.
+    """
+
+    source = None
+
+    query_sort = True
+    query_filters = True
+    limit = 500
+    max_pages = 20
+
+    def __init__(self, source=None, *args, **kwargs):
+
+        if source is not None: self.source = source
+        if self.source is None:
+            raise Exception("must define a source for array data table")
+        if not isinstance(self.source, DataSource):
+            self.source = ArraySource(self.source, kwargs.get("index") or self.index)
+        super(ArrayDataTable, self).__init__(*args, **kwargs)
+
+    def supports_query_filters(self, filters):
+        return all(isinstance(f, DataTableFilter) and self.source.has_column(f.column)
+                   for f in filters)
+
+    def query(self, sort=None, offset=None, limit=None, load_all=False, filters=None):
+
+        positions = self.source.select(sort, filters)
+        start = offset or 0
+        stop = start + limit if limit and not load_all else None
+        return self.source.rows(
+            self.source.page(positions, start, stop),
+            [ c.name for c in self.columns if not c.value_fn ]
+        )
+
+    def query_result_count(self):
+        return self.source.count(self.sort_by if self.query_sort else None,
+                                 self.pushed_filters)
+
+    def close(self):
+        self.source.close()
+
+
+__all__ = ["DataSource", "ArraySource", "ArrayDataTable"]
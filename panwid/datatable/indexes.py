@@ -0,0 +1,163 @@
+import logging
+logger = logging.getLogger("panwid.datatable")
+from bisect import bisect_left, bisect_right
+
+
+class SortedIndex(object):
+    """
+    Secondary index on a DataTableDataFrame column that keeps the non-null
+    values in sorted order alongside the index of the row holding each one,
+    so range and equality lookups are a pair of bisects.
+    """
+
+    kind = "sorted"
+
+    def __init__(self, column):
+
+        self.column = column
+        self.keys = []
+        self.rows = []
+        self.nulls = set()
+
+    def __len__(self):
+        return len(self.keys) + len(self.nulls)
+
+    def clear(self):
+        self.keys = []
+        self.rows = []
+        self.nulls = set()
+
+    def build(self, values, indexes):
+        self.clear()
+        pairs = []
+        for value, index in zip(values, indexes):
+            if value is None:
+                self.nulls.add(index)
+            else:
+                pairs.append((value, index))
+        pairs.sort(key=lambda p: p[0])
+        self.keys = [p[0] for p in pairs]
+        self.rows = [p[1] for p in pairs]
+
+    def add(self, value, index):
+        if value is None:
+            self.nulls.add(index)
+            return
+        i = bisect_right(self.keys, value)
+        self.keys.insert(i, value)
+        self.rows.insert(i, index)
+
+    def remove(self, value, index):
+        if value is None:
+            self.nulls.discard(index)
+            return
+        lo = bisect_left(self.keys, value)
+        hi = bisect_right(self.keys, value)
+        try:
+            i = self.rows.index(index, lo, hi)
+        except ValueError:
+            return
+        del self.keys[i]
+        del self.rows[i]
+
+    def equal(self, value):
+        if value is None:
+            return list(self.nulls)
+        return self.rows[bisect_left(self.keys, value):bisect_right(self.keys, value)]
+
+    def isin(self, values):
+        return [index for value in set(values) for index in self.equal(value)]
+
+    def range(self, lower=None, upper=None, include_lower=True, include_upper=True):
+        if lower is None:
+            lo = 0
+        elif include_lower:
+            lo = bisect_left(self.keys, lower)
+        else:
+            lo = bisect_right(self.keys, lower)
+        if upper is None:
+            hi = len(self.keys)
+        elif include_upper:
+            hi = bisect_right(self.keys, upper)
+        else:
+            hi = bisect_left(self.keys, upper)
+        return self.rows[lo:hi]
+
+    def sorted_rows(self, reverse=False):
+        """
+        Return the indexes of the non-null rows in value order.  Rows with
+        equal values keep the order in which they were indexed, in either
+        direction.
+        """
+        if not reverse:
+            return self.rows[:]
+        rows = []
+        hi = len(self.keys)
+        while hi:
+            lo = bisect_left(self.keys, self.keys[hi-1], 0, hi)
+            rows.extend(self.rows[lo:hi])
+            hi = lo
+        return rows
+
+
+class HashIndex(object):
+    """
+    Secondary index mapping each distinct value of a column to the set of
+    row indexes holding it.  Answers equality and membership lookups only.
+    """
+
+    kind = "hash"
+
+    def __init__(self, column):
+
+        self.column = column
+        self.buckets = dict()
+
+    def __len__(self):
+        return sum(len(b) for b in self.buckets.values())
+
+    def clear(self):
+        self.buckets = dict()
+
+    def build(self, values, indexes):
+        self.clear()
+        for value, index in zip(values, indexes):
+            self.add(value, index)
+
+    def add(self, value, index):
+        self.buckets.setdefault(value, set()).add(index)
+
+    def remove(self, value, index):
+        bucket = self.buckets.get(value)
+        if bucket is None:
+            return
+        bucket.discard(index)
+        if not bucket:
+            del self.buckets[value]
+
+    def equal(self, value):
+        return list(self.buckets.get(value, ()))
+
+    def isin(self, values):
+        return [index for value in set(values) for index in self.buckets.get(value, ())]
+
+    def range(self, *args, **kwargs):
+        return None
+
+    def sorted_rows(self, reverse=False):
+        return None
+
+
+SECONDARY_INDEX_TYPES = {
+    "sorted": SortedIndex,
+    "hash": HashIndex,
+}
+
+def make_secondary_index(column, kind="sorted"):
+    try:
+        return SECONDARY_INDEX_TYPES[kind](column)
+    except KeyError:
+        raise Exception("index type %s not supported" %(kind))
+
+
+__all__ = ["SortedIndex", "HashIndex", "make_secondary_index"]
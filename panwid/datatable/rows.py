@@ -232,28 +232,44 @@ class DataTableBodyRow(DataTableRow):
         focus_map[self.ATTR] = "%s focused" %(self.ATTR)
         self.attrmap.set_focus_map(focus_map)
 
-    def make_cells(self):
+    def col_to_attr(self, col):
+        if callable(col.attr):
+            return col.attr(self.data)
+        elif col.attr in self.data:
+            return self.data[col.attr]
+        # elif isinstance(col.attr, str):
+        #     return col.attr
+        else:
+            return None
+
+    def make_cell(self, col):
+        return DataTableBodyCell(
+            self.table,
+            col,
+            self.data[col.name],
+            value_attr=self.col_to_attr(col),
+            cell_selection=self.cell_selection
+        )
 
-        def col_to_attr(col):
-            if callable(col.attr):
-                return col.attr(self.data)
-            elif col.attr in self.data:
-                return self.data[col.attr]
-            # elif isinstance(col.attr, str):
-            #     return col.attr
-            else:
-                return None
+    def make_cells(self):
 
         return [
-            DataTableBodyCell(
-                self.table,
-                col,
-                self.data[col.name],
-                value_attr=col_to_attr(col),
-                cell_selection=self.cell_selection
-            )
+            self.make_cell(col)
             for i, col in enumerate(self.table.visible_columns)]
 
+    def update_cells(self, values):
+        """
+        Update the row's data and rebuild only the cells showing a changed
+        value, or whose attribute comes from one.
+        """
+        self.data.update(values)
+        for i, col in enumerate(self.table.visible_columns):
+            if not (col.name in values or callable(col.attr) or col.attr in values):
+                continue
+            cell = self.make_cell(col)
+            self.cells[i] = cell
+            self.columns.contents[i*2] = (cell, self.columns.contents[i*2][1])
+
 
 
 class DataTableHeaderRow(DataTableRow):
@@ -292,9 +308,9 @@ class DataTableHeaderRow(DataTableRow):
     def selectable(self):
         return self.table.ui_sort
 
-    def update_sort(self, sort):
+    def update_sort(self, sort, pending=False):
         for c in self.cells:
-            c.update_sort(sort)
+            c.update_sort(sort, pending)
 
 
 class DataTableFooterRow(DataTableRow):
@@ -0,0 +1,349 @@
+import logging
+logger = logging.getLogger("panwid.datatable")
+import sqlite3
+import itertools
+
+from .datatable import *
+from .filters import *
+from .cache import query_key
+
+
+def quote_identifier(name):
+    return '"%s"' %(str(name).replace('"', '""'))
+
+
+def lower_text(value):
+    # lowercases values the way SubstringFilter does
+    if value is None:
+        return None
+    return (value if isinstance(value, str) else str(value)).lower()
+
+
+class SQLDataTable(DataTable):
+    """
+    DataTable over a DB-API 2.0 connection and a base SELECT statement.
+    Sorting, paging and column projection are done by the database, with
+    the base query wrapped as a subquery:
+
+        SQLDataTable(sqlite3.connect("app.db"),
+                     "SELECT * FROM hosts WHERE up = ?", (1,),
+                     columns=[...], index="id", limit=100)
+
+    Statements are built from column names and a fixed shape, with values
+    passed as parameters, so the driver can reuse its prepared statements
+    across pages.  Pages after the first are fetched with a keyset condition
+    on the sort column and the index when query_cursor is set.
+
+    Nulls sort last ascending and first descending, as in memory, unless
+    nulls_first says where the database puts them in ascending order, in
+    which case its own ordering is used so indexes on the sort column can be.
+
+    Filters made up only of DataTableFilter instances that can be written
+    as SQL are added to the WHERE clause (see query_filters).
+    """
+
+    connection = None
+    sql = None
+    params = ()
+    paramstyle = "qmark"
+    nulls_first = None
+
+    query_sort = True
+    query_cursor = True
+    query_filters = True
+    # connections generally can't be shared between threads
+    query_threadsafe = False
+
+    def __init__(self, connection=None, sql=None, params=None,
+                 paramstyle=None, *args, **kwargs):
+
+        if connection is not None: self.connection = connection
+        if sql is not None: self.sql = sql
+        if params is not None: self.params = params
+        if paramstyle is not None: self.paramstyle = paramstyle
+        if self.connection is None or not self.sql:
+            raise Exception("must define a connection and query for SQL data table")
+        self._cursor = None
+        self._result_counts = dict()
+        super(SQLDataTable, self).__init__(*args, **kwargs)
+
+    @property
+    def cursor(self):
+        if self._cursor is None:
+            self._cursor = self.connection.cursor()
+        return self._cursor
+
+    def placeholders(self, count, start=0):
+        if self.paramstyle == "qmark":
+            return ["?"] * count
+        elif self.paramstyle in ["format", "pyformat"]:
+            return ["%s"] * count
+        elif self.paramstyle == "numeric":
+            return [":%d" %(i+1) for i in range(start, start+count)]
+        raise Exception("paramstyle %s not supported" %(self.paramstyle))
+
+    @property
+    def query_columns(self):
+        """The columns fetched from the database: every column without a value_fn."""
+        return [ c.name for c in self.columns if not c.value_fn ]
+
+    def order_by(self, sort):
+        column, reverse = sort if sort else (None, False)
+        if column not in self.query_columns:
+            column = None
+        direction = "DESC" if reverse else "ASC"
+        terms = []
+        if column and column != self.index:
+            if self.nulls_first is None:
+                terms.append("%s IS NULL%s" %(
+                    quote_identifier(column), " DESC" if reverse else ""))
+            terms.append("%s %s" %(quote_identifier(column), direction))
+        terms.append("%s %s" %(quote_identifier(self.index), direction))
+        return column, direction, terms
+
+    def nulls_lead(self, reverse):
+        """Return True if nulls come before other values in this sort direction."""
+        if self.nulls_first is None:
+            return reverse
+        return self.nulls_first != reverse
+
+    def filter_sql(self, f, params):
+        """
+        Return a SQL condition equivalent to filter ``f``, appending its
+        parameters to ``params``, or None if it can't be written as SQL.
+        """
+        if not isinstance(f, DataTableFilter) or f.column not in self.query_columns:
+            return None
+        column = quote_identifier(f.column)
+        if isinstance(f, EqualsFilter):
+            if f.value is None:
+                return "%s IS NULL" %(column)
+            params.append(f.value)
+            return "%s = %s" %(column, self.placeholders(1, len(params)-1)[0])
+        elif isinstance(f, IsInFilter):
+            values = [ v for v in f.values if v is not None ]
+            terms = []
+            if values:
+                terms.append("%s IN (%s)" %(
+                    column, ", ".join(self.placeholders(len(values), len(params)))))
+                params.extend(values)
+            if None in f.values:
+                terms.append("%s IS NULL" %(column))
+            return "(%s)" %(" OR ".join(terms)) if terms else "0 = 1"
+        elif isinstance(f, RangeFilter):
+            terms = ["%s IS NOT NULL" %(column)]
+            for bound, include, op in [
+                    (f.lower, f.include_lower, ">"),
+                    (f.upper, f.include_upper, "<")]:
+                if bound is None:
+                    continue
+                params.append(bound)
+                terms.append("%s %s%s %s" %(
+                    column, op, "=" if include else "",
+                    self.placeholders(1, len(params)-1)[0]))
+            return "(%s)" %(" AND ".join(terms))
+        elif isinstance(f, SubstringFilter):
+            return self.substring_sql(f, column, params)
+        return None
+
+    def substring_sql(self, f, column, params):
+        """
+        Return a SQL condition equivalent to SubstringFilter ``f``, or None.
+        LIKE's case sensitivity and LOWER()'s handling of non-ASCII text
+        differ between databases, so neither is pushed down by default.
+        """
+        return None
+
+    def where_sql(self, filters, params):
+        """
+        Return the WHERE conditions for ``filters``, or None if any of them
+        can't be written as SQL.
+        """
+        terms = []
+        for f in filters or []:
+            term = self.filter_sql(f, params)
+            if term is None:
+                return None
+            terms.append(term)
+        return terms
+
+    def supports_query_filters(self, filters):
+        return self.where_sql(filters, []) is not None
+
+    def execute(self, sql, params):
+        logger.debug("execute: %s %s" %(sql, params))
+        self.cursor.execute(sql, params)
+        return self.cursor
+
+    def query(self, sort=None, offset=None, limit=None, load_all=False,
+              after=None, filters=None):
+
+        params = list(self.params)
+        column, direction, order = self.order_by(sort)
+        sql = "SELECT %s FROM (%s) AS q" %(
+            ", ".join(quote_identifier(c) for c in self.query_columns), self.sql
+        )
+        where = self.where_sql(filters, params) or []
+
+        if after is not None:
+            op = "<" if direction == "DESC" else ">"
+            if column and column != self.index:
+                nulls_lead = self.nulls_lead(direction == "DESC")
+                if after[0] is None:
+                    # the rest of the nulls, then the values if they follow
+                    p = self.placeholders(1, len(params))
+                    term = "(%s IS NULL AND %s %s %s)" %(
+                        quote_identifier(column), quote_identifier(self.index), op, p[0])
+                    if nulls_lead:
+                        term = "(%s IS NOT NULL OR %s)" %(quote_identifier(column), term)
+                    params.append(after[1])
+                else:
+                    # the rest of the values, then the nulls if they follow
+                    p = self.placeholders(3, len(params))
+                    term = "(%s %s %s OR (%s = %s AND %s %s %s)%s)" %(
+                        quote_identifier(column), op, p[0],
+                        quote_identifier(column), p[1],
+                        quote_identifier(self.index), op, p[2],
+                        "" if nulls_lead else " OR %s IS NULL" %(quote_identifier(column))
+                    )
+                    params += [after[0], after[0], after[1]]
+                where.append(term)
+            else:
+                p = self.placeholders(1, len(params))
+                where.append("%s %s %s" %(quote_identifier(self.index), op, p[0]))
+                params.append(after[1])
+            offset = None
+
+        if where:
+            sql += " WHERE %s" %(" AND ".join(where))
+        sql += " ORDER BY %s" %(", ".join(order))
+
+        skip = 0
+        if limit and not load_all:
+            p = self.placeholders(1, len(params))
+            sql += " LIMIT %s" %(p[0])
+            params.append(limit)
+            if offset:
+                p = self.placeholders(1, len(params))
+                sql += " OFFSET %s" %(p[0])
+                params.append(offset)
+        elif offset:
+            # OFFSET without LIMIT isn't portable, so skip the rows here
+            skip = offset
+
+        cursor = self.execute(sql, params)
+        names = [ d[0] for d in cursor.description ]
+        return [ dict(zip(names, row)) for row in cursor.fetchall()[skip:] ]
+
+    def query_result_count(self):
+        key = query_key(self.pushed_filters or ())
+        if key not in self._result_counts:
+            params = list(self.params)
+            where = self.where_sql(self.pushed_filters, params)
+            cursor = self.execute(
+                "SELECT COUNT(*) FROM (%s) AS q%s" %(
+                    self.sql, " WHERE %s" %(" AND ".join(where)) if where else ""),
+                params
+            )
+            self._result_counts[key] = cursor.fetchone()[0]
+        return self._result_counts[key]
+
+    def invalidate_query_cache(self):
+        self._result_counts = dict()
+        super(SQLDataTable, self).invalidate_query_cache()
+
+    def close(self):
+        if self._cursor is not None:
+            self._cursor.close()
+            self._cursor = None
+
+
+class SQLiteDataTable(SQLDataTable):
+    """
+    DataTable that keeps its rows in a local SQLite database (a file, or
+    ``:memory:`` by default) with an index on each column, instead of in
+    memory.  Rows given as ``data`` or added with insert_rows() are written
+    to the database, and only the pages that are scrolled to are loaded.
+    At most max_pages pages are kept loaded, the ones furthest from where
+    the user scrolled to being dropped and loaded again when scrolled back
+    to, so the table can be much larger than the memory it uses.
+    """
+
+    path = ":memory:"
+    table_name = "datatable"
+    limit = 500
+    max_pages = 20
+    insert_chunk_size = 10000
+
+    def __init__(self, path=None, data=None, table_name=None, *args, **kwargs):
+
+        if path is not None: self.path = path
+        if table_name is not None: self.table_name = table_name
+        columns = kwargs.get("columns") or self.columns
+        self.index = kwargs.get("index") or self.index
+        self.store_columns = [ c.name for c in columns if not c.value_fn ]
+        if self.index not in self.store_columns:
+            self.store_columns.insert(0, self.index)
+        connection = sqlite3.connect(self.path)
+        # SQLite's LOWER() only folds ASCII, so use Python's for filters
+        connection.create_function("panwid_lower", 1, lower_text)
+        self.create_table(connection)
+        super(SQLiteDataTable, self).__init__(
+            connection,
+            "SELECT * FROM %s" %(quote_identifier(self.table_name)),
+            *args, **kwargs
+        )
+        if data:
+            self.insert_rows(data)
+
+    def create_table(self, connection):
+        table = quote_identifier(self.table_name)
+        with connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS %s (%s)" %(
+                table,
+                ", ".join(
+                    "%s%s" %(quote_identifier(c),
+                             " NOT NULL PRIMARY KEY" if c == self.index else "")
+                    for c in self.store_columns
+                )
+            ))
+            for c in self.store_columns:
+                if c == self.index:
+                    continue
+                connection.execute("CREATE INDEX IF NOT EXISTS %s ON %s (%s)" %(
+                    quote_identifier("%s_%s" %(self.table_name, c)),
+                    table, quote_identifier(c)
+                ))
+
+    def substring_sql(self, f, column, params):
+        if not f._needle:
+            return "1 = 1"
+        params.append(f._needle)
+        if f.case_sensitive:
+            return "instr(CAST(%s AS TEXT), ?) > 0" %(column)
+        return "instr(panwid_lower(%s), ?) > 0" %(column)
+
+    def insert_rows(self, rows):
+        """
+        Write rows to the database, replacing any with the same index, and
+        bring the loaded rows up to date.
+        """
+        sql = "INSERT OR REPLACE INTO %s (%s) VALUES (%s)" %(
+            quote_identifier(self.table_name),
+            ", ".join(quote_identifier(c) for c in self.store_columns),
+            ", ".join(["?"] * len(self.store_columns))
+        )
+        rows = iter(rows)
+        with self.connection:
+            while True:
+                chunk = [
+                    tuple(row.get(c) for c in self.store_columns)
+                    for row in itertools.islice(rows, self.insert_chunk_size)
+                ]
+                if not chunk:
+                    break
+                self.connection.executemany(sql, chunk)
+        self.refresh(diff=True)
+
+
+__all__ = ["SQLDataTable", "SQLiteDataTable"]
@@ -81,7 +81,7 @@ class ScrollingListBox(urwid.WidgetWrap):
 
     signals = ["select",
                "drag_start", "drag_continue", "drag_stop",
-               "load_more"]
+               "load_more", "load_previous"]
 
     def __init__(self, body,
                  infinite = False,
@@ -100,6 +100,7 @@ class ScrollingListBox(urwid.WidgetWrap):
         self.drag_to = None
         self.load_more = False
         self.height = 0
+        self.listbox_size = None
         self.page = 0
 
         self.queued_keypress = None
@@ -161,6 +162,8 @@ class ScrollingListBox(urwid.WidgetWrap):
                 self.mouse_state = 1
                 self.drag_from = self.drag_last = (col, row)
             elif button == 4:
+                if self.infinite and self.listbox.focus_position == 0:
+                    urwid.signals.emit_signal(self, "load_previous")
                 pos = self.listbox.focus_position - int(self.height * SCROLL_WHEEL_HEIGHT_RATIO)
                 if pos < 0:
                     pos = 0
@@ -222,6 +225,16 @@ class ScrollingListBox(urwid.WidgetWrap):
                 self.queued_keypress = key
                 self._invalidate()
 
+        # up, page up at start trigger load of earlier data
+        elif (
+                command in ["cursor up", "cursor page up"]
+                and self.infinite
+                and len(self.body)
+                and self.focus_position == 0
+        ):
+                urwid.signals.emit_signal(self, "load_previous")
+                return super(ScrollingListBox, self).keypress(size, key)
+
         elif command == "activate":
             urwid.signals.emit_signal(self, "select", self, self.selection)
 
@@ -271,8 +284,31 @@ class ScrollingListBox(urwid.WidgetWrap):
             self.scroll_bar.update(size)
 
         self.height = maxrow
+        self.listbox_size = (maxcol - (1 if self.with_scrollbar else 0), maxrow)
         return super(ScrollingListBox, self).render( (maxcol, maxrow), focus)
 
+    def position_at_row(self, row):
+        """
+        Return the body position of the widget drawn at screen row ``row``
+        as of the last render, or None if there isn't one.
+        """
+        if not self.listbox_size or not len(self.listbox.body):
+            return None
+        middle, top, bottom = self.listbox.calculate_visible(self.listbox_size)
+        focus_position, focus_rows = middle[2], middle[3]
+        trim_top, fill_above = top
+        visible = (
+            [ (pos, rows) for w, pos, rows in reversed(fill_above) ]
+            + [ (focus_position, focus_rows) ]
+            + [ (pos, rows) for w, pos, rows in bottom[1] ]
+        )
+        y = -trim_top
+        for pos, rows in visible:
+            if y <= row < y + rows:
+                return pos
+            y += rows
+        return None
+
 
     def disable(self):
         self.selectable = lambda: False
@@ -1,6 +1,29 @@
 import unittest
+import os
+import threading
+import tempfile
+import sqlite3
+from datetime import datetime, timedelta, timezone
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+import urwid
 
 from panwid.datatable import *
+from panwid.datatable.cells import DataTableHeaderCell
+from panwid.datatable.cache import QueryPageCache
+from panwid.datatable.frame import ArraySource
+from panwid.datatable.arrow import ArrowSource
 from orderedattrdict import AttrDict
 
 class TestDataTableWithIndex(unittest.TestCase):
@@ -39,3 +62,1647 @@ class TestDataTableWithIndex(unittest.TestCase):
         dt = DataTable(self.columns, data=self.data)
         dt.add_row(dict(a=4, b=7.142, c="qux"))
         self.assertEqual(len(dt), 4)
+
+
+class TestDataTableTypedColumns(unittest.TestCase):
+
+    def setUp(self):
+
+        self.data = [
+            dict(a=1, b="2.5", c="2019-01-02"),
+            dict(a=2, b=None, c="2018-05-06 12:34:56"),
+            dict(a=3, b=-3, c=None)
+        ]
+        self.columns = [
+            DataTableColumn("a", dtype=int),
+            DataTableColumn("b", dtype="float"),
+            DataTableColumn("c", dtype="datetime")
+        ]
+
+    def test_values_coerced(self):
+
+        dt = DataTable(self.columns, data=self.data, index="a")
+        self.assertEqual(dt.df.get_cell(1, "b"), 2.5)
+        self.assertEqual(dt.df.get_cell(2, "b"), None)
+        self.assertEqual(dt.df.get_cell(2, "c").hour, 12)
+
+    def test_datetime_zones(self):
+
+        utc = timezone.utc
+        east = timezone(timedelta(hours=5))
+        dt = DataTable(self.columns, data=[
+            dict(a=1, c=datetime(2020, 1, 1, 12, tzinfo=east)),
+            dict(a=2, c=datetime(2020, 1, 1, 8, tzinfo=utc)),
+            dict(a=3, c=datetime(2020, 1, 1, 7)),
+        ], index="a")
+        self.assertEqual(dt.df.get_cell(1, "c").utcoffset(), timedelta(hours=5))
+        self.assertEqual(dt.df.get_cell(1, "c").hour, 12)
+        self.assertIs(dt.df.get_cell(2, "c").tzinfo, utc)
+        self.assertIsNone(dt.df.get_cell(3, "c").tzinfo)
+        dt.sort_by_column("c")
+        self.assertEqual(list(dt.df.index), [1, 3, 2])
+        self.assertEqual(dt.df.get_cell(1, "c"), datetime(2020, 1, 1, 7, tzinfo=utc))
+        self.assertEqual(dt.df.get_cell(1, "c").tzinfo, east)
+
+    def test_sort_nulls_last(self):
+
+        dt = DataTable(self.columns, data=self.data, index="a")
+        dt.sort_by_column("b")
+        self.assertEqual(list(dt.df.index), [3, 1, 2])
+        dt.sort_by_column("c", reverse=True)
+        self.assertEqual(list(dt.df.index), [3, 1, 2])
+
+    def test_format(self):
+
+        self.assertEqual(self.columns[1]._format(2.5).text, "2.500")
+
+    def test_bad_dtype(self):
+
+        with self.assertRaises(Exception):
+            DataTableColumn("d", dtype="complex")
+
+
+class TestDataTableCategoricalColumns(unittest.TestCase):
+
+    def setUp(self):
+
+        self.data = [
+            dict(a=1, color="red"),
+            dict(a=2, color="blue"),
+            dict(a=3, color=None),
+            dict(a=4, color="red"),
+            dict(a=5, color="green"),
+        ]
+        self.columns = [
+            DataTableColumn("a"),
+            DataTableColumn("color", dtype="category"),
+        ]
+
+    def test_dictionary_encoded(self):
+
+        dt = DataTable(self.columns, data=self.data, index="a")
+        column = dt.df._data[dt.df.columns.index("color")]
+        self.assertEqual(column.codes.typecode, "I")
+        self.assertEqual(len(column.categories), 4)
+        self.assertEqual(dt.df.get_cell(4, "color"), "red")
+
+    def test_sort(self):
+
+        dt = DataTable(self.columns, data=self.data, index="a")
+        dt.sort_by_column("color")
+        self.assertEqual(list(dt.df.index), [2, 5, 1, 4, 3])
+        dt.sort_by_column("color", reverse=True)
+        self.assertEqual(list(dt.df.index), [3, 1, 4, 5, 2])
+
+    def test_equality(self):
+
+        dt = DataTable(self.columns, data=self.data, index="a")
+        self.assertEqual(dt.df.equality("color", value="red"),
+                         [True, False, False, True, False])
+        self.assertEqual(dt.df.equality("color", value="purple"), [False]*5)
+        self.assertEqual(dt.df.isin("color", ["blue", "green"]),
+                         [False, True, False, False, True])
+
+
+class TestDataTableSecondaryIndexes(unittest.TestCase):
+
+    def setUp(self):
+
+        self.data = [
+            dict(a=1, foo=10, color="red"),
+            dict(a=2, foo=30, color="blue"),
+            dict(a=3, foo=None, color="red"),
+            dict(a=4, foo=25, color="green"),
+            dict(a=5, foo=40, color="red"),
+        ]
+        self.columns = [
+            DataTableColumn("a"),
+            DataTableColumn("foo"),
+            DataTableColumn("color"),
+        ]
+
+    def make_table(self):
+        return DataTable(self.columns, data=self.data, index="a",
+                         secondary_indexes={"foo": "sorted", "color": "hash"})
+
+    def filtered_indexes(self, dt):
+        return [dt.position_to_index(p) for p in dt.filtered_rows]
+
+    def test_index_filters(self):
+
+        dt = self.make_table()
+        dt.apply_filters([RangeFilter("foo", lower=20, include_lower=False)])
+        self.assertEqual(self.filtered_indexes(dt), [2, 4, 5])
+        dt.apply_filters([RangeFilter("foo", 20, 35), EqualsFilter("color", "blue")])
+        self.assertEqual(self.filtered_indexes(dt), [2])
+        dt.apply_filters([IsInFilter("color", ["green", "blue"])])
+        self.assertEqual(self.filtered_indexes(dt), [2, 4])
+
+    def test_index_maintained(self):
+
+        dt = self.make_table()
+        dt.add_row(dict(a=6, foo=22, color="blue"), sort=False)
+        dt.delete_rows(2)
+        dt.df.set(5, "foo", 21)
+        dt.apply_filters([RangeFilter("foo", 20, 30)])
+        self.assertEqual(self.filtered_indexes(dt), [4, 5, 6])
+        dt.apply_filters([EqualsFilter("color", "blue")])
+        self.assertEqual(self.filtered_indexes(dt), [6])
+
+    def test_sort_uses_index(self):
+
+        dt = self.make_table()
+        dt.sort_by_column("foo")
+        self.assertEqual(list(dt.df.index), [1, 4, 2, 5, 3])
+        dt.sort_by_column("foo", reverse=True)
+        self.assertEqual(list(dt.df.index), [3, 5, 2, 4, 1])
+
+    def test_sort_uses_index_ties(self):
+
+        data = [ dict(a=i, foo=i % 3) for i in range(9) ]
+        columns = self.columns[:2]
+        indexed = DataTable(columns, data=data, index="a",
+                            secondary_indexes={"foo": "sorted"})
+        plain = DataTable(columns, data=data, index="a")
+        for reverse in (False, True):
+            indexed.sort_by_column("foo", reverse=reverse)
+            plain.sort_by_column("foo", reverse=reverse)
+            self.assertEqual(list(indexed.df.index), list(plain.df.index))
+        self.assertEqual(list(indexed.df.index), [2, 5, 8, 1, 4, 7, 0, 3, 6])
+
+
+class TestDataTableFilterCache(unittest.TestCase):
+
+    def setUp(self):
+
+        self.data = [
+            dict(a=i, foo=(i * 7) % 10, bar=i % 3)
+            for i in range(20)
+        ]
+        self.columns = [
+            DataTableColumn("a"),
+            DataTableColumn("foo"),
+            DataTableColumn("bar"),
+        ]
+        self.calls = 0
+
+    def foo_filter(self, row):
+        self.calls += 1
+        return row["foo"] > 4
+
+    def bar_filter(self, row):
+        return row["bar"] == 0
+
+    def filtered_indexes(self, dt):
+        return sorted(dt.position_to_index(p) for p in dt.filtered_rows)
+
+    def expected(self, dt, filters):
+        return sorted(row["a"] for row in dt.df.iterrows()
+                      if all(f(row) for f in filters))
+
+    def test_toggle_uses_cache(self):
+
+        dt = DataTable(self.columns, data=self.data, index="a", cache_filters=True)
+        dt.apply_filters([self.foo_filter, self.bar_filter])
+        calls = self.calls
+        dt.apply_filters([self.bar_filter])
+        dt.apply_filters([self.foo_filter, self.bar_filter])
+        self.assertEqual(self.calls, calls)
+        self.assertEqual(self.filtered_indexes(dt),
+                         self.expected(dt, [self.foo_filter, self.bar_filter]))
+
+    def test_add_filter_uses_cache(self):
+
+        dt = DataTable(self.columns, data=self.data, index="a", cache_filters=True)
+        dt.apply_filters([self.foo_filter])
+        self.assertIn(self.foo_filter, dt.filter_cache)
+        dt.apply_filters([self.bar_filter])
+        dt.apply_filters([self.bar_filter, self.foo_filter])
+        dt.apply_filters([self.bar_filter])
+        dt.apply_filters([self.bar_filter, self.foo_filter])
+        self.assertEqual(self.calls, len(self.data))
+        self.assertEqual(self.filtered_indexes(dt),
+                         self.expected(dt, [self.foo_filter, self.bar_filter]))
+
+    def test_cache_follows_changes(self):
+
+        dt = DataTable(self.columns, data=self.data, index="a", cache_filters=True)
+        filters = [self.foo_filter, self.bar_filter]
+        dt.apply_filters(filters)
+        dt.add_row(dict(a=20, foo=9, bar=0), sort=False)
+        dt.sort_by_column("foo", reverse=True)
+        dt.delete_rows([3, 9])
+        dt.df.set(6, "foo", 0)
+        dt.invalidate_rows(6)
+        dt.apply_filters(filters)
+        self.assertEqual(self.filtered_indexes(dt), self.expected(dt, filters))
+
+    def test_calculated_column(self):
+
+        offset = [0]
+        columns = self.columns + [
+            DataTableColumn("calc", value=lambda t, r: r["foo"] + offset[0])
+        ]
+        dt = DataTable(columns, data=self.data, index="a", cache_filters=True)
+        filters = [RangeFilter("calc", 5), EqualsFilter("bar", 0)]
+        dt.apply_filters(filters)
+        self.assertEqual(self.filtered_indexes(dt), self.expected(dt, filters))
+
+        offset[0] = 3
+        dt.invalidate()
+        dt.refresh_calculated_fields()
+        dt.apply_filters([EqualsFilter("bar", 0)])
+        dt.apply_filters(filters)
+        self.assertEqual(self.filtered_indexes(dt), self.expected(dt, filters))
+        self.assertEqual(len(dt.filter_cache.bitmaps), 2)
+
+
+class CountingSubstringFilter(SubstringFilter):
+
+    calls = 0
+
+    def __call__(self, row):
+        CountingSubstringFilter.calls += 1
+        return super(CountingSubstringFilter, self).__call__(row)
+
+
+class TestDataTableRefinableFilters(unittest.TestCase):
+
+    def setUp(self):
+
+        self.data = [
+            dict(a=1, host="alpha.example.com"),
+            dict(a=2, host="beta.example.com"),
+            dict(a=3, host="alphabet.example.org"),
+            dict(a=4, host=None),
+            dict(a=5, host="gamma.example.org"),
+        ]
+        self.columns = [
+            DataTableColumn("a"),
+            DataTableColumn("host"),
+        ]
+        CountingSubstringFilter.calls = 0
+
+    def search(self, dt, text):
+        dt.apply_filters([CountingSubstringFilter("host", text)])
+        return sorted(dt.position_to_index(p) for p in dt.filtered_rows)
+
+    def test_refines(self):
+
+        self.assertTrue(SubstringFilter("host", "alp").refines(SubstringFilter("host", "al")))
+        self.assertFalse(SubstringFilter("host", "al").refines(SubstringFilter("host", "alp")))
+        self.assertTrue(RangeFilter("foo", 2, 5).refines(RangeFilter("foo", 1, None)))
+        self.assertFalse(RangeFilter("foo", 0, 5).refines(RangeFilter("foo", 1, None)))
+        self.assertTrue(IsInFilter("foo", [1]).refines(IsInFilter("foo", [1, 2])))
+
+    def test_narrowing(self):
+
+        dt = DataTable(self.columns, data=self.data, index="a")
+        self.assertEqual(self.search(dt, "al"), [1, 3])
+        self.assertEqual(CountingSubstringFilter.calls, 5)
+        self.assertEqual(self.search(dt, "alph"), [1, 3])
+        self.assertEqual(self.search(dt, "alpha."), [1])
+        self.assertEqual(CountingSubstringFilter.calls, 9)
+        self.assertEqual(self.search(dt, "alph"), [1, 3])
+        self.assertEqual(CountingSubstringFilter.calls, 9)
+        self.assertEqual(self.search(dt, "org"), [3, 5])
+        self.assertEqual(CountingSubstringFilter.calls, 14)
+
+    def test_stack_invalidated_by_changes(self):
+
+        dt = DataTable(self.columns, data=self.data, index="a")
+        self.search(dt, "al")
+        dt.add_row(dict(a=6, host="alpine.example.net"), sort=False)
+        self.assertEqual(self.search(dt, "alp"), [1, 3, 6])
+
+    def test_calculated_column(self):
+
+        offset = [0]
+        columns = self.columns + [
+            DataTableColumn("calc", value=lambda t, r: r["a"] + offset[0])
+        ]
+        dt = DataTable(columns, data=self.data, index="a")
+        self.search(dt, "al")
+        for i in range(len(dt)):
+            dt[i]
+        # rendering doesn't throw away the stack
+        self.assertEqual(self.search(dt, "alph"), [1, 3])
+        self.assertEqual(CountingSubstringFilter.calls, 7)
+
+        dt.apply_filters([RangeFilter("calc", 3)])
+        offset[0] = -2
+        dt.invalidate()
+        for i in range(len(dt)):
+            dt[i]
+        # but calculated values that changed do
+        dt.apply_filters([RangeFilter("calc", 3)])
+        self.assertEqual([ dt.position_to_index(p) for p in dt.filtered_rows ], [5])
+
+
+class TestDataTableFilterOrdering(unittest.TestCase):
+
+    def setUp(self):
+
+        self.data = [ dict(a=i, foo=i % 100) for i in range(2000) ]
+        self.columns = [
+            DataTableColumn("a"),
+            DataTableColumn("foo"),
+        ]
+        self.expensive_calls = 0
+
+    def expensive_filter(self, row):
+        self.expensive_calls += 1
+        sum(range(200))
+        return row["foo"] % 2 == 0
+
+    def selective_filter(self, row):
+        return row["foo"] < 5
+
+    def test_reorders_filters(self):
+
+        dt = DataTable(self.columns, data=self.data, index="a")
+        dt.apply_filters([self.expensive_filter, self.selective_filter])
+        self.assertEqual(len(dt), 60)
+        self.assertEqual(
+            dt.order_filters([self.expensive_filter, self.selective_filter]),
+            [self.selective_filter, self.expensive_filter]
+        )
+        self.assertLess(self.expensive_calls, len(self.data))
+        stats = dt.filter_stats[self.selective_filter]
+        self.assertLess(stats.pass_rate, 0.2)
+        self.assertGreater(stats.calls, 0)
+
+
+def even_foo(row):
+    return row["foo"] % 2 == 0
+
+def double_foo(table, row):
+    return row["foo"] * 2
+
+
+class TestDataTableParallel(unittest.TestCase):
+
+    def setUp(self):
+
+        self.data = [ dict(a=i, foo=i % 10) for i in range(100) ]
+        self.columns = [
+            DataTableColumn("a"),
+            DataTableColumn("foo"),
+            DataTableColumn("double", value=double_foo, value_parallel=True),
+        ]
+
+    def test_parallel_filter(self):
+
+        dt = DataTable(self.columns, data=self.data, index="a",
+                       parallel=2, parallel_chunk_size=20)
+        progress = []
+        urwid.connect_signal(
+            dt, "progress",
+            lambda source, done, total: progress.append((done, total))
+        )
+        try:
+            dt.apply_filters([even_foo])
+        finally:
+            dt.shutdown_executor()
+        self.assertEqual(len(dt), 50)
+        self.assertEqual(progress[-1], (5, 5))
+
+    def test_parallel_calculated_column(self):
+
+        dt = DataTable(self.columns, data=self.data, index="a",
+                       parallel=2, parallel_chunk_size=20)
+        try:
+            dt.refresh_calculated_fields()
+        finally:
+            dt.shutdown_executor()
+        self.assertEqual(dt.df.get(7, "double"), 14)
+
+    def test_unpicklable_falls_back(self):
+
+        dt = DataTable(self.columns[:2], data=self.data, index="a",
+                       parallel=2, parallel_chunk_size=20)
+        dt.apply_filters([lambda row: row["foo"] < 3])
+        self.assertEqual(len(dt), 30)
+        self.assertIsNone(dt._executor)
+
+
+class FakeMainLoop(object):
+
+    def __init__(self):
+        self.callbacks = []
+        self.idle = None
+        self.alarms = []
+
+    def watch_pipe(self, callback):
+        self.callbacks.append(callback)
+        return os.open(os.devnull, os.O_WRONLY)
+
+    def enter_idle(self, callback):
+        self.idle = callback
+        return callback
+
+    def remove_enter_idle(self, handle):
+        self.idle = None
+
+    def set_alarm_in(self, seconds, callback, user_data=None):
+        self.alarms.append((callback, user_data))
+        return callback
+
+    def run_alarms(self):
+        alarms, self.alarms = self.alarms, []
+        for callback, user_data in alarms:
+            callback(self, user_data)
+
+
+class TestDataTableAsyncSort(unittest.TestCase):
+
+    def setUp(self):
+
+        self.data = [ dict(a=i, foo=(i * 7) % 100) for i in range(100) ]
+        self.columns = [
+            DataTableColumn("a"),
+            DataTableColumn("foo"),
+        ]
+        self.loop = FakeMainLoop()
+
+    def run_pending(self, dt):
+        while dt.sort_pending:
+            dt._sort_thread.join()
+            for callback in self.loop.callbacks:
+                callback(b"s")
+
+    def test_async_sort(self):
+
+        dt = DataTable(self.columns, data=self.data, index="a",
+                       async_sort=True, main_loop=self.loop)
+        dt.sort_by_column("foo")
+        self.assertEqual(dt.header.cells[1].columns.contents[1][0].text,
+                         DataTableHeaderCell.PENDING_SORT_MARKER)
+        self.run_pending(dt)
+        self.assertFalse(dt.sort_pending)
+        self.assertEqual(dt.df["foo"].to_list(), sorted(r["foo"] for r in self.data))
+        self.assertEqual(dt.header.cells[1].columns.contents[1][0].text,
+                         DataTableHeaderCell.ASCENDING_SORT_MARKER)
+
+    def test_newer_sort_wins(self):
+
+        dt = DataTable(self.columns, data=self.data, index="a",
+                       async_sort=True, main_loop=self.loop)
+        dt.sort_by_column("foo")
+        dt._sort_thread.join()
+        dt.sort_by_column(("a", True))
+        self.run_pending(dt)
+        self.assertEqual(dt.df.index[:3], [99, 98, 97])
+
+    def test_one_worker(self):
+
+        dt = DataTable(self.columns, data=self.data, index="a",
+                       async_sort=True, main_loop=self.loop)
+        dt.sort_by_column("foo")
+        first = dt._sort_thread
+        dt.sort_by_column(("a", True))
+        dt.sort_by_column("a")
+        # queued until the running sort is done, then only the newest runs
+        self.assertIs(dt._sort_thread, first)
+        first.join()
+        for callback in self.loop.callbacks:
+            callback(b"s")
+        self.assertIsNot(dt._sort_thread, first)
+        self.assertIsNone(dt._sort_request)
+        self.run_pending(dt)
+        self.assertEqual(dt.df.index[:3], [0, 1, 2])
+
+    def test_rows_changed(self):
+
+        dt = DataTable(self.columns, data=self.data, index="a",
+                       async_sort=True, main_loop=self.loop,
+                       async_sort_retries=0)
+        dt.sort_by_column("foo")
+        dt.df.set(5, "foo", -1)
+        self.run_pending(dt)
+        self.assertEqual(dt.df.index[0], 5)
+        self.assertEqual(dt.df["foo"].to_list()[1:],
+                         sorted(r["foo"] for r in self.data if r["a"] != 5))
+
+
+class TestDataTableLazySort(unittest.TestCase):
+
+    def setUp(self):
+
+        self.data = [ dict(a=i, foo=(i * 37) % 101) for i in range(100) ]
+        self.columns = [
+            DataTableColumn("a"),
+            DataTableColumn("foo"),
+        ]
+        self.expected = sorted(r["foo"] for r in self.data)
+
+    def test_first_screen_sorted(self):
+
+        dt = DataTable(self.columns, data=self.data, index="a",
+                       sort_by="foo", lazy_sort=True, lazy_sort_size=10)
+        self.assertEqual(dt._lazy_sort.sorted, 10)
+        self.assertEqual(dt.df["foo"].to_list()[:10], self.expected[:10])
+
+    def test_sorted_on_scroll(self):
+
+        dt = DataTable(self.columns, data=self.data, index="a",
+                       sort_by=("foo", True), lazy_sort=True, lazy_sort_size=10)
+        dt[50]
+        self.assertGreater(dt._lazy_sort.sorted, 50)
+        self.assertEqual(dt.df["foo"].to_list()[:51], self.expected[::-1][:51])
+
+    def test_finished_when_idle(self):
+
+        loop = FakeMainLoop()
+        dt = DataTable(self.columns, data=self.data, index="a",
+                       lazy_sort=True, lazy_sort_size=10, main_loop=loop)
+        dt.sort_by_column("foo")
+        while loop.idle:
+            loop.idle()
+        self.assertIsNone(dt._lazy_sort)
+        self.assertEqual(dt.df["foo"].to_list(), self.expected)
+
+    def test_calculated_column(self):
+
+        loop = FakeMainLoop()
+        columns = self.columns + [
+            DataTableColumn("double", value=lambda t, r: r["foo"] * 2)
+        ]
+        dt = DataTable(columns, data=self.data, index="a",
+                       lazy_sort=True, lazy_sort_size=10, main_loop=loop)
+        dt.sort_by_column("foo")
+        while loop.idle:
+            # rendering computes calculated values between steps
+            version = dt.df.version
+            dt[0]
+            dt[5]
+            self.assertEqual(dt.df.version, version)
+            loop.idle()
+        self.assertIsNone(dt._lazy_sort)
+        self.assertEqual(dt.df["foo"].to_list(), self.expected)
+        self.assertEqual(dt.df["double"].to_list(), [ v * 2 for v in self.expected ])
+
+
+class TestDataTableMultiColumnSort(unittest.TestCase):
+
+    def setUp(self):
+
+        self.data = [
+            dict(a=1, region="west", bar=3),
+            dict(a=2, region="east", bar=1),
+            dict(a=3, region="west", bar=7),
+            dict(a=4, region=None, bar=5),
+            dict(a=5, region="east", bar=4),
+            dict(a=6, region="west", bar=None),
+        ]
+        self.columns = [
+            DataTableColumn("a"),
+            DataTableColumn("region"),
+            DataTableColumn("bar"),
+        ]
+
+    def test_sort(self):
+
+        dt = DataTable(self.columns, data=self.data, index="a",
+                       sort_by=[("region", False), ("bar", True)])
+        self.assertEqual(dt.df.index[:], [5, 2, 6, 3, 1, 4])
+        self.assertEqual(dt.sort_by, ("region", False))
+
+    def test_null_ties(self):
+
+        data = [
+            dict(a=1, region=None, bar=3),
+            dict(a=2, region="west", bar=9),
+            dict(a=3, region=None, bar=1),
+            dict(a=4, region=None, bar=2),
+        ]
+        dt = DataTable(self.columns, data=data, index="a",
+                       sort_by=[("region", False), ("bar", False)])
+        self.assertEqual(dt.df.index[:], [2, 3, 4, 1])
+        dt.sort_by_column([("region", True), ("bar", False)])
+        self.assertEqual(dt.df.index[:], [3, 4, 1, 2])
+
+    def test_header_priority(self):
+
+        dt = DataTable(self.columns, data=self.data, index="a",
+                       sort_by=[("region", False), ("bar", True)])
+        markers = [ c.columns.contents[1][0].text for c in dt.header.cells ]
+        self.assertEqual(markers, [
+            "",
+            DataTableHeaderCell.ASCENDING_SORT_MARKER + "1",
+            DataTableHeaderCell.DESCENDING_SORT_MARKER + "2",
+        ])
+
+    def test_keys_cached(self):
+
+        calls = []
+        def key(v):
+            calls.append(v)
+            return (v is None, v)
+        self.columns[2].sort_key = key
+        dt = DataTable(self.columns, data=self.data, index="a",
+                       sort_by=["region", "bar"])
+        count = len(calls)
+        dt.sort_by_column([("region", True), ("bar", False)])
+        dt.sort_by_column([("region", False), ("bar", False)])
+        self.assertEqual(len(calls), count)
+        self.assertEqual(dt.df.index[:], [2, 5, 1, 3, 6, 4])
+        dt.add_row(dict(a=7, region="east", bar=2))
+        self.assertGreater(len(calls), count)
+        self.assertEqual(dt.df.index[:3], [2, 7, 5])
+
+
+class TestDataTableCollation(unittest.TestCase):
+
+    def setUp(self):
+
+        self.data = [
+            dict(a=1, host="web10", name="beta"),
+            dict(a=2, host="web9", name="Alpha"),
+            dict(a=3, host="Web2", name="alpha"),
+            dict(a=4, host=None, name="Gamma"),
+            dict(a=5, host="db1", name=None),
+        ]
+        self.columns = [
+            DataTableColumn("a"),
+            DataTableColumn("host", collation="natural"),
+            DataTableColumn("name", collation="casefold"),
+        ]
+
+    def test_natural(self):
+
+        dt = DataTable(self.columns, data=self.data, index="a", sort_by="host")
+        self.assertEqual(dt.df["host"].to_list(),
+                         ["db1", "Web2", "web9", "web10", None])
+
+    def test_casefold(self):
+
+        dt = DataTable(self.columns, data=self.data, index="a",
+                       sort_by=("name", True))
+        self.assertEqual(dt.df["name"].to_list(),
+                         [None, "Gamma", "beta", "Alpha", "alpha"])
+
+    def test_key_updated_with_value(self):
+
+        dt = DataTable(self.columns, data=self.data, index="a", sort_by="host")
+        dt.df.set(3, "host", "web11")
+        dt.sort_by_column("host")
+        self.assertEqual(dt.df["host"].to_list(),
+                         ["db1", "web9", "web10", "web11", None])
+
+    def test_bad_collation(self):
+
+        self.assertRaises(Exception, DataTableColumn, "host", collation="klingon")
+
+
+class TestDataTableUpsert(unittest.TestCase):
+
+    def setUp(self):
+
+        self.data = [ dict(a=i, status="up", load=i) for i in range(10) ]
+        self.columns = [
+            DataTableColumn("a"),
+            DataTableColumn("status"),
+            DataTableColumn("load"),
+        ]
+
+    def test_upsert(self):
+
+        dt = DataTable(self.columns, data=self.data, index="a",
+                       secondary_indexes={"status": "hash"})
+        dt.df["_dirty"] = False
+        dt.upsert_rows([
+            dict(a=3, status="down"),
+            dict(a=5, status="up", load=5),
+            dict(a=10, status="up", load=1),
+            dict(a=3, load=30),
+        ])
+        self.assertEqual(len(dt), 11)
+        self.assertEqual(dt.df.get(3, "status"), "down")
+        self.assertEqual(dt.df.get(3, "load"), 30)
+        self.assertEqual(dt.df.get(10, "load"), 1)
+        self.assertEqual(
+            [ i for i in dt.df.index if dt.df.get(i, "_dirty") ], [10]
+        )
+        self.assertEqual(sorted(dt.df.secondary_index("status").equal("down")), [3])
+
+    def test_upsert_filtered(self):
+
+        dt = DataTable(self.columns, data=self.data, index="a")
+        dt.apply_filters([lambda row: row["status"] == "up"])
+        dt.upsert_rows([
+            dict(a=3, status="down"),
+            dict(a=11, status="up"),
+            dict(a=12, status="down"),
+        ])
+        self.assertEqual(len(dt), 10)
+        self.assertEqual(
+            [ dt.position_to_index(p) for p in dt.filtered_rows ],
+            [0, 1, 2, 4, 5, 6, 7, 8, 9, 11]
+        )
+
+    def test_sorted_in_place(self):
+
+        calls = []
+        def key(v):
+            calls.append(v)
+            return (v is None, v)
+        self.columns[2].sort_key = key
+        data = [ dict(a=i, status="up", load=i % 7) for i in range(100) ]
+        dt = DataTable(self.columns, data=data, index="a", sort_by=("load", True))
+        del calls[:]
+        dt.add_row(dict(a=100, status="up", load=3))
+        self.assertLess(len(calls), 20)
+        loads = [ dt.df.get(i, "load") for i in dt.df.index ]
+        self.assertEqual(loads, sorted(loads, reverse=True))
+        # after the rows it ties with, as a stable sort would put it
+        self.assertEqual([ i for i in dt.df.index if dt.df.get(i, "load") == 3 ][-1], 100)
+
+        dt.upsert_rows([
+            dict(a=101, status="up", load=None),
+            dict(a=102, status="up", load=9),
+            dict(a=0, load=4),
+        ])
+        self.assertEqual(dt.df.index[:2], [101, 102])
+        self.assertEqual([ i for i in dt.df.index if dt.df.get(i, "load") == 4 ][-1], 0)
+        self.assertEqual(len(dt), 103)
+
+    def test_duplicate_append(self):
+
+        dt = DataTable(self.columns, data=self.data, index="a")
+        self.assertRaises(ValueError, dt.append_rows, [dict(a=3)])
+
+
+def total_value(table, row):
+    return row["price"] * row["qty"]
+
+
+class TestDataTableUpdateCells(unittest.TestCase):
+
+    def setUp(self):
+
+        self.data = [
+            dict(sym="A", price=10, qty=1, note=""),
+            dict(sym="B", price=20, qty=2, note=""),
+            dict(sym="C", price=30, qty=3, note=""),
+        ]
+        self.columns = [
+            DataTableColumn("sym"),
+            DataTableColumn("price"),
+            DataTableColumn("qty"),
+            DataTableColumn("note"),
+            DataTableColumn("total", value=total_value,
+                            value_depends=["price", "qty"]),
+        ]
+
+    def test_update_cells(self):
+
+        dt = DataTable(self.columns, data=self.data, index="sym")
+        row = dt[1]
+        cells = list(row.cells)
+        dt.update_cells({"B": {"price": 25}})
+        self.assertIs(dt[1], row)
+        self.assertEqual(dt.df.get("B", "total"), 50)
+        self.assertEqual(row.data.price, 25)
+        self.assertIsNot(row.cells[1], cells[1])
+        self.assertIsNot(row.cells[4], cells[4])
+        self.assertIs(row.cells[0], cells[0])
+        self.assertIs(row.cells[2], cells[2])
+
+    def test_independent_column(self):
+
+        calls = []
+        def total(table, row):
+            calls.append(row["sym"])
+            return total_value(table, row)
+        self.columns[4].value_fn = total
+        dt = DataTable(self.columns, data=self.data, index="sym")
+        del calls[:]
+        dt.update_cells({"A": {"note": "halted"}})
+        self.assertEqual(calls, [])
+        dt.update_cells({"A": {"qty": 4}})
+        self.assertEqual(calls, ["A"])
+
+    def test_sort_and_filter(self):
+
+        dt = DataTable(self.columns, data=self.data, index="sym",
+                       sort_by=("price", True))
+        dt.apply_filters([RangeFilter("price", upper=25)])
+        self.assertEqual([ dt.position_to_index(p) for p in dt.filtered_rows ], ["B", "A"])
+        dt.update_cells({"A": {"price": 22}, "C": {"price": 5}})
+        self.assertEqual(dt.df.index[:], ["A", "B", "C"])
+        self.assertEqual([ dt.position_to_index(p) for p in dt.filtered_rows ], ["A", "B", "C"])
+
+    def test_moved_in_place(self):
+
+        data = [ dict(sym="S%02d" %(i), price=i, qty=1, note="") for i in range(50) ]
+        dt = DataTable(self.columns, data=data, index="sym", sort_by="price",
+                       cache_filters=True)
+        dt.apply_filters([RangeFilter("price", lower=10)])
+        dt.df.apply_order = None # rows must move without rebuilding the frame
+        dt.update_cells({"S40": {"price": 12.5}, "S11": {"price": 45.5},
+                         "S03": {"price": 20}})
+        expected = sorted(dt.df.index, key=lambda i: dt.df.get(i, "price"))
+        self.assertEqual(dt.df.index[:], expected)
+        self.assertEqual([ dt.position_to_index(p) for p in dt.filtered_rows ],
+                         [ i for i in expected if dt.df.get(i, "price") >= 10 ])
+        self.assertEqual([ dt.index_to_position(i) for i in expected ],
+                         list(range(len(expected))))
+
+
+class TestDataTableManualOrder(unittest.TestCase):
+
+    def setUp(self):
+
+        self.data = [ dict(a=i, b=i % 2) for i in range(6) ]
+        self.columns = [
+            DataTableColumn("a"),
+            DataTableColumn("b"),
+        ]
+
+    def shown(self, dt):
+        return [ dt.position_to_index(p) for p in dt.filtered_rows ]
+
+    def test_move_row(self):
+
+        dt = DataTable(self.columns, data=self.data, index="a", manual_order=True)
+        row = dt[4]
+        dt.move_row(4, 1)
+        self.assertEqual(self.shown(dt), [0, 4, 1, 2, 3, 5])
+        self.assertEqual(dt.df.index[:], list(range(6)))
+        self.assertIs(dt[1], row)
+        dt.move_row(0, 5)
+        self.assertEqual(self.shown(dt), [4, 1, 2, 3, 5, 0])
+
+    def test_move_to_top(self):
+
+        dt = DataTable(self.columns, data=self.data, index="a", manual_order=True)
+        dt.apply_filters([lambda row: row["b"] == 1])
+        dt.move_row(2, 0)
+        dt.move_row(2, 0)
+        self.assertEqual(self.shown(dt), [3, 5, 1])
+        dt.add_row(dict(a=7, b=1))
+        dt.add_row(dict(a=9, b=1))
+        dt.move_row(4, 0)
+        self.assertEqual(self.shown(dt), [9, 3, 5, 1, 7])
+        dt.clear_filters()
+        self.assertEqual(self.shown(dt), [9, 3, 5, 0, 1, 2, 4, 7])
+
+    def test_swap_rows(self):
+
+        dt = DataTable(self.columns, data=self.data, index="a", manual_order=True)
+        dt.swap_rows(0, 2)
+        self.assertEqual(self.shown(dt), [2, 1, 0, 3, 4, 5])
+        self.assertEqual(dt.df.get(0, "b"), 0)
+
+    def test_order_kept_across_filters(self):
+
+        dt = DataTable(self.columns, data=self.data, index="a", manual_order=True)
+        dt.apply_filters([lambda row: row["b"] == 0])
+        dt.move_row(2, 0)
+        dt.add_row(dict(a=6, b=0))
+        self.assertEqual(self.shown(dt), [4, 0, 2, 6])
+        dt.clear_filters()
+        self.assertEqual(self.shown(dt), [4, 0, 1, 2, 3, 5, 6])
+        dt.sort_by_column(("a", True))
+        self.assertEqual(self.shown(dt), [6, 5, 4, 3, 2, 1, 0])
+
+
+class TestDataTableBatch(unittest.TestCase):
+
+    def setUp(self):
+
+        self.data = [ dict(a=i, b=i % 3) for i in range(10) ]
+        self.columns = [
+            DataTableColumn("a"),
+            DataTableColumn("b"),
+        ]
+
+    def test_batch(self):
+
+        dt = DataTable(self.columns, data=self.data, index="a", sort_by="a")
+        dt.apply_filters([lambda row: row["b"] != 1])
+        calls = []
+        sort = dt.sort
+        dt.sort = lambda *args, **kwargs: (calls.append("sort"), sort(*args, **kwargs))
+        invalidate = dt.invalidate
+        dt.invalidate = lambda: (calls.append("invalidate"), invalidate())
+
+        with dt.batch():
+            for i in range(10, 20):
+                dt.add_row(dict(a=i, b=i % 3))
+            dt.add_row(dict(a=-1, b=0))
+            dt.toggle_columns("b")
+            self.assertEqual(len(dt), 7)
+
+        self.assertEqual(calls.count("sort"), 1)
+        self.assertEqual(len(dt), 14)
+        self.assertEqual(dt.position_to_index(dt.filtered_rows[0]), -1)
+        self.assertEqual(dt.position_to_index(dt.filtered_rows[-1]), 18)
+        self.assertTrue(dt.columns[1].hide)
+
+    def test_calculated_column(self):
+
+        self.columns.append(
+            DataTableColumn("c", value=lambda t, r: -r["a"]))
+        dt = DataTable(self.columns, data=self.data, index="a", sort_by="c")
+        dt.apply_filters([RangeFilter("c", upper=-12)])
+        with dt.batch():
+            for i in range(10, 15):
+                dt.add_row(dict(a=i, b=0))
+        self.assertEqual([ dt.df.get(i, "c") for i in range(10, 15) ],
+                         [-10, -11, -12, -13, -14])
+        self.assertEqual([ dt.position_to_index(p) for p in dt.filtered_rows ],
+                         [14, 13, 12])
+
+
+class TestDataTableTail(unittest.TestCase):
+
+    def setUp(self):
+
+        self.columns = [
+            DataTableColumn("a"),
+            DataTableColumn("level"),
+        ]
+
+    def test_capacity(self):
+
+        dt = DataTable(self.columns, data=[], index="a", tail=True, tail_capacity=5,
+                       secondary_indexes={"level": "hash"})
+        for i in range(8):
+            dt.add_row(dict(a=i, level="info"))
+        self.assertEqual(dt.df.index[:], [3, 4, 5, 6, 7])
+        self.assertEqual(len(dt), 5)
+        self.assertEqual(dt.focus_position, 4)
+        self.assertEqual(sorted(dt.df.secondary_index("level").equal("info")),
+                         [3, 4, 5, 6, 7])
+
+    def test_sorted(self):
+
+        dt = DataTable(self.columns, data=[], index="a", tail=True, tail_capacity=5)
+        for i in range(5):
+            dt.add_row(dict(a=i, level="info"))
+        dt.sort_by_column("a", True)
+        for i in range(5, 8):
+            dt.add_row(dict(a=i, level="info"))
+        self.assertEqual([ dt.position_to_index(p) for p in dt.filtered_rows ],
+                         [7, 6, 5, 4, 3])
+
+    def test_filtered_and_scrolled_away(self):
+
+        dt = DataTable(self.columns, data=[], index="a", tail=True, tail_capacity=6)
+        dt.apply_filters([lambda row: row["level"] == "error"])
+        dt.tail_rows([ dict(a=i, level="error" if i % 2 else "info")
+                       for i in range(6) ])
+        dt.focus_position = 1
+        dt.tail_rows([ dict(a=i, level="error" if i % 2 else "info")
+                       for i in range(6, 10) ])
+        self.assertEqual([ dt.position_to_index(p) for p in dt.filtered_rows ],
+                         [5, 7, 9])
+        self.assertEqual(dt.focus_position, 0)
+
+    def test_coalesced(self):
+
+        loop = FakeMainLoop()
+        dt = DataTable(self.columns, data=[], index="a", tail=True, tail_capacity=100,
+                       main_loop=loop)
+        for i in range(50):
+            dt.add_row(dict(a=i, level="info"))
+        self.assertEqual(len(dt), 0)
+        self.assertEqual(len(loop.alarms), 1)
+        loop.run_alarms()
+        self.assertEqual(len(dt), 50)
+        self.assertEqual(dt.focus_position, 49)
+
+
+class TestDataTablePostUpdates(unittest.TestCase):
+
+    def setUp(self):
+
+        self.columns = [
+            DataTableColumn("a"),
+            DataTableColumn("b"),
+        ]
+        self.data = [ dict(a=i, b=i * 10) for i in range(5) ]
+
+    def test_from_threads(self):
+
+        loop = FakeMainLoop()
+        dt = DataTable(self.columns, data=self.data, index="a", main_loop=loop)
+        threads = [
+            threading.Thread(target=dt.post_updates, args=(ops,))
+            for ops in (
+                [ ("insert", dict(a=5, b=50)), ("insert", dict(a=6, b=60)) ],
+                [ ("update", 1, dict(b=-1)) ],
+                [ ("delete", 0), ("delete", 0) ],
+            )
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(dt), 5)
+        self.assertTrue(dt._posted_signalled)
+        for callback in loop.callbacks:
+            callback(b"u")
+        self.assertFalse(dt._posted)
+        self.assertEqual(sorted(dt.df.index), [1, 2, 3, 4, 5, 6])
+        self.assertEqual(dt.df.get(1, "b"), -1)
+        self.assertEqual(len(dt), 6)
+
+    def post(self, dt, ops):
+        dt.post_updates(ops)
+        for callback in dt.main_loop.callbacks:
+            callback(b"u")
+
+    def test_order_preserved(self):
+
+        dt = DataTable(self.columns, data=self.data, index="a",
+                       main_loop=FakeMainLoop())
+        self.post(dt, [
+            ("delete", 2),
+            ("insert", dict(a=2, b=99)),
+            ("update", 3, dict(b=33)),
+            ("delete", 4),
+        ])
+        self.assertEqual(sorted(dt.df.index), [0, 1, 2, 3])
+        self.assertEqual(dt.df.get(2, "b"), 99)
+        self.assertEqual(dt.df.get(3, "b"), 33)
+
+    def test_update_unknown(self):
+
+        dt = DataTable(self.columns, data=self.data, index="a",
+                       main_loop=FakeMainLoop())
+        self.post(dt, [
+            ("update", 7, dict(b=70)),
+            ("insert", dict(a=8, b=80)),
+            ("update", 8, dict(b=88)),
+            ("delete", 1),
+            ("update", 1, dict(b=11)),
+        ])
+        self.assertEqual(sorted(dt.df.index), [0, 2, 3, 4, 8])
+        self.assertEqual(dt.df.get(8, "b"), 88)
+
+    def test_main_loop_required(self):
+
+        dt = DataTable(self.columns, data=self.data, index="a")
+        with self.assertRaises(Exception):
+            dt.post_updates([ ("delete", 0) ])
+        self.assertEqual(len(dt), 5)
+        # a main loop assigned later is used
+        dt.main_loop = FakeMainLoop()
+        self.post(dt, [ ("delete", 0) ])
+        self.assertEqual(sorted(dt.df.index), [1, 2, 3, 4])
+
+
+class TestDataTableRefresh(unittest.TestCase):
+
+    class PolledTable(DataTable):
+
+        index = "a"
+        columns = [
+            DataTableColumn("a"),
+            DataTableColumn("b"),
+        ]
+        sort_by = ("a", False)
+        results = []
+
+        def query(self, sort=None, offset=None, limit=None, load_all=False):
+            return [ dict(row) for row in self.results ]
+
+    def test_diff(self):
+
+        self.PolledTable.results = [ dict(a=i, b=i * 10) for i in range(6) ]
+        dt = self.PolledTable()
+        widgets = [ dt[i] for i in range(len(dt)) ]
+        dt.focus_position = 3
+
+        self.PolledTable.results = (
+            [ dict(a=i, b=i * 10) for i in (0, 2, 3, 5) ]
+            + [ dict(a=4, b=-4), dict(a=-1, b=0) ]
+        )
+        dt.refresh(diff=True)
+        self.assertEqual([ dt.position_to_index(p) for p in dt.filtered_rows ],
+                         [-1, 0, 2, 3, 4, 5])
+        self.assertEqual(dt.focus_position, 3)
+        self.assertIs(dt[1], widgets[0])
+        self.assertIs(dt[3], widgets[3])
+        self.assertIs(dt[5], widgets[5])
+        self.assertIs(dt[4], widgets[4])
+        self.assertEqual(dt.df.get(4, "b"), -4)
+
+    def test_filtered(self):
+
+        self.PolledTable.results = [ dict(a=i, b=i % 2) for i in range(6) ]
+        dt = self.PolledTable()
+        dt.apply_filters([lambda row: row["b"] == 1])
+        self.PolledTable.results = [ dict(a=i, b=i % 2) for i in range(1, 8) ]
+        dt.refresh(diff=True)
+        self.assertEqual([ dt.position_to_index(p) for p in dt.filtered_rows ],
+                         [1, 3, 5, 7])
+
+
+class TestDataTableQueryCache(unittest.TestCase):
+
+    class CountingTable(DataTable):
+
+        index = "a"
+        columns = [
+            DataTableColumn("a"),
+            DataTableColumn("b"),
+        ]
+        query_sort = True
+        limit = 10
+
+        def __init__(self, *args, **kwargs):
+            self.queries = []
+            super(TestDataTableQueryCache.CountingTable, self).__init__(*args, **kwargs)
+
+        def query(self, sort=None, offset=None, limit=None, load_all=False):
+            self.queries.append((sort, offset, limit))
+            rows = [ dict(a=i, b=-i) for i in range(30) ]
+            if sort and sort[0]:
+                rows.sort(key=lambda row: row[sort[0]], reverse=bool(sort[1]))
+            return rows[offset:offset+limit]
+
+        def query_result_count(self):
+            return 30
+
+    def test_sort_toggle(self):
+
+        dt = self.CountingTable(query_cache_size=4)
+        dt.sort_by_column("b")
+        dt.sort_by_column("a")
+        n = len(dt.queries)
+        dt.sort_by_column("b")
+        dt.sort_by_column("a")
+        self.assertEqual(len(dt.queries), n)
+        self.assertEqual(dt.position_to_index(dt.filtered_rows[0]), 0)
+
+        dt.invalidate_query_cache()
+        dt.sort_by_column("b")
+        self.assertEqual(len(dt.queries), n + 1)
+
+    def test_eviction(self):
+
+        cache = QueryPageCache(max_size=2)
+        cache.put(dict(offset=0), [1])
+        cache.put(dict(offset=10), [2])
+        cache.get(dict(offset=0))
+        cache.put(dict(offset=20), [3])
+        self.assertIn(dict(offset=0), cache)
+        self.assertNotIn(dict(offset=10), cache)
+        self.assertEqual(len(cache), 2)
+
+
+class TestDataTablePersistentCache(unittest.TestCase):
+
+    class SlowTable(DataTable):
+
+        index = "a"
+        columns = [
+            DataTableColumn("a"),
+            DataTableColumn("b"),
+        ]
+        results = []
+
+        def query(self, sort=None, offset=None, limit=None, load_all=False):
+            return [ dict(row) for row in self.results ]
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def test_startup(self):
+
+        self.SlowTable.results = [ dict(a=i, b=i) for i in range(3) ]
+        loop = FakeMainLoop()
+        dt = self.SlowTable(main_loop=loop, query_cache_path=self.path)
+        self.assertEqual(len(dt), 3)
+        self.assertIsNone(dt._reconcile_thread)
+
+        self.SlowTable.results = [ dict(a=i, b=-i) for i in range(1, 5) ]
+        loop = FakeMainLoop()
+        dt = self.SlowTable(main_loop=loop, query_cache_path=self.path)
+        # the cached rows are shown until the fresh query comes back
+        self.assertEqual(sorted(dt.df.index), [0, 1, 2])
+        dt._reconcile_thread.join()
+        for callback in loop.callbacks:
+            callback(b"r")
+        self.assertEqual(sorted(dt.df.index), [1, 2, 3, 4])
+        self.assertEqual(dt.df.get(2, "b"), -2)
+
+        dt = self.SlowTable(main_loop=FakeMainLoop(), query_cache_path=self.path)
+        self.assertEqual(sorted(dt.df.index), [1, 2, 3, 4])
+        dt._reconcile_thread.join()
+
+    def test_stale_result(self):
+
+        self.SlowTable.results = [ dict(a=i, b=i) for i in range(3) ]
+        self.SlowTable(main_loop=FakeMainLoop(), query_cache_path=self.path)
+        loop = FakeMainLoop()
+        dt = self.SlowTable(main_loop=loop, query_cache_path=self.path)
+        dt._reconcile_thread.join()
+        # refreshed before the background result was merged
+        self.SlowTable.results = [ dict(a=i, b=i) for i in range(5) ]
+        dt.refresh(diff=True)
+        for callback in loop.callbacks:
+            callback(b"r")
+        self.assertEqual(sorted(dt.df.index), [0, 1, 2, 3, 4])
+
+    def test_sql(self):
+
+        db = sqlite3.connect(":memory:")
+        db.execute("CREATE TABLE t (a INTEGER PRIMARY KEY, b INTEGER)")
+        db.executemany("INSERT INTO t VALUES (?, ?)", [ (i, i) for i in range(3) ])
+        make_table = lambda loop: SQLDataTable(
+            db, "SELECT * FROM t", columns=self.SlowTable.columns, index="a",
+            main_loop=loop, query_cache_path=self.path
+        )
+        make_table(FakeMainLoop())
+        db.execute("DELETE FROM t WHERE a = 0")
+        loop = FakeMainLoop()
+        dt = make_table(loop)
+        self.assertEqual(sorted(dt.df.index), [0, 1, 2])
+        # queried from the main loop, on the connection's own thread
+        self.assertIsNone(dt._reconcile_thread)
+        loop.run_alarms()
+        self.assertEqual(sorted(dt.df.index), [1, 2])
+
+
+class TestDataTableQueryCursor(unittest.TestCase):
+
+    class KeysetTable(DataTable):
+
+        index = "a"
+        columns = [
+            DataTableColumn("a"),
+            DataTableColumn("b"),
+        ]
+        query_sort = True
+        query_cursor = True
+        limit = 4
+        with_scrollbar = True
+
+        def __init__(self, *args, **kwargs):
+            self.cursors = []
+            super(TestDataTableQueryCursor.KeysetTable, self).__init__(*args, **kwargs)
+
+        def query(self, sort=None, offset=None, limit=None, load_all=False, after=None):
+            self.cursors.append(after)
+            column = sort[0] or "a"
+            key = lambda row: (row[column], row["a"])
+            rows = sorted([ dict(a=i, b=i % 3) for i in range(10) ], key=key)
+            if after is not None:
+                rows = [ row for row in rows if key(row) > after ]
+            return rows[:limit]
+
+        def query_result_count(self):
+            return 10
+
+    def test_pages(self):
+
+        dt = self.KeysetTable(sort_by="b")
+        dt.load_more()
+        dt.load_more()
+        self.assertEqual(dt.cursors[-3:], [None, (0, 9), (2, 2)])
+        self.assertEqual(sorted(dt.df.index), list(range(10)))
+        self.assertEqual(dt.query_cursors[dt.sort_by], (2, 8))
+
+
+class TestSQLDataTable(unittest.TestCase):
+
+    def setUp(self):
+
+        self.db = sqlite3.connect(":memory:")
+        self.db.execute("CREATE TABLE hosts (id INTEGER PRIMARY KEY, name TEXT, load REAL, up INTEGER)")
+        self.db.executemany(
+            "INSERT INTO hosts VALUES (?, ?, ?, ?)",
+            [ (i, "host%02d" %(i), (i * 7) % 10, i % 4 != 0) for i in range(1, 31) ]
+        )
+        self.columns = [
+            DataTableColumn("id"),
+            DataTableColumn("name"),
+            DataTableColumn("load"),
+            DataTableColumn("double", value=lambda t, r: r["load"] * 2),
+        ]
+
+    def make_table(self, **kwargs):
+        return SQLDataTable(
+            self.db, "SELECT * FROM hosts WHERE up = ?", (1,),
+            columns=self.columns, index="id", limit=5, with_scrollbar=True,
+            **kwargs
+        )
+
+    def loaded(self, dt):
+        return [ dt.position_to_index(p) for p in dt.filtered_rows ]
+
+    def test_paging(self):
+
+        expected = [ r[0] for r in self.db.execute(
+            "SELECT id FROM hosts WHERE up = 1 ORDER BY load DESC, id DESC") ]
+        for cursor in (True, False):
+            dt = self.make_table(sort_by=("load", True), query_cursor=cursor)
+            self.assertEqual(dt.query_result_count(), 23)
+            while len(dt) < dt.query_result_count():
+                dt.load_more()
+            self.assertEqual(self.loaded(dt), expected)
+            self.assertNotIn("up", dt.df.columns)
+            self.assertEqual(dt.df.get(expected[0], "double"), 18)
+
+    def test_paging_nulls(self):
+
+        self.db.execute("UPDATE hosts SET load = NULL WHERE id % 3 = 0")
+        self.columns = self.columns[:3]
+        rows = list(self.db.execute("SELECT id, load FROM hosts WHERE up = 1"))
+        values = sorted([ r for r in rows if r[1] is not None ], key=lambda r: (r[1], r[0]))
+        nulls = sorted(r for r in rows if r[1] is None)
+        for reverse in (False, True):
+            expected = [ r[0] for r in
+                         ((values + nulls)[::-1] if reverse else values + nulls) ]
+            for cursor in (True, False):
+                dt = self.make_table(sort_by=("load", reverse), query_cursor=cursor)
+                while len(dt) < dt.query_result_count():
+                    dt.load_more()
+                self.assertEqual(self.loaded(dt), expected)
+
+    def test_substring_not_pushed(self):
+
+        dt = self.make_table()
+        self.assertFalse(dt.supports_query_filters([SubstringFilter("name", "host")]))
+        dt.apply_filters([SubstringFilter("name", "HOST0")])
+        self.assertIsNone(dt.pushed_filters)
+        while len(dt.df) < dt.query_result_count():
+            dt.load_more()
+        self.assertEqual(sorted(dt.position_to_index(p) for p in dt.filtered_rows),
+                         [1, 2, 3, 5, 6, 7, 9])
+
+    def test_count_cached(self):
+
+        dt = self.make_table()
+        self.assertEqual(dt.query_result_count(), 23)
+        self.db.execute("UPDATE hosts SET up = 1")
+        self.assertEqual(dt.query_result_count(), 23)
+        dt.refresh(diff=True)
+        self.assertEqual(dt.query_result_count(), 30)
+
+
+class TestSQLiteDataTable(unittest.TestCase):
+
+    def setUp(self):
+
+        self.columns = [
+            DataTableColumn("id"),
+            DataTableColumn("n"),
+            DataTableColumn("name"),
+        ]
+        self.data = [ dict(id=i, n=i % 50, name="Row%d" %(i)) for i in range(2000) ]
+
+    def make_table(self, **kwargs):
+        return SQLiteDataTable(data=self.data, columns=self.columns, index="id",
+                               limit=100, with_scrollbar=True, **kwargs)
+
+    def test_window(self):
+
+        dt = self.make_table(sort_by=("n", True))
+        self.assertEqual(len(dt), 100)
+        self.assertEqual(len(dt.df), 100)
+        self.assertEqual(dt.query_result_count(), 2000)
+        self.assertEqual(dt.df.get(dt.position_to_index(0), "n"), 49)
+        self.assertIn("datatable_n", [ r[0] for r in dt.connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'") ])
+
+    def test_filter_pushdown(self):
+
+        dt = self.make_table()
+        dt.apply_filters([RangeFilter("n", 10, 11), SubstringFilter("name", "ROW1")])
+        self.assertEqual(dt.pushed_filters[0], RangeFilter("n", 10, 11))
+        self.assertEqual(dt.filters, dt.pushed_filters)
+        self.assertEqual(dt.query_result_count(), 46)
+        self.assertEqual(len(dt), 46)
+
+        dt.sort_by_column("id", True)
+        self.assertEqual(len(dt), 46)
+        self.assertEqual(dt.position_to_index(dt.filtered_rows[0]), 1961)
+
+        dt.apply_filters([lambda row: row["n"] == 0])
+        self.assertIsNone(dt.pushed_filters)
+        self.assertEqual(len(dt), 2)
+
+        dt.clear_filters()
+        self.assertEqual(len(dt), 100)
+        self.assertEqual(dt.query_result_count(), 2000)
+
+    def test_paging_nulls(self):
+
+        # few enough nulls that they share a page with values either way
+        for row in self.data[::70]:
+            row["n"] = None
+        values = sorted((r for r in self.data if r["n"] is not None),
+                        key=lambda r: (r["n"], r["id"]))
+        nulls = [ r for r in self.data if r["n"] is None ]
+        for reverse in (False, True):
+            expected = [ r["id"] for r in
+                         ((values + nulls)[::-1] if reverse else values + nulls) ]
+            dt = self.make_table(sort_by=("n", reverse))
+            while len(dt) < dt.query_result_count():
+                dt.load_more()
+            self.assertEqual([ dt.position_to_index(p) for p in dt.filtered_rows ],
+                             expected)
+
+    def test_max_pages(self):
+
+        expected = [ r["id"] for r in sorted(self.data, key=lambda r: (r["n"], r["id"])) ]
+        for cursor in (True, False):
+            dt = self.make_table(sort_by="n", max_pages=3, query_cursor=cursor)
+            for page in range(5):
+                dt.load_more()
+            self.assertEqual(len(dt.df), 300)
+            self.assertEqual((dt.first_page, dt.page), (3, 6))
+            self.assertEqual(dt.df.index[:], expected[300:600])
+
+            dt.focus_position = 0
+            dt.load_previous()
+            self.assertEqual(dt.df.index[:], expected[200:500])
+            self.assertEqual(dt.position_to_index(dt.filtered_rows[dt.focus_position]),
+                             expected[300])
+            dt.load_more()
+            self.assertEqual(dt.df.index[:], expected[300:600])
+
+            dt.refresh(diff=True)
+            self.assertEqual(dt.df.index[:], expected[300:600])
+            dt.load_all()
+            self.assertEqual(dt.df.index[:], expected)
+
+    def test_unicode_case(self):
+
+        self.data[:3] = [ dict(id=0, n=0, name="ÉCOLE"),
+                          dict(id=1, n=0, name="Straße"),
+                          dict(id=2, n=0, name="école") ]
+        dt = self.make_table()
+        f = SubstringFilter("name", "éco")
+        dt.apply_filters([f])
+        self.assertEqual(dt.pushed_filters, [f])
+        self.assertEqual(sorted(dt.df.index), [0, 2])
+        self.assertEqual(
+            sorted(dt.df.index),
+            [ r["id"] for r in self.data if f(r) ]
+        )
+        with self.assertRaises(sqlite3.IntegrityError):
+            dt.insert_rows([ dict(id=None, n=0, name="none") ])
+
+    def test_insert(self):
+
+        dt = self.make_table()
+        dt.insert_rows([ dict(id=-1, n=0, name="first"), dict(id=5, n=0, name="five") ])
+        self.assertEqual(dt.query_result_count(), 2001)
+        self.assertEqual(dt.position_to_index(dt.filtered_rows[0]), -1)
+        self.assertEqual(dt.df.get(5, "name"), "five")
+
+
+@unittest.skipIf(np is None, "numpy not installed")
+class TestArrayDataTable(unittest.TestCase):
+
+    def setUp(self):
+
+        self.columns = [
+            DataTableColumn("n"),
+            DataTableColumn("name"),
+            DataTableColumn("double", value=lambda t, r: r["n"] * 2),
+        ]
+        self.arrays = dict(
+            n = np.arange(1000) % 7,
+            name = np.array([ "row%d" %(i) for i in range(1000) ], dtype=object),
+        )
+
+    def test_arrays(self):
+
+        dt = ArrayDataTable(self.arrays, columns=self.columns, index="id",
+                            limit=50, with_scrollbar=True, sort_by=("n", True))
+        self.assertEqual(len(dt.df), 50)
+        self.assertEqual(dt.query_result_count(), 1000)
+        self.assertEqual(dt.df.get(dt.position_to_index(0), "n"), 6)
+        self.assertEqual(dt.df.get(dt.position_to_index(0), "double"), 12)
+
+        dt.apply_filters([RangeFilter("n", 1, 2), SubstringFilter("name", "ROW99")])
+        self.assertEqual(dt.pushed_filters[1], SubstringFilter("name", "ROW99"))
+        self.assertEqual(dt.query_result_count(), 3)
+        self.assertEqual(sorted(dt.df.index), [99, 995, 996])
+
+        dt.clear_filters()
+        self.assertEqual(dt.query_result_count(), 1000)
+
+    def test_numpy_only(self):
+
+        # the code paths taken when pandas isn't installed
+        import panwid.datatable.frame as frame
+        frame.import_arrays()
+        pandas, frame.pd = frame.pd, None
+        try:
+            source = ArraySource(dict(
+                n = np.array([2, 1, 2, 1, 2]),
+                x = np.array([1.5, np.nan, 0.5, np.nan, 1.5]),
+                s = np.array(["b", None, "a", "b", None], dtype=object),
+            ), "id")
+            self.assertEqual(source.select(("n", True)).tolist(), [0, 2, 4, 1, 3])
+            self.assertEqual(source.select(("x", True)).tolist(), [1, 3, 0, 4, 2])
+            self.assertEqual(source.select(("s", True)).tolist(), [1, 4, 0, 3, 2])
+            self.assertEqual(source.select(("s", False)).tolist(), [2, 0, 3, 1, 4])
+            self.assertEqual(
+                source.select(filters=[EqualsFilter("x", None)]).tolist(), [1, 3])
+            self.assertEqual(
+                source.rows(source.page(source.select(("n", False)), 0, 2), ["id", "n"]),
+                [ dict(id=1, n=1), dict(id=3, n=1) ])
+        finally:
+            frame.pd = pandas
+
+    @unittest.skipIf(pd is None, "pandas not installed")
+    def test_pandas(self):
+
+        frame = pd.DataFrame(self.arrays)
+        frame.index.name = "id"
+        dt = ArrayDataTable(frame, columns=self.columns, index="id",
+                            limit=50, with_scrollbar=True, sort_by="n")
+        dt.apply_filters([EqualsFilter("n", 3)])
+        self.assertEqual(dt.query_result_count(), 143)
+        self.assertEqual(dt.df.index[:3], [3, 10, 17])
+
+
+@unittest.skipIf(pa is None, "pyarrow not installed")
+class TestArrowDataTable(unittest.TestCase):
+
+    def setUp(self):
+
+        fd, self.path = tempfile.mkstemp(suffix=".arrow")
+        os.close(fd)
+        schema = pa.schema([("n", pa.int64()), ("name", pa.string()), ("extra", pa.int64())])
+        with pa.OSFile(self.path, "wb") as sink:
+            with pa.ipc.new_file(sink, schema) as writer:
+                for b in range(4):
+                    ids = range(b * 250, (b+1) * 250)
+                    writer.write_batch(pa.record_batch([
+                        pa.array([ i % 7 for i in ids ], type=pa.int64()),
+                        pa.array([ "row%d" %(i) for i in ids ]),
+                        pa.array(list(ids), type=pa.int64()),
+                    ], schema=schema))
+        self.columns = [
+            DataTableColumn("n"),
+            DataTableColumn("name"),
+        ]
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def test_window(self):
+
+        dt = ArrowDataTable(self.path, columns=self.columns, index="id",
+                            limit=100, with_scrollbar=True)
+        self.assertEqual(dt.query_result_count(), 1000)
+        self.assertEqual(len(dt.df), 100)
+        self.assertNotIn("extra", dt.df.columns)
+        dt.load_more()
+        dt.load_more()
+        self.assertEqual(dt.df.get(249, "name"), "row249")
+        self.assertEqual(dt.df.get(250, "name"), "row250")
+
+    def test_max_pages(self):
+
+        dt = ArrowDataTable(self.path, columns=self.columns, index="id",
+                            limit=100, with_scrollbar=True, max_pages=2)
+        for page in range(4):
+            dt.load_more()
+        self.assertEqual(len(dt.df), 200)
+        self.assertEqual(dt.df.index[:], list(range(300, 500)))
+        dt.load_previous()
+        self.assertEqual(dt.df.index[:], list(range(200, 400)))
+
+    def test_sort_and_filter(self):
+
+        dt = ArrowDataTable(self.path, columns=self.columns, index="id",
+                            limit=100, with_scrollbar=True, sort_by=("n", True))
+        self.assertEqual(dt.df.get(dt.position_to_index(0), "n"), 6)
+        dt.apply_filters([RangeFilter("n", 1, 2), SubstringFilter("name", "ROW99")])
+        self.assertEqual(dt.query_result_count(), 3)
+        self.assertEqual(sorted(dt.df.index), [99, 995, 996])
+
+    def test_descending_ties(self):
+
+        source = ArrowSource(self.path, "id")
+        order = source.select(("n", True)).to_pylist()
+        source.close()
+        self.assertTrue(source.file.closed)
+        self.assertEqual(order[:3], [6, 13, 20])
+        self.assertEqual(order[-3:], [980, 987, 994])
+
+    def test_mismatched_filter(self):
+
+        with ArrowDataTable(self.path, columns=self.columns, index="id",
+                            limit=100, with_scrollbar=True) as dt:
+            dt.apply_filters([EqualsFilter("name", 5)])
+            self.assertEqual(dt.query_result_count(), 0)
+            dt.apply_filters([IsInFilter("n", ["3", 4])])
+            self.assertEqual(dt.query_result_count(), 143)
+        self.assertTrue(dt.source.file.closed)